@@ -1,14 +1,29 @@
+import hashlib
+import json
 import streamlit as st
-import pandas as pd
-from scripts.utils import cargar_config
-from scripts.utils import create_grupped_df
-from scripts.utils import valores_atipicos
-from scripts.utils import calculo_variaciones
-from scripts.utils import creacion_graficos
-from scripts.utils import agrupaciones_calculos
-from scripts.utils import cargar_datos
+from scripts.configuracion import cargar_config
+from scripts.almacen_ventas import abrir_almacen
+from scripts import validacion
+from scripts import diagnostico
+from scripts.diagnostico import etapa
+from scripts.carga_diferida import modulo_diferido
+
+# pandas, plotly, pyarrow y los modulos de analisis se importan con su primer uso,
+# la pantalla inicial no los espera
+pd = modulo_diferido('pandas')
+utils = modulo_diferido('scripts.utils')
+cache_datos = modulo_diferido('scripts.cache_datos')
+registro = modulo_diferido('scripts.registro_datos')
+formato_tablas = modulo_diferido('scripts.formato_tablas')
+exportar = modulo_diferido('scripts.exportar')
+cubo_ventas = modulo_diferido('scripts.cubo_ventas')
+variaciones = modulo_diferido('scripts.variaciones')
+analisis = modulo_diferido('scripts.analisis')
+dimensiones = modulo_diferido('scripts.dimensiones')
 
 config = cargar_config() # archivo de configuración
+# excel o formatos columnares (ver scripts.columnar, se leen mucho mas rapido que el excel)
+TIPOS_ARCHIVO = ["xlsx", "xls", "parquet", "arrow", "feather", "csv"]
 
 def configurar_pagina():
     """Configura el estilo y apariencia de la página"""
@@ -87,25 +102,42 @@ def sidebar_carga_archivos():
         
         # archivo de balance score
         st.markdown("#### Balanced Scored")
-        balanced_score = st.file_uploader("Seleccione el primer archivo Excel", type=["xlsx", "xls"], key="balanced_score")
-        
+        # varios archivos (ej. uno por mes o por region) se leen en paralelo y se concatenan
+        archivos_balance = st.file_uploader("Seleccione el primer archivo Excel (o varios)", type=TIPOS_ARCHIVO,
+                                            key="balanced_score", accept_multiple_files=True)
+        balanced_score = None
+        # validacion previa: solo el encabezado y una muestra de cada archivo
+        errores_balance = [f"{archivo.name}: {error}" for archivo in archivos_balance or []
+                           for error in validar_archivo(archivo, validacion.validar_balance)]
+        if errores_balance:
+            st.error("El balanced score no es valido:\n\n" + "\n\n".join(f"- {error}" for error in errores_balance))
+            st.session_state.balance_cargado = False
+        elif archivos_balance:
+            balanced_score = archivos_balance[0] if len(archivos_balance) == 1 else archivos_balance
+
         if balanced_score is not None:
             try:
                 #df1 = pd.read_excel(balanced_score)
                 st.session_state.df_balance = balanced_score
                 st.session_state.balance_cargado = True
-                st.success(f"✅ balanced_score cargado exitosamente: {balanced_score.name}")
+                st.success(f"✅ balanced_score cargado exitosamente: {', '.join(archivo.name for archivo in archivos_balance)}")
             except Exception as e:
                 st.error(f"Error al cargar el archivo 1: {e}")
-                st.session_state.balance_cargado = False
-        else:
+                balanced_score = None
+        elif not errores_balance:
             st.warning("⚠️ El balanced_score aún no ha sido cargado")
+
+        historico_mensual(balanced_score)
         
         # Carga arhcivo margen.
         st.markdown("#### Margen")
-        archivo_margen = st.file_uploader("Seleccione el segundo archivo Excel", type=["xlsx", "xls"], key="Margen")
+        archivo_margen = st.file_uploader("Seleccione el segundo archivo Excel", type=TIPOS_ARCHIVO, key="Margen")
+        errores_margen = validar_archivo(archivo_margen, validacion.validar_margen) if archivo_margen is not None else []
         
-        if archivo_margen is not None:
+        if errores_margen:
+            st.error("El archivo de margen no es valido:\n\n" + "\n\n".join(f"- {error}" for error in errores_margen))
+            st.session_state.margen_cargado = False
+        elif archivo_margen is not None:
             try:          
                 st.session_state.df_margen = archivo_margen
                 st.session_state.margen_cargado = True
@@ -128,6 +160,51 @@ def sidebar_carga_archivos():
         st.markdown(estado_archivos)
         st.markdown('</div>', unsafe_allow_html=True)
 
+def validar_archivo(archivo, validar):
+    """
+    Valida el archivo cargado con una funcion de scripts.validacion, una sola vez por archivo cargado.
+    return: list de errores
+    """
+    validaciones = st.session_state.setdefault('validaciones', {})
+    clave = (validar.__name__, getattr(archivo, 'file_id', None) or getattr(archivo, 'name', str(archivo)))
+    if clave not in validaciones:
+        validaciones[clave] = validar(archivo, config)
+    return validaciones[clave]
+
+def nombre_archivos(archivos):
+    """
+        Nombre del archivo cargado o de los archivos separados por coma.
+    """
+    if isinstance(archivos, (list, tuple)):
+        return ', '.join(archivo.name for archivo in archivos)
+    return archivos.name
+
+def historico_mensual(balanced_score):
+    """
+        Permite agregar el archivo cargado al historico mensual (solo se procesan los meses
+        del archivo) y analizar el historico completo en lugar del archivo.
+    """
+    almacen = abrir_almacen(config)
+    with st.expander("Histórico mensual"):
+        if balanced_score is not None and st.button("Agregar archivo al histórico"):
+            df_mes = leer_balance(balanced_score)
+            if df_mes is None or isinstance(df_mes, str):
+                st.error(f"No fue posible agregar el archivo: {df_mes}")
+            else:
+                df_mes, _ = utils.preprocess_dataframe(df_mes, config)
+                actualizados = almacen.agregar_mes(df_mes, origen=nombre_archivos(balanced_score))
+                if isinstance(actualizados, str):
+                    st.error(actualizados)
+                else:
+                    st.success(f"✅ Meses agregados al histórico: {', '.join(actualizados)}")
+
+        meses = almacen.meses()
+        st.write(f"Meses en el histórico: {', '.join(meses) if meses else 'ninguno'}")
+        st.checkbox("Analizar el histórico completo", key="usar_historico", disabled=not meses)
+        # en cada ejecucion: hay balance si se cargo un archivo valido o si se analiza el historico
+        usar_historico = bool(st.session_state.get("usar_historico") and meses)
+        st.session_state.balance_cargado = balanced_score is not None or usar_historico
+
 def contenido_principal():
     """
         Gestiona el contenido principal de la aplicación
@@ -199,8 +276,11 @@ def contenido_principal():
             'venta_un_ant': [100, 200, 150, 300],
             'venta_un_act': [120, 180, 165, 330]
         }
-        example_df = pd.DataFrame(example_data)
-        st.dataframe(example_df, use_container_width=True)
+        # tabla en markdown: st.dataframe convierte los datos con pandas y lo importaria antes de la primera pantalla
+        filas_ejemplo = zip(*example_data.values())
+        st.markdown("\n".join(["| " + " | ".join(example_data) + " |",
+                               "|" + " --- |" * len(example_data)]
+                              + ["| " + " | ".join(str(valor) for valor in fila) + " |" for fila in filas_ejemplo]))
 
     # Botón para continuar (siempre visible, pero deshabilitado si no están los archivos)
     col1, col2, col3 = st.columns([1, 2, 1])
@@ -210,12 +290,85 @@ def contenido_principal():
             disabled=not ambos_archivos_cargados
         )
 
-    # Acción al presionar el botón
-    if boton_continuar:
+    # Acción al presionar el botón, la vista se mantiene en las siguientes interacciones
+    if boton_continuar or (ambos_archivos_cargados and st.session_state.get('vista_actual') == 'general'):
         st.success("¡Ambos archivos están cargados! Presione 'CONTINUAR' para avanzar con el análisis.")
         mostrar_vista_analisis() # analisis general de las ventas.  
         # Mostrar información cuando se presione el botón continuar
 
+def clave_datos(df_balance, usar_historico):
+    """
+    Identificador del conjunto de datos en analisis: el contenido del archivo cargado
+    o los meses guardados del historico.
+    """
+    if usar_historico:
+        manifiesto = json.dumps(abrir_almacen(config).manifiesto(), sort_keys=True)
+        return f"historico_{hashlib.blake2b(manifiesto.encode('utf-8'), digest_size=10).hexdigest()}"
+    return cache_datos.clave_cache(df_balance, config, cache_datos.SECCIONES_BALANCE)
+
+def memo_datos(nombre, funcion):
+    """
+    Calcula funcion una sola vez por conjunto de datos (ver clave_datos) y guarda
+    el resultado en la sesion, si cambia el conjunto de datos se descartan los resultados.
+    """
+    memo = st.session_state.setdefault('memo_datos', {})
+    clave = st.session_state.get('clave_datos')
+    if memo.get('clave') != clave:
+        memo.clear()
+        memo['clave'] = clave
+    if nombre not in memo:
+        memo[nombre] = funcion()
+    return memo[nombre]
+
+@st.cache_resource
+def registro_compartido():
+    """
+    Registro de datos del proceso, compartido por todas las sesiones (ver scripts.registro_datos).
+    """
+    return registro.registro_datos((config.get('registro') or {}).get('limite_mb', 4096))
+
+def datos_compartidos(nombre, clave, funcion_carga):
+    """
+    Retorna los datos de la llave desde el registro compartido, la sesion solo guarda la referencia.
+    Los datos compartidos no se deben modificar.
+    ARG: nombre: str nombre de la referencia en la sesion (ej. 'cubo', 'margen')
+        clave: str llave del contenido
+        funcion_carga: funcion sin argumentos que carga los datos si no estan en el registro
+    """
+    referencias = st.session_state.setdefault('referencias_datos', {})
+    referencia = referencias.get(nombre)
+    if referencia is None or referencia.clave != clave:
+        referencia = registro_compartido().adquirir(clave, funcion_carga)
+        if not isinstance(referencia, registro.referencia_datos):
+            referencias.pop(nombre, None)
+            return referencia  # advertencia de lectura, no se registra
+        referencias[nombre] = referencia  # la referencia anterior se libera
+    return referencia.datos
+
+def leer_balance(archivo):
+    """
+    Lee el archivo del balanced score segun balanced_score_columnas, usando el cache en disco
+    para no volver a leer el excel en cada interaccion.
+    return: data frame o str con la advertencia de columnas faltantes
+    """
+    return cache_datos.cargar_con_cache(archivo, config, cache_datos.SECCIONES_BALANCE,
+                            lambda: analisis.leer_balance(archivo, config))
+
+def obtener_cubo(archivo):
+    """
+    Retorna el cubo de ventas del archivo del balanced score (ver scripts.cubo_ventas).
+    El cubo se guarda en el cache en disco, de esta forma se construye una sola vez por archivo.
+    return: data frame o str con la advertencia de columnas faltantes
+    """
+    def construir():
+        balance = leer_balance(archivo)
+        if balance is None or isinstance(balance, str):
+            return balance
+        balance, _ = utils.preprocess_dataframe(balance, config)
+        return cubo_ventas.construir_cubo(balance)
+
+    return cache_datos.cargar_con_cache(archivo, config, cache_datos.SECCIONES_BALANCE, construir, nombre='cubo')
+
 def mostrar_vista_analisis():
     """Vista principal para mostrar resumen y gráficos tras cargar los archivos"""
 
@@ -230,221 +383,201 @@ def mostrar_vista_analisis():
 
     st.title("Vista de Análisis de Datos")
 
+    usar_historico = st.session_state.get("usar_historico", False)
     df_balance = st.session_state.get("df_balance")
     df_margen = st.session_state.get("df_margen")
 
-    if df_balance is not None and df_margen is not None:
+    if (df_balance is not None or usar_historico) and df_margen is not None:
 
-
-        # Leer y procesar los archivos
-        col_usar = config['balanced_score_columnas'].keys()
-        tipado_col = {nomcol: tipo[0]  for nomcol, tipo in config['balanced_score_columnas'].items()}
-
-        columnas_fecha = config['columnas_fechas'][0]       
-       
-        nombre_col = [tipo[1] for tipo in config['balanced_score_columnas'].values()]
-        balance = cargar_datos(df_balance,margen=False, 
-                               col_usar = col_usar,
-                               tipado_col=tipado_col,
-                               parse = columnas_fecha,
-                               nom_columnas = nombre_col)      
+        # Leer y procesar los archivos (el historico mensual o el archivo cargado),
+        # todas las tablas y graficos se calculan sobre el cubo de ventas
+        # (una sola copia en memoria por archivo, compartida entre las sesiones)
+        with etapa('carga cubo de ventas') as medicion:
+            clave = clave_datos(df_balance, usar_historico)
+            if usar_historico:
+                cubo = datos_compartidos('cubo', f"cubo_{clave}", lambda: abrir_almacen(config).leer_agregados())
+            else:
+                cubo = datos_compartidos('cubo', f"cubo_{clave}", lambda: obtener_cubo(df_balance))
+            medicion.filas = len(cubo) if isinstance(cubo, pd.DataFrame) else None
       
-        if isinstance(balance, str):
-             st.info(balance)
+        if cubo is None or isinstance(cubo, str):
+             st.info(cubo if cubo is not None else "No fue posible leer el balanced score")
+             return
         
         # realizando transformacion para el poner el nombre de los meses        
-        mg_sector,mg_marca,mg_material = cargar_datos(df_margen,margen=True)
-
-        
-        #Guardando en la session state los dataframes
-        st.session_state.df2_balance = balance
-        st.session_state.df_margen = mg_sector
-        st.session_state.mg_marca = mg_marca
-        st.session_state.mg_material = mg_material
-
-
-        # realiazando limpiza del data frame balance
-        #try:
-        filtros = config['filtros']
-        for key,value in  filtros.items(): ## ciclo para filtrar valores segun la parametrizacion en el archivo de config
-            for valor in value:
-                balance = balance[balance[key] != valor]
-        
-        valores_nulos = config['balanced_score_fill']
-        for key,value in valores_nulos.items(): # ciclo para completar informacion nula con 0
-            if key == 'borrar_na':
-                    for columna in value:
-                        balance = balance.dropna(subset=[columna])
-            else:
-                    for columna in value:
-                        balance[columna] = balance[columna].fillna(0)
-        #except:
-        #   st.warning("No se ha filtrado ningún tipo de información!")
+        with etapa('carga margen'):
+            clave_margen = cache_datos.clave_cache(df_margen, config, cache_datos.SECCIONES_MARGEN)
+            mg_sector,mg_marca,mg_material = datos_compartidos(
+                'margen', f"margen_{clave_margen}",
+                lambda: cache_datos.cargar_con_cache(df_margen, config, cache_datos.SECCIONES_MARGEN,
+                                         lambda: utils.cargar_datos(df_margen,margen=True)))
+        # los resultados guardados con memo_datos dependen del balanced score y del margen
+        st.session_state.clave_datos = f"{clave}_{clave_margen}"
+
+
+        # resumen de la limpieza del balance segun filtros y balanced_score_fill del config
+        reporte_limpieza = cubo.attrs.get('reporte_limpieza', {})
+        filas_analisis = int(cubo['filas'].sum())
+        filas_iniciales = filas_analisis + sum(reporte_limpieza.values())
+        with st.expander("Resumen de limpieza de datos"):
+            st.write(f"Registros iniciales: {filas_iniciales:,} - registros para el análisis: {filas_analisis:,}")
+            st.dataframe(pd.DataFrame({'regla': list(reporte_limpieza.keys()),
+                                       'registros_eliminados': list(reporte_limpieza.values())}),
+                         hide_index=True)
+
+        # negocios, marcas y materiales con ventas y sin margen (y claves del margen sin ventas)
+        cruces = memo_datos('cruces_margen',
+                            lambda: analisis.cruces_margen(modelo_dimensional(cubo), mg_sector, mg_marca, mg_material))
+        with st.expander("Cruce de ventas con el margen"):
+            if cruces['claves_sin_cruce'].sum():
+                st.warning("Hay ventas sin margen, sus margenes quedan vacios en las tablas")
+            st.dataframe(formato_tablas.aplicar_formatos(cruces, {'ventas_sin_cruce': 'millones',
+                                                                  '%_ventas_sin_cruce': 'porcentaje'}))
+
+        # cada seccion se calcula solo cuando se abre y queda guardada para el conjunto de datos
+        secciones = {
+            'Tendencia por negocio': lambda: seccion_tendencia_negocio(cubo),
+            'Margen por negocio': lambda: seccion_margen_negocio(mg_sector),
+            'Métricas por negocio': lambda: seccion_metricas_negocio(cubo, mg_sector),
+            'Ventas promedio por marca': lambda: seccion_promedio_marca(cubo),
+            'Variaciones por marca': lambda: seccion_variaciones_marca(cubo, mg_marca),
+            'Margen por marca (atípicos)': lambda: seccion_atipicos_marca(cubo, mg_marca),
+        }
+        seccion = st.radio("Sección del análisis", list(secciones), horizontal=True, key="seccion_analisis")
+        with etapa(f"seccion {seccion}"):
+            secciones[seccion]()
      
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col2:
+            boton_continuar_producto = st.button(
+            "CONTINUAR CON EL ANALISIS POR PRODUCTO",         
+            on_click=cambiar_a_analisis_producto)
+      
+
+def seccion_tendencia_negocio(cubo):
+    """Grafico de lineas de ventas por negocio y mes"""
+    def calcular():
         # agrupando variables de mes y negocio y sumando las ventas
-        #try:
         variables = config['agrupaciones']['agrupa_a']
-
-        balance['mes_agrupado'] = balance['mes'].dt.to_period('M').dt.to_timestamp()
-        df_mes_negocio = create_grupped_df(balance, variables['var_categoricas'],variables['var_numericas'] )
-        graph_linea = creacion_graficos(df_mes_negocio, x_label='mes_agrupado', y_label='venta_cop', heu='negocio',
+        df_mes_negocio = utils.create_grupped_df(cubo, variables['var_categoricas'],variables['var_numericas'] )
+        # los meses sin ventas de un negocio quedan en 0 para que la linea no los salte
+        df_mes_negocio = utils.completar_meses_faltantes(df_mes_negocio,
+                                                   [col for col in variables['var_categoricas'] if col != 'mes_agrupado'],
+                                                   variables['var_numericas'], col_fecha='mes_agrupado')
+        graph_linea = utils.creacion_graficos(df_mes_negocio, x_label='mes_agrupado', y_label='venta_cop', heu='negocio',
         titulo = 'Tendencia de Ventas por Negocio y Mes' )
-        ## Grafico de lineas de ventas por negocio
-        fig = graph_linea.create_line_chart()
-        st.markdown('''###''')
-        st.write('Gráfico de lineas para conocer series de tiempo por negocio')
-        st.plotly_chart(fig, use_container_width=True)
-    
-       # except:
-       #    st.warning("No encontró columnas para agrupacion!!")
-
-        ## Grafico de barras de margen por negocio
-        mg_sector['marge_real_label'] = mg_sector['marge_real_negocio'].round(2) # redondeando los margenes
-        graph_bar = creacion_graficos(mg_sector, x_label='negocio', y_label='marge_real_label', heu='negocio',
+        return graph_linea.create_line_chart()
+
+    fig = memo_datos('grafico_tendencia_negocio', calcular)
+    st.markdown('''###''')
+    st.write('Gráfico de lineas para conocer series de tiempo por negocio')
+    mostrar_grafico(fig)
+
+def seccion_margen_negocio(mg_sector):
+    """Grafico de barras de margen por negocio"""
+    def calcular():
+        mg_sector_label = mg_sector.assign(marge_real_label=mg_sector['marge_real_negocio'].round(2)) # redondeando los margenes
+        graph_bar = utils.creacion_graficos(mg_sector_label, x_label='negocio', y_label='marge_real_label', heu='negocio',
                                titulo = 'Margen año actual por Negocio' )
-        fig = graph_bar.create_bar_chart()
-        st.markdown('''###''')
-        st.write('Grafico de barra para el margen año actual por negocio')
-        st.plotly_chart(fig, use_container_width=True)
+        return graph_bar.create_bar_chart()
+
+    fig = memo_datos('grafico_margen_negocio', calcular)
+    st.markdown('''###''')
+    st.write('Grafico de barra para el margen año actual por negocio')
+    mostrar_grafico(fig)
+
+def seccion_metricas_negocio(cubo, mg_sector):
+    """Tabla de metricas de ventas por negocio con su margen"""
+    var_agrupar = 'negocio'
+    var_calculo = 'venta_cop'
+
+    def calcular():
+        resultado = analisis.metricas_negocio(cubo, mg_sector, var_agrupar, var_calculo)
+        # mismo formato de agrupaciones.transformaciones, calculado por columna
+        resultado = formato_tablas.aplicar_formatos(resultado, {'total': 'millones', 'media': 'cientos_millones',
+                                                 'desviacion': 'cientos_millones', 'mediana': 'cientos_millones',
+                                                 'minimo': 'millones', 'maximo': 'millones'})
+        resultado.set_index("negocio",inplace=True)               
+        return resultado
 
+    resultado = memo_datos('tabla_metricas_negocio', calcular)
+    st.markdown(f"Resultado **{var_agrupar}** con total de **{var_calculo}**")
+    st.dataframe(resultado, use_container_width=True)
 
-        # Actualiza el estado si hay cambios
-        var_agrupar = 'negocio'
-        var_calculo = 'venta_cop'
-        # funcion que agrupa por "negocio"
-        df_negocio = create_grupped_df(balance,['mes',var_agrupar],var_num=var_calculo)
-        
-        # funcion para completar meses
-     
-        agrupaciones = agrupaciones_calculos(df_negocio)  # instancia de objeto para agrupar.
-        st.markdown(f"Resultado **{var_agrupar}** con total de **{var_calculo}**")
-        resultado = agrupaciones.tabla_metricas(var_agrupar, var_calculo)  
-          
-        resultado = agrupaciones.combinar_tablas(mg_sector[[var_agrupar,'marge_real_label']],union= [var_agrupar])                
-        
-        resultado['total'] = resultado['total'].apply(
-        lambda x: agrupaciones.transformaciones(x) )
-       
-        resultado['media'] = resultado['media'].apply(
-        lambda x: agrupaciones.transformaciones(x,mmill=False))
-       
-        resultado['desviacion'] = resultado['desviacion'].apply(
-        lambda x: agrupaciones.transformaciones(x, mmill=False))
-
-        resultado['mediana'] = resultado['mediana'].apply(
-        lambda x: agrupaciones.transformaciones(x,mmill=False))
-
-        resultado['minimo'] = resultado['minimo'].apply(
-        lambda x: agrupaciones.transformaciones(x) )
-
-        resultado['maximo'] = resultado['maximo'].apply(
-        lambda x: agrupaciones.transformaciones(x))       
-                
-        resultado.sort_values(by='total', ascending=False)
-        resultado.set_index("negocio",inplace=True)               
-        st.dataframe(resultado, use_container_width=True)
-  
-        ## analisis por  marca
+def modelo_dimensional(cubo):
+    """
+    Ids de negocios, marcas y materiales del cubo (ver scripts.dimensiones), se construye una vez por conjunto de datos.
+    """
+    return memo_datos('modelo_dimensional', lambda: dimensiones.modelo_dimensional(cubo))
 
-        variables_a_agrupar= ['marca'] # variables a agrupar
-        variables_numericas ={'venta_cop':'sum', 'venta_un':'sum','cod_material': pd.Series.nunique} # agrupa por suma ventas para tabla
-        variables_numericas_grafico ={'venta_cop':'mean'} # agrupa por promedio de ventas
+def promedios_marca(cubo):
+    """
+    Ventas promedio mensuales por marca (venta_cop y venta_un), se calcula una vez por conjunto de datos.
+    """
+    return memo_datos('promedios_marca', lambda: analisis.promedios_marca(cubo))
 
-        ventas_por_marca_sorted = create_grupped_df(balance,variables_a_agrupar,variables_numericas,agrupa=False,sort_values='venta_cop').reset_index()
-        
-        ventas_por_marca_sorted_grafico = create_grupped_df(ventas_por_marca_sorted,variables_a_agrupar,variables_numericas_grafico,agrupa=False,sort_values='venta_cop').reset_index()
-        del ventas_por_marca_sorted_grafico['index']
-        
-        variables_a_agrupar_variacion = ['marca','mes'] # SE UTILIZARA MAS ADELANTE
-        variables_numericas_ventas = {'venta_cop':'sum','venta_un':'sum'} # SE UTILIZARA MAS ADELANTE
-        #variables_numericas_ventas_UN = {'venta_un':'sum','venta_cop':'sum'}
-                             
-        ventas_marca_agrup_promedio = create_grupped_df(balance,variables_a_agrupar_variacion,variables_numericas_ventas,agrupa=False,sort_values='venta_cop').reset_index()
-        
-        ventas_promedio  = create_grupped_df(ventas_marca_agrup_promedio,'marca',{'venta_cop':'mean','venta_un':'mean'},agrupa=False,sort_values='venta_cop').reset_index()
-        del ventas_promedio['index']
-        graph_bar_marca = creacion_graficos(ventas_promedio, x_label='venta_cop', y_label='marca',
+def seccion_promedio_marca(cubo):
+    """Grafico de barras de ventas promedio por marca"""
+    def calcular():
+        graph_bar_marca = utils.creacion_graficos(promedios_marca(cubo), x_label='venta_cop', y_label='marca',
                                             heu='marca',
-                                            titulo = 'Ventas promedio Marca')
-        fig_marca = graph_bar_marca.create_bar_chart()
-        st.markdown('''###''')
-        st.write('Gráfico de barra ventas promedio por marca')
-        st.plotly_chart(fig_marca, use_container_width=True)
-        
-        ## linea para conocer cuales son los margenes por marca, adicionalmente, 
-        ## utiliza una funcion para exlcuir posibles valores atipicos, muestra al
-        # usuario cuales fueron las marcas que no se tendran en cuenta
-        st.subheader("Resumen analisis por marca:")
-        marcas_inciales = set(mg_marca['marca'])
-        marge_bruto_ajus_marcas = valores_atipicos(mg_marca,'margen_real')
-        marcas_resultantes = set(marge_bruto_ajus_marcas['marca'])
-
-        #ventas_por_marca_sorted['ventas_acumuladas'] = round(ventas_por_marca_sorted['venta_cop_año_ant'].cumsum())
-        total_ventas = round(ventas_por_marca_sorted['venta_cop'].sum())
-        ventas_por_marca_sorted['venta_cop'] = ventas_por_marca_sorted['venta_cop'].round().astype(float)      
-
-        ventas_por_marca_sorted = pd.merge(ventas_por_marca_sorted,mg_marca[['marca','margen_real']], on = 'marca', how='left')
-       
-        ## agrupaciones variaciones...
-        
-        df_variaciones = calculo_variaciones(ventas_marca_agrup_promedio,col_valor = 'venta_cop'
-                                             ,col_grupo='marca', col_fecha= 'mes')
-        
-        ventas_promedio.columns = ['marca','prom_venta_cop','prom_venta_un']
-        ventas_por_marca_sorted = pd.merge(ventas_por_marca_sorted,df_variaciones, on = 'marca', how='left').merge(
-                            ventas_promedio, on='marca', how = 'left')
-               
-        ventas_por_marca_sorted['margen_real'] = (ventas_por_marca_sorted['margen_real']/100).round(3)        
-        ventas_por_marca_sorted['%_ventas'] = (ventas_por_marca_sorted['venta_cop']) / total_ventas
-        del ventas_por_marca_sorted['index']
-        ventas_por_marca_sorted = ventas_por_marca_sorted.sort_values(by='venta_cop', ascending=False)
-        ventas_por_marca_sorted = ventas_por_marca_sorted.rename(columns={'venta_cop': 'ventas_totales',
-                                                                          'venta_un':'venta_totales_un',
-                                                                          'cod_material':'num_materiales'})        
-       
-        ## ordenando las columnas
-        orden_columnas = ['marca','ventas_totales','venta_totales_un','prom_venta_cop','prom_venta_un','ventas_ultimo_mes',
-                          'margen_real','num_materiales','%_ventas','var_vs_mismo_mes_anterior','var_ultimo_mes','var_ultimo_trimestre',
-                          'var_vs_prom_semestre']
-        ventas_por_marca_sorted = ventas_por_marca_sorted[orden_columnas]
-        ventas_por_marca_sorted.set_index("marca",inplace=True)
-        formateado = ventas_por_marca_sorted.style.format({
-        'ventas_totales': lambda x: f"{x:,.0f}".replace(",", "."),
-        'venta_totales_un':lambda x: f"{x:,.0f}".replace(",", "."),
-        'prom_venta_cop':lambda x: f"{x:,.0f}".replace(",", "."),
-        'prom_venta_un':lambda x: f"{x:,.0f}".replace(",", "."),
-        'ventas_ultimo_mes': lambda x: f"{x:,.0f}".replace(",", "."),    
-        '%_ventas': '{:.1%}',   # Formato porcentaje con 2 decimales
-        'margen_real': '{:.1%}',
-        'var_ultimo_mes': '{:.1%}',  
-        'var_ultimo_trimestre': '{:.1%}',
-        'var_vs_prom_semestre':  '{:.1%}',  
-        'var_vs_mismo_mes_anterior': '{:.1%}'
-        })
-     
-        st.dataframe(formateado, use_container_width=True)
-       
-        st.write('Marcas que no se tendran en cuenta con ser consideradas atipicas.')
-        marge_bruto_ajus_marcas = marge_bruto_ajus_marcas.sort_values(by= 'margen_real')
-        st.markdown(f"Marcas consideras atípicas en sus margenes **{marcas_inciales.difference(marcas_resultantes)}**")
-        graph_bar_marca = creacion_graficos(marge_bruto_ajus_marcas, x_label='marca', y_label='margen_real', heu='marca',
-                               titulo = 'Margen por marca')
-        fig_marca = graph_bar_marca.create_bar_chart()
+                                            titulo = 'Ventas promedio Marca', agregado_otros='mean')
+        return graph_bar_marca.create_bar_chart()
 
+    fig_marca = memo_datos('grafico_promedio_marca', calcular)
+    st.markdown('''###''')
+    st.write('Gráfico de barra ventas promedio por marca')
+    mostrar_grafico(fig_marca)
 
-        st.plotly_chart(fig_marca, use_container_width=True)
-        
-        # capturando las marcas unicas.
-        # marcas_disponibles  = ventas_por_marca_sorted['marca'].unique().tolist()
-        # marcas_seleccionadas = st.multiselect("Seleccione una o más marcas:", marcas_disponibles)
-           # Controlar el flujo basado en el estado actual
-     
-        col1, col2, col3 = st.columns([1, 2, 1])
-        with col2:
-            boton_continuar_producto = st.button(
-            "CONTINUAR CON EL ANALISIS POR PRODUCTO",         
-            on_click=cambiar_a_analisis_producto)
-      
+def seccion_variaciones_marca(cubo, mg_marca):
+    """Tabla de ventas, margen y variaciones por marca para el mes de referencia elegido"""
+    def calcular():
+        return analisis.ventas_marca(cubo, mg_marca, promedios_marca(cubo), modelo_dimensional(cubo))
+
+    st.subheader("Resumen analisis por marca:")
+    ventas_por_marca_base = memo_datos('tabla_ventas_marca', calcular)
+
+    ## agrupaciones variaciones...
+    
+    # la matriz de ventas mensuales por marca se construye una vez por conjunto de datos,
+    # cambiar el mes de referencia solo recalcula las variaciones
+    motor_marca = memo_datos('motor_variaciones_marca',
+                             lambda: variaciones.motor_variaciones(cubo, 'venta_cop', 'marca', col_fecha='mes'))
+    meses_ref = [str(mes) for mes in motor_marca.meses]
+    mes_ref = st.select_slider("Mes de referencia para las variaciones por marca", options=meses_ref,
+                               value=meses_ref[-1]) if len(meses_ref) > 1 else None
+    df_variaciones = motor_marca.variaciones(ventanas=config.get('variaciones'), mes_ref=mes_ref)
+    
+    ventas_por_marca_sorted = analisis.tabla_marcas(ventas_por_marca_base, df_variaciones, config.get('variaciones'))
+    nombres_variacion = list(config.get('variaciones') or variaciones.VENTANAS_DEFECTO)
+    formatos = {
+    'ventas_totales': 'miles',
+    'venta_totales_un': 'miles',
+    'prom_venta_cop': 'miles',
+    'prom_venta_un': 'miles',
+    'ventas_ultimo_mes': 'miles',
+    '%_ventas': 'porcentaje',
+    'margen_real': 'porcentaje',
+    **{nombre: 'porcentaje' for nombre in nombres_variacion}
+    }
+    tabla_paginada(ventas_por_marca_sorted, formatos, 'tabla_marcas')
+
+def seccion_atipicos_marca(cubo, mg_marca):
+    """
+    Margenes por marca sin valores atipicos (cuartiles por los grupos de la seccion atipicos del config),
+    muestra al usuario cuales fueron las marcas que no se tendran en cuenta.
+    """
+    def calcular():
+        marcas_atipicas, marge_bruto_ajus_marcas = analisis.marcas_atipicas(mg_marca, cubo, config.get('atipicos'))
+        graph_bar_marca = utils.creacion_graficos(marge_bruto_ajus_marcas, x_label='marca', y_label='margen_real', heu='marca',
+                               titulo = 'Margen por marca', agregado_otros='mean',
+                               extremos=True)
+        return marcas_atipicas, graph_bar_marca.create_bar_chart()
+
+    marcas_atipicas, fig_marca = memo_datos('grafico_atipicos_marca', calcular)
+    st.write('Marcas que no se tendran en cuenta con ser consideradas atipicas.')
+    st.markdown(f"Marcas consideras atípicas en sus margenes **{marcas_atipicas}**")
+    mostrar_grafico(fig_marca)
 
 def cambiar_a_analisis_producto():
     """Función para cambiar directamente a la vista de análisis por producto"""
@@ -453,52 +586,142 @@ def cambiar_a_analisis_producto():
 def seleccionar_marcas_para_analisis():
     
     st.title("Analisis materiales...")
-    df_balance = st.session_state.df2_balance 
-    mg_sector = st.session_state.df_margen
-    mg_marca =  st.session_state.mg_marca
-    mg_material = st.session_state.mg_material
+    referencias = st.session_state.referencias_datos
+    cubo = referencias['cubo'].datos
+    mg_sector, mg_marca, mg_material = referencias['margen'].datos
 
   
-    marcas_disponibles = sorted(df_balance['marca'].dropna().unique())
+    marcas_disponibles = memo_datos('marcas_disponibles', lambda: sorted(cubo['marca'].dropna().unique()))
     marcas_seleccionadas = st.multiselect(
     "Selecciona una o más marcas para filtrar:",
     options=marcas_disponibles
     )
-    variables_a_agrupar_variacion = ['cod_material','nombre_material','PLU','negocio','categoria','marca'] # SE UTILIZARA MAS ADELANTE
-    variables_numericas_ventas = {'venta_cop':'mean','venta_un':'mean'} # SE UTILIZARA MAS ADELANTE
-                           
-    ventas_material = create_grupped_df(df_balance,variables_a_agrupar_variacion,variables_numericas_ventas,agrupa=False,sort_values='venta_cop').reset_index()
-    ventas_material = pd.merge(ventas_material,mg_material[['cod_material','margen_real']], on= 'cod_material', how='left').merge(mg_marca[['marca','margen_real']], 
-                        on = 'marca', how = 'left',suffixes=('_material', '_marca'))
-    print(type(mg_sector))
-    #ventas_material = pd.merge(ventas_material,mg_sector, on ='negocio', how='left' )
-    del ventas_material['index']
-    ventas_material = ventas_material.sort_values(by =  ['marca', 'venta_cop'], ascending=False)
-
-    ventas_material.set_index(['cod_material','nombre_material'], inplace=True)
+    # la tabla de materiales se construye una vez por conjunto de datos, particionada por marca
+    with etapa('indice de materiales'):
+        indice = memo_datos('indice_materiales', lambda: indice_materiales(cubo, mg_marca, mg_material))
+    # las marcas consultadas se guardan para que cambiar de pagina u orden no oculte la tabla
     if st.button("Clic Marcas seleccionadas"):
-        if marcas_seleccionadas:
-            st.markdown(f"Marcas Selccionadas **{marcas_seleccionadas}** ")         
-            ventas_filtradas = ventas_material[ventas_material['marca'].isin(marcas_seleccionadas)]
-            ventas_filtradas['margen_real_material'] = (ventas_filtradas['margen_real_material']/100).round(3)
-            ventas_filtradas['margen_real_marca'] = (ventas_filtradas['margen_real_marca']/100).round(3)
-            
+        st.session_state.marcas_consultadas = marcas_seleccionadas
+    if 'marcas_consultadas' in st.session_state:
+        marcas_consultadas = st.session_state.marcas_consultadas
+        if marcas_consultadas:
+            st.markdown(f"Marcas Selccionadas **{marcas_consultadas}** ")         
+            ventas_filtradas = materiales_marcas(indice, marcas_consultadas)
             ventas_filtradas = ventas_filtradas.rename(columns={'venta_cop': 'venta_prom_cop',
                                                                 'venta_un':'venta_prom_un'}) 
         
-            
-            formateado = ventas_filtradas.style.format({
-            'margen_real_material':'{:.1%}',
-            'margen_real_marca':'{:.1%}',
-            'venta_prom_cop':lambda x: f"{x:,.0f}".replace(",", "."),
-            'venta_prom_un':lambda x: f"{x:,.0f}".replace(",", ".")
-            })
-            st.dataframe(formateado, use_container_width=True)
+            formatos = {
+            'margen_real_material': 'porcentaje',
+            'margen_real_marca': 'porcentaje',
+            'venta_prom_cop': 'miles',
+            'venta_prom_un': 'miles',
+            **{nombre: 'porcentaje' for nombre in (config.get('variaciones') or variaciones.VENTANAS_DEFECTO)}
+            }
+            with etapa('tabla de materiales') as medicion:
+                medicion.filas = len(ventas_filtradas)
+                tabla_paginada(ventas_filtradas, formatos, 'tabla_materiales')
         else:
             st.warning("No se seleccionaron marcas. Por favor selecciona al menos una marca para filtrar.")
    
+def mostrar_grafico(fig):
+    """Muestra la figura de plotly (la serializacion se mide como una etapa)"""
+    with etapa('serializacion plotly'):
+        st.plotly_chart(fig, use_container_width=True)
+
+def mostrar_diagnostico():
+    """
+    Panel de la barra lateral con las mediciones por etapa de la ejecucion actual
+    (solo con diagnostico activo en el config), las mediciones se agregan al archivo JSON lines.
+    """
+    if not diagnostico.activo():
+        return
+    mediciones = pd.DataFrame(diagnostico.etapas())
+    diagnostico.exportar()
+    with st.sidebar:
+        with st.expander("Diagnóstico de desempeño"):
+            if mediciones.empty:
+                st.write("Sin mediciones en esta ejecución")
+                return
+            st.download_button("Descargar mediciones (JSON lines)",
+                               mediciones.to_json(orient='records', lines=True, force_ascii=False),
+                               file_name='diagnostico.jsonl')
+            # las etapas internas se muestran con sangria
+            mediciones['etapa'] = ['· ' * nivel + nombre for nivel, nombre in zip(mediciones['nivel'], mediciones['etapa'])]
+            st.dataframe(mediciones[['etapa', 'segundos', 'filas', 'memoria_delta_mb']], hide_index=True)
+
+def tabla_paginada(df, formatos, clave):
+    """
+    Muestra una tabla por paginas con el orden calculado en el servidor,
+    solo las filas de la pagina visible se convierten a texto y se envian al navegador.
+    ARG: df: data frame con los valores numericos
+        formatos: dict columna: formato (ver scripts.formato_tablas.FORMATOS)
+        clave: str prefijo de las llaves de los widgets
+    """
+    filas_por_pagina = (config.get('tablas') or {}).get('filas_por_pagina', 50)
+    total_paginas = max(1, -(-len(df) // filas_por_pagina))
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        orden = st.selectbox("Ordenar por", ['(orden actual)'] + list(df.columns), key=f"{clave}_orden")
+    with col2:
+        ascendente = st.checkbox("Ascendente", key=f"{clave}_ascendente")
+    with col3:
+        # la llave cambia con el numero de paginas para volver a la primera pagina cuando cambia la tabla
+        pagina = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas,
+                                 value=1, key=f"{clave}_pagina_{total_paginas}")
+    pagina_df, _ = formato_tablas.pagina_tabla(df, pagina, filas_por_pagina,
+                                None if orden == '(orden actual)' else orden, ascendente)
+    with etapa('formato y envio de la tabla') as medicion:
+        medicion.filas = len(pagina_df)
+        st.dataframe(formato_tablas.aplicar_formatos(pagina_df, formatos), use_container_width=True)
+    st.caption(f"{len(df):,} filas".replace(",", "."))
+    botones_descarga(df, formatos, clave)
+
+def botones_descarga(df, formatos, clave):
+    """
+    Botones para descargar la tabla completa con sus valores numericos (excel con formatos de celda,
+    parquet o csv). El archivo se escribe en disco solo cuando el usuario hace clic.
+    """
+    def contenido(formato):
+        # se entrega el archivo temporal abierto, streamlit lo lee al enviarlo (se borra al liberarlo)
+        return exportar.archivo_exportado(df, formato, formatos, hoja=clave)
+
+    columnas = st.columns(len(exportar.TIPOS_MIME))
+    for columna, (formato, mime) in zip(columnas, exportar.TIPOS_MIME.items()):
+        with columna:
+            st.download_button(f"Descargar {formato}", lambda formato=formato: contenido(formato),
+                               file_name=f"{clave}.{formato}", mime=mime, key=f"{clave}_descarga_{formato}",
+                               on_click='ignore')
+
+def indice_materiales(cubo, mg_marca, mg_material):
+    """
+    Construye la tabla de materiales (ventas promedio, margenes y variaciones) ordenada por marca
+    y ventas, particionada por marca.
+    return: dict con 'marcas' (list en el orden de la tabla) y 'particiones' (dict marca: data frame)
+    """
+    # variaciones por material al ultimo mes (la matriz mensual se construye una vez por conjunto de datos)
+    motor_material = memo_datos('motor_variaciones_material',
+                                lambda: variaciones.motor_variaciones(cubo, 'venta_cop', 'cod_material', col_fecha='mes'))
+    variaciones_material = motor_material.variaciones(ventanas=config.get('variaciones'))
+    ventas_material = analisis.tabla_materiales(cubo, mg_marca, mg_material, variaciones_material,
+                                                config.get('atipicos'), modelo_dimensional(cubo))
+    particiones = dict(tuple(ventas_material.groupby('marca', observed=True, sort=False)))
+    return {'marcas': list(particiones), 'particiones': particiones}
+
+def materiales_marcas(indice, marcas):
+    """
+    Retorna los materiales de las marcas seleccionadas (solo se leen sus particiones).
+    ARG: indice: dict de indice_materiales
+        marcas: list marcas seleccionadas
+    """
+    seleccion = set(marcas)
+    partes = [indice['particiones'][marca] for marca in indice['marcas'] if marca in seleccion]
+    if not partes:
+        return next(iter(indice['particiones'].values())).iloc[:0]
+    return pd.concat(partes)
+
 def main():
     """Función principal que ejecuta la aplicación"""
+    diagnostico.iniciar_ejecucion()
     configurar_pagina()
     inicializar_estado()
     sidebar_carga_archivos()
@@ -507,6 +730,7 @@ def main():
         seleccionar_marcas_para_analisis()
     else:
         contenido_principal()
+    mostrar_diagnostico()
    
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+'''
+Este modulo permite guardar el balanced score en un historico local particionado por mes.
+Cada mes nuevo se valida contra balanced_score_columnas y se guarda en su propia particion
+(formato parquet), junto con sus ventas agregadas (cubo de ventas del mes). Al agregar un mes
+solo se escriben la particion y los agregados de ese mes, el resto del historico no se vuelve a procesar.
+'''
+import json
+import os
+import time
+
+from scripts.configuracion import ruta_proyecto
+
+
+class almacen_ventas:
+    '''
+    Historico de ventas particionado por mes.
+    ARG: carpeta: str carpeta del historico
+        config: dict configuracion (balanced_score_columnas)
+    '''
+
+    def __init__(self, carpeta, config):
+        self.carpeta = carpeta
+        self.config = config
+        self.carpeta_datos = os.path.join(carpeta, 'datos')
+        self.carpeta_agregados = os.path.join(carpeta, 'agregados')
+        self.ruta_manifiesto = os.path.join(carpeta, 'manifiesto.json')
+        os.makedirs(self.carpeta_datos, exist_ok=True)
+        os.makedirs(self.carpeta_agregados, exist_ok=True)
+
+    def manifiesto(self):
+        '''
+        Retorna el dict mes: informacion de la particion (filas, origen, fecha de actualizacion).
+        '''
+        if not os.path.exists(self.ruta_manifiesto):
+            return {}
+        with open(self.ruta_manifiesto, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _guardar_manifiesto(self, manifiesto):
+        ruta_tmp = f"{self.ruta_manifiesto}.tmp"
+        with open(ruta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifiesto, f, indent=2, sort_keys=True)
+        os.replace(ruta_tmp, self.ruta_manifiesto)
+
+    def meses(self):
+        '''
+        Retorna la lista ordenada de meses (YYYY-MM) guardados.
+        '''
+        return sorted(self.manifiesto().keys())
+
+    def validar(self, df):
+        '''
+        Valida que el data frame tenga las columnas de balanced_score_columnas (ya renombradas)
+        y que la columna mes sea de tipo fecha.
+        return: str con la advertencia o None si es valido
+        '''
+        import pandas as pd  # pandas se importa al usar el historico, no al abrirlo
+
+        columnas_esperadas = {tipo[1] for tipo in self.config['balanced_score_columnas'].values()}
+        columnas_faltantes = columnas_esperadas - set(df.columns)
+        if columnas_faltantes:
+            return (f"Advertencia: Faltan las siguientes columnas: {columnas_faltantes}")
+        if not pd.api.types.is_datetime64_any_dtype(df['mes']):
+            return "Advertencia: la columna mes no tiene formato de fecha"
+        if df['mes'].isna().any():
+            return "Advertencia: hay registros sin mes"
+        return None
+
+    def agregar_mes(self, df, origen=''):
+        '''
+        Agrega (o reemplaza) en el historico los meses que trae el data frame.
+        Solo se escriben las particiones y los agregados de esos meses.
+        ARG: df: data frame limpio del balanced score
+            origen: str nombre del archivo de origen
+        return: list meses actualizados (YYYY-MM) o str con la advertencia de validacion
+        '''
+        from scripts.cubo_ventas import construir_cubo
+
+        valida = self.validar(df)
+        if valida is not None:
+            return valida
+
+        manifiesto = self.manifiesto()
+        meses = df['mes'].dt.to_period('M')
+        actualizados = []
+        for periodo, df_mes in df.groupby(meses, observed=True):
+            mes = str(periodo)
+            df_mes = df_mes.reset_index(drop=True)
+            self._escribir(self.carpeta_datos, mes, df_mes)
+            self._escribir(self.carpeta_agregados, mes, construir_cubo(df_mes))
+            manifiesto[mes] = {'filas': len(df_mes), 'origen': origen, 'actualizado': time.time()}
+            actualizados.append(mes)
+
+        self._guardar_manifiesto(manifiesto)
+        return actualizados
+
+    def _escribir(self, carpeta, mes, df):
+        ruta = os.path.join(carpeta, f"mes={mes}.parquet")
+        ruta_tmp = f"{ruta}.tmp"
+        df.to_parquet(ruta_tmp, index=False)
+        os.replace(ruta_tmp, ruta)
+
+    def _leer(self, carpeta, meses=None):
+        import pandas as pd
+        from scripts.utils import concatenar_bloques
+
+        meses = self.meses() if meses is None else meses
+        bloques = [pd.read_parquet(os.path.join(carpeta, f"mes={mes}.parquet")) for mes in meses]
+        if not bloques:
+            return None
+        return concatenar_bloques(bloques).reset_index(drop=True)
+
+    def leer(self, meses=None):
+        '''
+        Retorna el balanced score del historico (todos los meses o los indicados).
+        ARG: meses: list meses YYYY-MM, None para todos
+        '''
+        return self._leer(self.carpeta_datos, meses)
+
+    def leer_agregados(self, meses=None):
+        '''
+        Retorna las ventas agregadas del historico, es decir el cubo de ventas (ver construir_cubo).
+        ARG: meses: list meses YYYY-MM, None para todos
+        '''
+        return self._leer(self.carpeta_agregados, meses)
+
+    def eliminar_mes(self, mes):
+        '''
+        Elimina un mes del historico.
+        ARG: mes: str YYYY-MM
+        '''
+        manifiesto = self.manifiesto()
+        for carpeta in (self.carpeta_datos, self.carpeta_agregados):
+            ruta = os.path.join(carpeta, f"mes={mes}.parquet")
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        manifiesto.pop(mes, None)
+        self._guardar_manifiesto(manifiesto)
+
+
+def abrir_almacen(config):
+    '''
+    Retorna el historico configurado en la seccion 'historico' del config.
+    '''
+    config_historico = config.get('historico') or {}
+    carpeta = ruta_proyecto(config_historico.get('carpeta', 'historico_ventas'))
+    return almacen_ventas(carpeta, config)
@@ -0,0 +1,251 @@
+'''
+Calculos del analisis sin streamlit: lectura del balanced score segun el config, tabla de metricas
+por negocio, tabla de ventas y variaciones por marca, tabla de materiales y margenes atipicos.
+Los usa la aplicacion (appi.py, que agrega cache, memoria por sesion y formato) y el modo por lotes
+(scripts/lote.py).
+'''
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from scripts.utils import (cargar_datos, tipado_memoria, create_grupped_df,
+                           agrupaciones_calculos, marcar_atipicos, concatenar_bloques, medir_etapa)
+from scripts.dimensiones import modelo_dimensional
+from scripts.variaciones import VENTANAS_DEFECTO
+
+
+def leer_balance(archivo, config):
+    '''
+    Lee el archivo del balanced score segun balanced_score_columnas, columnas_fechas, formato_fechas y lectura.
+    ARG: archivo: ruta u objeto tipo archivo, o lista de ellos (ver leer_balances)
+    return: data frame o str con la advertencia de columnas faltantes
+    '''
+    if isinstance(archivo, (list, tuple)):
+        if len(archivo) > 1:
+            return leer_balances(archivo, config)
+        archivo = archivo[0]
+    col_usar = config['balanced_score_columnas'].keys()
+    tipado_col = {nomcol: tipo[0]  for nomcol, tipo in config['balanced_score_columnas'].items()}
+
+    columnas_fecha = config['columnas_fechas'][0]
+    formato_fecha = (config.get('formato_fechas') or {}).get(columnas_fecha)
+
+    nombre_col = [tipo[1] for tipo in config['balanced_score_columnas'].values()]
+    lectura = config.get('lectura') or {}
+    return cargar_datos(archivo,margen=False,
+                        col_usar = col_usar,
+                        tipado_col=tipado_col,
+                        parse = columnas_fecha,
+                        nom_columnas = nombre_col,
+                        streaming = lectura.get('streaming', False),
+                        tamano_bloque = lectura.get('tamano_bloque', 50000),
+                        formato_fecha = formato_fecha,
+                        tipos_compactos = tipado_memoria(config))
+
+
+def _leer_balance_proceso(archivo, config):
+    # en el proceso de trabajo los archivos cargados llegan como (nombre, bytes), el nombre define el formato
+    if isinstance(archivo, tuple):
+        nombre, contenido = archivo
+        archivo = io.BytesIO(contenido)
+        archivo.name = nombre
+    return leer_balance(archivo, config)
+
+
+@medir_etapa()
+def leer_balances(archivos, config, procesos=None):
+    '''
+    Lee varios archivos del balanced score (ej. uno por mes o por region) en paralelo, un proceso
+    por archivo, y los concatena con las mismas categorias. Si un mes esta en varios archivos
+    se conserva el del ultimo archivo de la lista.
+    ARG: archivos: list rutas u objetos tipo archivo
+        procesos: int procesos de trabajo (por defecto lectura.procesos del config o el numero de nucleos)
+    return: data frame o str con la advertencia del primer archivo que no se pudo leer
+    '''
+    if procesos is None:
+        procesos = (config.get('lectura') or {}).get('procesos') or os.cpu_count()
+    procesos = min(procesos, len(archivos))
+    if procesos > 1:
+        entradas = [archivo if isinstance(archivo, (str, os.PathLike)) else (archivo.name, archivo.getvalue())
+                    for archivo in archivos]
+        # spawn: los procesos no heredan los hilos del servidor de streamlit
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn')) as ejecutor:
+            tablas = list(ejecutor.map(_leer_balance_proceso, entradas, [config] * len(entradas)))
+    else:
+        tablas = [leer_balance(archivo, config) for archivo in archivos]
+
+    for archivo, tabla in zip(archivos, tablas):
+        if tabla is None or isinstance(tabla, str):
+            return f"{getattr(archivo, 'name', archivo)}: {tabla}"
+
+    # cada mes se toma del ultimo archivo que lo tiene
+    col_fecha = config['balanced_score_columnas'][config['columnas_fechas'][0]][1]
+    meses_tabla = [tabla[col_fecha].dt.to_period('M') for tabla in tablas]
+    duenos = {}
+    for posicion, meses in enumerate(meses_tabla):
+        for mes in meses.dropna().unique():
+            duenos[mes] = posicion
+    reporte = {}
+    for posicion, (tabla, meses) in enumerate(zip(tablas, meses_tabla)):
+        propios = meses.map(duenos).eq(posicion) | meses.isna()
+        if not propios.all():
+            reporte['meses repetidos en otro archivo'] = reporte.get('meses repetidos en otro archivo', 0) + int((~propios).sum())
+            tablas[posicion] = tabla[propios.to_numpy()]
+        for regla, filas in tabla.attrs.get('reporte_limpieza', {}).items():
+            reporte[regla] = reporte.get(regla, 0) + filas
+
+    balance = concatenar_bloques([tabla.copy() for tabla in tablas]).reset_index(drop=True)
+    balance.attrs['reporte_limpieza'] = reporte
+    return balance
+
+
+def metricas_negocio(cubo, mg_sector, var_agrupar='negocio', var_calculo='venta_cop'):
+    '''
+    Metricas de las ventas mensuales por negocio (total, media, desviacion, mediana, minimo, maximo)
+    con el margen del negocio.
+    '''
+    df_negocio = create_grupped_df(cubo,['mes',var_agrupar],var_num=var_calculo)
+    agrupaciones = agrupaciones_calculos(df_negocio)  # instancia de objeto para agrupar.
+    agrupaciones.tabla_metricas(var_agrupar, var_calculo)
+    mg_sector_label = mg_sector.assign(marge_real_label=mg_sector['marge_real_negocio'].round(2))
+    return agrupaciones.combinar_tablas(mg_sector_label[[var_agrupar,'marge_real_label']],union= [var_agrupar])
+
+
+def promedios_marca(cubo):
+    '''
+    Ventas promedio mensuales por marca (venta_cop y venta_un).
+    '''
+    variables_a_agrupar_variacion = ['marca','mes']
+    variables_numericas_ventas = {'venta_cop':'sum','venta_un':'sum'}
+    ventas_marca_agrup_promedio = create_grupped_df(cubo,variables_a_agrupar_variacion,variables_numericas_ventas,agrupa=False,sort_values='venta_cop').reset_index()
+    ventas_promedio  = create_grupped_df(ventas_marca_agrup_promedio,'marca',{'venta_cop':'mean','venta_un':'mean'},agrupa=False,sort_values='venta_cop').reset_index()
+    del ventas_promedio['index']
+    return ventas_promedio
+
+
+def ventas_marca(cubo, mg_marca, ventas_promedio, modelo=None):
+    '''
+    Ventas totales, numero de materiales, margen y ventas promedio por marca
+    (la parte de la tabla de marcas que no depende del mes de referencia).
+    ARG: modelo: modelo_dimensional del cubo (si no se indica se construye), el margen se cruza por id de marca
+    '''
+    variables_a_agrupar= ['marca'] # variables a agrupar
+    variables_numericas ={'venta_cop':'sum', 'venta_un':'sum','cod_material': pd.Series.nunique} # agrupa por suma ventas para tabla
+    ventas_por_marca_sorted = create_grupped_df(cubo,variables_a_agrupar,variables_numericas,agrupa=False,sort_values='venta_cop').reset_index()
+    ventas_por_marca_sorted['venta_cop'] = ventas_por_marca_sorted['venta_cop'].round().astype(float)
+    modelo = modelo or modelo_dimensional(cubo)
+    margen_marca = modelo.valores_por_id(mg_marca, 'marca', 'margen_real', nombre='margen_marca')
+    ventas_por_marca_sorted['margen_real'] = modelo.tomar(
+        margen_marca, modelo.dimensiones['marca'].get_indexer(ventas_por_marca_sorted['marca']))
+    ventas_por_marca_sorted['marca'] = ventas_por_marca_sorted['marca'].astype(object)  # igual que despues de un merge
+    ventas_promedio = ventas_promedio.copy()
+    ventas_promedio.columns = ['marca','prom_venta_cop','prom_venta_un']
+    return ventas_por_marca_sorted.merge(ventas_promedio, on='marca', how = 'left')
+
+
+def tabla_marcas(ventas_base, df_variaciones, ventanas=None):
+    '''
+    Tabla de marcas: ventas, margen, participacion y una columna por cada ventana de variacion.
+    ARG: ventas_base: data frame de ventas_marca
+        df_variaciones: data frame de motor_variaciones.variaciones por marca
+        ventanas: dict ventanas de variacion (por defecto VENTANAS_DEFECTO)
+    return: data frame con indice marca ordenado por ventas
+    '''
+    total_ventas = round(ventas_base['venta_cop'].sum())
+    ventas_por_marca_sorted = pd.merge(ventas_base,df_variaciones, on = 'marca', how='left')
+
+    ventas_por_marca_sorted['margen_real'] = (ventas_por_marca_sorted['margen_real']/100).round(3)
+    ventas_por_marca_sorted['%_ventas'] = (ventas_por_marca_sorted['venta_cop']) / total_ventas
+    del ventas_por_marca_sorted['index']
+    ventas_por_marca_sorted = ventas_por_marca_sorted.sort_values(by='venta_cop', ascending=False)
+    ventas_por_marca_sorted = ventas_por_marca_sorted.rename(columns={'venta_cop': 'ventas_totales',
+                                                                      'venta_un':'venta_totales_un',
+                                                                      'cod_material':'num_materiales'})
+
+    ## ordenando las columnas (una columna por cada ventana de variacion del config)
+    nombres_variacion = list(ventanas or VENTANAS_DEFECTO)
+    orden_columnas = ['marca','ventas_totales','venta_totales_un','prom_venta_cop','prom_venta_un','ventas_ultimo_mes',
+                      'margen_real','num_materiales','%_ventas'] + nombres_variacion
+    ventas_por_marca_sorted = ventas_por_marca_sorted[orden_columnas]
+    return ventas_por_marca_sorted.set_index("marca")
+
+
+def tabla_materiales(cubo, mg_marca, mg_material, variaciones_material, atipicos=None, modelo=None):
+    '''
+    Tabla de materiales: ventas promedio por registro, margen del material y de la marca, variaciones
+    y la marca margen_atipico (margen del material atipico dentro de su grupo), ordenada por marca y ventas.
+    Las ventas se suman por id de producto y los margenes y variaciones se cruzan por id de material
+    y de marca (ver scripts.dimensiones).
+    ARG: variaciones_material: data frame de motor_variaciones.variaciones por cod_material
+        atipicos: dict seccion atipicos del config (grupos_material, factor, max_filas_grupo)
+        modelo: modelo_dimensional del cubo (si no se indica se construye)
+    return: data frame con indice cod_material, nombre_material
+    '''
+    modelo = modelo or modelo_dimensional(cubo)
+    productos = modelo.productos
+    # promedio por registro de venta_cop y venta_un calculado desde el cubo
+    sumas = modelo.sumar('producto')
+    ventas_material = productos.drop(columns=['id_material', 'id_marca'])
+    ventas_material['venta_cop'] = sumas['venta_cop'] / sumas['filas']
+    ventas_material['venta_un'] = sumas['venta_un'] / sumas['filas']
+    # mismo orden de los productos que al agrupar por sus atributos (define el orden de los empates en ventas)
+    ventas_material = ventas_material.sort_values(list(productos.columns.drop(['id_material', 'id_marca'])))
+    id_material = productos['id_material'].to_numpy()[ventas_material.index]
+    id_marca = productos['id_marca'].to_numpy()[ventas_material.index]
+    ventas_material = ventas_material.reset_index(drop=True)
+    # las claves del margen quedan como texto (igual que despues de un merge): el orden por marca es alfabetico
+    ventas_material = ventas_material.astype({'cod_material': object, 'marca': object})
+    margen_material = modelo.valores_por_id(mg_material, 'cod_material', 'margen_real', nombre='margen_material')
+    margen_marca = modelo.valores_por_id(mg_marca, 'marca', 'margen_real', nombre='margen_marca')
+    ventas_material['margen_real_material'] = modelo.tomar(margen_material, id_material)
+    ventas_material['margen_real_marca'] = modelo.tomar(margen_marca, id_marca)
+    columnas_variacion = list(variaciones_material.columns.drop(['cod_material', 'ventas_ultimo_mes'], errors='ignore'))
+    variaciones_id, _ = modelo.tabla_por_id(variaciones_material, 'cod_material', columnas_variacion)
+    for columna in columnas_variacion:
+        ventas_material[columna] = modelo.tomar(variaciones_id[columna].to_numpy(), id_material)
+    ventas_material = ventas_material.sort_values(by='venta_cop')
+    ventas_material['margen_real_material'] = (ventas_material['margen_real_material']/100).round(3)
+    ventas_material['margen_real_marca'] = (ventas_material['margen_real_marca']/100).round(3)
+    atipicos = atipicos or {}
+    ventas_material['margen_atipico'] = marcar_atipicos(ventas_material, 'margen_real_material',
+                                                        grupos=atipicos.get('grupos_material'),
+                                                        factor=atipicos.get('factor', 1.5),
+                                                        max_filas_grupo=atipicos.get('max_filas_grupo')
+                                                        ) & ventas_material['margen_real_material'].notna()
+    ventas_material = ventas_material.sort_values(by =  ['marca', 'venta_cop'], ascending=False)
+    return ventas_material.set_index(['cod_material','nombre_material'])
+
+
+def cruces_margen(modelo, mg_sector, mg_marca, mg_material):
+    '''
+    Cruza las ventas con las tres tablas de margen y retorna las estadisticas de claves sin cruce
+    (negocios, marcas y materiales con ventas y sin margen, y claves del margen sin ventas).
+    ARG: modelo: modelo_dimensional del cubo
+    return: data frame con indice nombre del cruce (ver modelo_dimensional.reporte_cruces)
+    '''
+    modelo.valores_por_id(mg_sector, 'negocio', 'marge_real_negocio', nombre='margen_sector')
+    modelo.valores_por_id(mg_marca, 'marca', 'margen_real', nombre='margen_marca')
+    modelo.valores_por_id(mg_material, 'cod_material', 'margen_real', nombre='margen_material')
+    return modelo.reporte_cruces().loc[['margen_sector', 'margen_marca', 'margen_material']]
+
+
+def marcas_atipicas(mg_marca, cubo=None, atipicos=None):
+    '''
+    Margenes por marca sin valores atipicos. Con el cubo, los cuartiles se calculan por los grupos
+    grupos_marca del config (ej. negocio), tomando para cada marca el grupo donde mas vende.
+    ARG: cubo: data frame cubo de ventas (opcional)
+        atipicos: dict seccion atipicos del config (grupos_marca, factor, max_filas_grupo)
+    return: set marcas atipicas, data frame de margenes sin atipicos ordenado por margen
+    '''
+    atipicos = atipicos or {}
+    grupos = list(atipicos.get('grupos_marca') or []) if cubo is not None else []
+    if grupos:
+        ventas_grupo = cubo.groupby(['marca'] + grupos, observed=True)['venta_cop'].sum().reset_index()
+        grupo_marca = ventas_grupo.sort_values('venta_cop').drop_duplicates('marca', keep='last')
+        mg_marca = mg_marca.merge(grupo_marca[['marca'] + grupos], on='marca', how='left')
+    atipico = marcar_atipicos(mg_marca, 'margen_real', grupos=grupos, factor=atipicos.get('factor', 1.5),
+                              max_filas_grupo=atipicos.get('max_filas_grupo'))
+    return set(mg_marca.loc[atipico, 'marca']), mg_marca[~atipico].sort_values(by= 'margen_real')
@@ -0,0 +1,226 @@
+'''
+Micro benchmark de las funciones de scripts/utils.py con datos sinteticos (ver generar_datos).
+Mide el tiempo (mejor de varias repeticiones) y el pico de memoria (tracemalloc) de cada caso
+y los compara con una linea base guardada: si un caso supera la linea base mas la tolerancia
+el proceso termina con codigo 1. Tambien mide el arranque de la aplicacion en un proceso nuevo
+(arranque_en_frio: importar appi, primera_pantalla: hasta mostrar la pantalla inicial).
+Uso (desde la carpeta del proyecto):
+    python -m scripts.benchmark --filas 200000 --guardar-base     # guarda la linea base
+    python -m scripts.benchmark --filas 200000                    # compara contra la linea base
+'''
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from scripts.configuracion import RUTA_PROYECTO, ruta_proyecto
+from scripts.utils import (config, cargar_datos, dfarchivoAFO, create_grupped_df, calculo_variaciones,
+                           valores_atipicos, agrupaciones_calculos, preprocess_dataframe, tipado_memoria)
+from scripts.generar_datos import generar_balance, generar_margen, escribir_archivos
+from scripts.cubo_ventas import construir_cubo
+from scripts.variaciones import motor_variaciones
+from scripts.dimensiones import modelo_dimensional
+from scripts import analisis, validacion
+
+
+def medir(funcion, repeticiones=3):
+    '''
+    Ejecuta la funcion y retorna el mejor tiempo en segundos y el pico de memoria en MB.
+    '''
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    gc.collect()
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(tiempos), pico / 1024 ** 2
+
+
+def casos(rutas):
+    '''
+    Retorna el dict nombre del caso: funcion sin argumentos, sobre los archivos generados.
+    '''
+    columnas = config['balanced_score_columnas']
+
+    def leer_balance(ruta=rutas['balance']):
+        return cargar_datos(ruta, col_usar=columnas.keys(),
+                            tipado_col={nombre: tipo[0] for nombre, tipo in columnas.items()},
+                            parse=config['columnas_fechas'][0],
+                            nom_columnas=[tipo[1] for tipo in columnas.values()],
+                            tipos_compactos=tipado_memoria(config))
+
+    balance, _ = preprocess_dataframe(leer_balance(), config)
+    mg_sector, mg_marca, mg_material = cargar_datos(rutas['margen'], margen=True)
+    hoja, columnas_hoja = next(iter(config['config_margen'].items()))
+    df_negocio = create_grupped_df(balance, ['mes', 'negocio'], var_num='venta_cop')
+    cubo = construir_cubo(balance)
+    variaciones_material = motor_variaciones(cubo, 'venta_cop', 'cod_material', col_fecha='mes').variaciones(
+        ventanas=config.get('variaciones'))
+
+    def metricas():
+        agrupaciones = agrupaciones_calculos(df_negocio)
+        agrupaciones.tabla_metricas('negocio', 'venta_cop')
+        return agrupaciones.combinar_tablas(mg_sector[['negocio', 'marge_real_negocio']], union=['negocio'])
+
+    return {
+        'cargar_datos_balance': leer_balance,
+        'cargar_datos_margen': lambda: cargar_datos(rutas['margen'], margen=True),
+        # los mismos archivos en parquet (scripts.columnar, el margen en una tabla con la columna hoja)
+        'cargar_datos_balance_parquet': lambda: leer_balance(rutas['balance_parquet']),
+        'cargar_datos_margen_parquet': lambda: cargar_datos(rutas['margen_parquet'], margen=True),
+        'dfarchivoAFO': lambda: dfarchivoAFO(rutas['margen'], hoja, columnas_hoja),
+        'create_grupped_df_suma': lambda: create_grupped_df(balance, ['mes', 'negocio'], ['venta_cop', 'venta_un']),
+        'create_grupped_df_agregaciones': lambda: create_grupped_df(
+            balance, ['marca'], {'venta_cop': 'sum', 'venta_un': 'sum', 'cod_material': pd.Series.nunique},
+            agrupa=False, sort_values='venta_cop'),
+        'calculo_variaciones': lambda: calculo_variaciones(balance, 'venta_cop', 'marca', col_fecha='mes'),
+        'valores_atipicos': lambda: valores_atipicos(mg_marca, 'margen_real'),
+        'agrupaciones_calculos': metricas,
+        # incluye la construccion de los ids de producto, marca y material (scripts.dimensiones)
+        'tabla_materiales': lambda: analisis.tabla_materiales(cubo, mg_marca, mg_material, variaciones_material,
+                                                              config.get('atipicos'), modelo_dimensional(cubo)),
+        # encabezado y muestra del xlsx: no debe crecer con las filas ni con los textos distintos del archivo
+        'validar_balance': lambda: validacion.validar_balance(rutas['balance'], config),
+    }
+
+
+# se ejecuta en un proceso nuevo: imprime los segundos de arranque, de primera pantalla y la memoria maxima (MB)
+CODIGO_ARRANQUE = '''
+import resource, sys, time
+inicio = time.perf_counter()
+sys.path.insert(0, {proyecto!r})
+import appi
+arranque = time.perf_counter() - inicio
+from streamlit.testing.v1 import AppTest
+AppTest.from_file({appi!r}, default_timeout=120).run()
+pantalla = time.perf_counter() - inicio
+print(arranque, pantalla, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+'''
+
+
+CASOS_ARRANQUE = ['arranque_en_frio', 'primera_pantalla']
+
+
+def medir_arranque(repeticiones=3):
+    '''
+    Mide el arranque de la aplicacion en procesos nuevos (sin modulos importados), desde otra carpeta
+    de trabajo para que no dependa del directorio actual.
+    return: dict caso: {'segundos': mejor tiempo, 'memoria_mb': memoria maxima del proceso}
+    '''
+    codigo = CODIGO_ARRANQUE.format(proyecto=RUTA_PROYECTO, appi=os.path.join(RUTA_PROYECTO, 'appi.py'))
+    medidas = []
+    with tempfile.TemporaryDirectory() as carpeta:
+        for _ in range(repeticiones):
+            salida = subprocess.run([sys.executable, '-c', codigo], cwd=carpeta, capture_output=True,
+                                    text=True, check=True)
+            medidas.append([float(valor) for valor in salida.stdout.split()[-3:]])
+    memoria = max(medida[2] for medida in medidas)
+    return {
+        'arranque_en_frio': {'segundos': min(medida[0] for medida in medidas), 'memoria_mb': memoria},
+        'primera_pantalla': {'segundos': min(medida[1] for medida in medidas), 'memoria_mb': memoria},
+    }
+
+
+def comparar(resultados, linea_base, tolerancia_tiempo, tolerancia_memoria, minimo_segundos=0.05):
+    '''
+    Compara los resultados con la linea base, las diferencias de tiempo menores a minimo_segundos
+    no se cuentan (ruido de la medicion en los casos muy rapidos).
+    return: list de textos con las regresiones encontradas
+    '''
+    regresiones = []
+    for caso, medida in resultados.items():
+        base = linea_base.get(caso)
+        if base is None:
+            continue
+        if (medida['segundos'] > base['segundos'] * (1 + tolerancia_tiempo)
+                and medida['segundos'] - base['segundos'] > minimo_segundos):
+            regresiones.append(f"{caso}: tiempo {medida['segundos']:.3f} s vs base {base['segundos']:.3f} s")
+        if medida['memoria_mb'] > base['memoria_mb'] * (1 + tolerancia_memoria):
+            regresiones.append(f"{caso}: memoria {medida['memoria_mb']:.1f} MB vs base {base['memoria_mb']:.1f} MB")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro benchmark de scripts/utils.py con datos sinteticos')
+    parser.add_argument('--filas', type=int, default=100000)
+    parser.add_argument('--meses', type=int, default=24)
+    parser.add_argument('--marcas', type=int, default=200)
+    parser.add_argument('--materiales', type=int, default=5000)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--casos', nargs='+', help='casos a ejecutar (por defecto todos)')
+    parser.add_argument('--linea-base', default=ruta_proyecto(os.path.join('benchmark', 'linea_base.json')))
+    parser.add_argument('--guardar-base', action='store_true', help='guarda los resultados como linea base')
+    parser.add_argument('--tolerancia-tiempo', type=float, default=0.25)
+    parser.add_argument('--tolerancia-memoria', type=float, default=0.10)
+    parser.add_argument('--minimo-segundos', type=float, default=0.05)
+    args = parser.parse_args()
+
+    resultados = {}
+    solo_arranque = args.casos and set(args.casos) <= set(CASOS_ARRANQUE)
+    with tempfile.TemporaryDirectory() as carpeta:
+        if solo_arranque:
+            casos_datos = {}
+        else:
+            balance = generar_balance(args.filas, args.meses, args.marcas, args.materiales)
+            rutas = escribir_archivos(carpeta, balance, generar_margen(balance), ['xlsx', 'parquet'])
+            casos_datos = casos({'balance': rutas['xlsx'][0], 'margen': rutas['xlsx'][1],
+                                 'balance_parquet': rutas['parquet'][0], 'margen_parquet': rutas['parquet'][1]})
+            del balance
+
+        for caso, funcion in casos_datos.items():
+            if args.casos and caso not in args.casos:
+                continue
+            segundos, memoria = medir(funcion, args.repeticiones)
+            resultados[caso] = {'segundos': segundos, 'memoria_mb': memoria}
+            print(f"{caso:<32} {segundos:>9.3f} s {memoria:>10.1f} MB")
+
+    # el arranque abre procesos nuevos de python: solo se mide si se pide alguno de sus casos
+    if not args.casos or set(args.casos) & set(CASOS_ARRANQUE):
+        for caso, medida in medir_arranque(args.repeticiones).items():
+            if args.casos and caso not in args.casos:
+                continue
+            resultados[caso] = medida
+            print(f"{caso:<32} {medida['segundos']:>9.3f} s {medida['memoria_mb']:>10.1f} MB")
+
+    parametros = {'filas': args.filas, 'meses': args.meses, 'marcas': args.marcas, 'materiales': args.materiales}
+    if args.guardar_base:
+        os.makedirs(os.path.dirname(args.linea_base) or '.', exist_ok=True)
+        with open(args.linea_base, 'w', encoding='utf-8') as f:
+            json.dump({'parametros': parametros, 'resultados': resultados}, f, indent=2)
+        print(f"Linea base guardada en {args.linea_base}")
+        return
+
+    if not os.path.exists(args.linea_base):
+        print(f"No existe la linea base {args.linea_base}, ejecute con --guardar-base")
+        return
+    with open(args.linea_base, 'r', encoding='utf-8') as f:
+        linea_base = json.load(f)
+    if linea_base.get('parametros') != parametros:
+        # con otros tamaños de datos la comparacion no es valida (regresiones o mejoras falsas)
+        print(f"La linea base se genero con otros parametros {linea_base.get('parametros')}, "
+              f"ejecute con los mismos parametros o genere una nueva con --guardar-base")
+        sys.exit(1)
+    regresiones = comparar(resultados, linea_base['resultados'], args.tolerancia_tiempo, args.tolerancia_memoria,
+                          args.minimo_segundos)
+    for regresion in regresiones:
+        print(f"REGRESION {regresion}")
+    if regresiones:
+        sys.exit(1)
+    print("Sin regresiones contra la linea base")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+'''
+Este modulo permite guardar en disco los data frames ya procesados de los archivos cargados,
+para que cada interaccion en streamlit no vuelva a leer el excel completo.
+La llave del cache es el hash del contenido del archivo mas las secciones del config.yml
+que afectan la lectura. Los data frames se guardan en formato parquet (columnar) y el
+tamaño total de la carpeta se limita eliminando las entradas usadas hace mas tiempo (LRU).
+'''
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from scripts.configuracion import ruta_proyecto
+
+VERSION_CACHE = 2  # aumentar cuando cambie la forma en que se construyen los data frames
+
+SECCIONES_BALANCE = ['balanced_score_columnas', 'columnas_fechas', 'formato_fechas', 'lectura', 'filtros',
+                     'balanced_score_fill']
+SECCIONES_MARGEN = ['config_margen']
+
+MAX_HASHES = 256  # hashes de archivos cargados que se recuerdan (los usados hace mas tiempo se descartan)
+_hash_por_id = OrderedDict()  # file_id de streamlit: hash del contenido
+_bloqueo_hashes = threading.Lock()
+
+
+def hash_archivo(archivo, tamano_bloque=8 * 1024 * 1024):
+    '''
+    Calcula el hash del contenido de un archivo.
+    ARG: archivo: str ruta o objeto tipo archivo (ej. UploadedFile de streamlit), o lista de ellos
+        tamano_bloque: int bytes leidos por iteracion
+    return: str hash hexadecimal
+    '''
+    # varios archivos: el hash depende del contenido y del orden de cada uno
+    if isinstance(archivo, (list, tuple)):
+        hashes = '_'.join(hash_archivo(elemento, tamano_bloque) for elemento in archivo)
+        return hashlib.blake2b(hashes.encode('utf-8'), digest_size=20).hexdigest()
+
+    # los archivos de streamlit tienen un id unico por carga, el hash se calcula una sola vez
+    id_archivo = getattr(archivo, 'file_id', None)
+    if id_archivo is not None:
+        with _bloqueo_hashes:
+            if id_archivo in _hash_por_id:
+                _hash_por_id.move_to_end(id_archivo)
+                return _hash_por_id[id_archivo]
+
+    hash_contenido = hashlib.blake2b(digest_size=20)
+    if isinstance(archivo, (str, os.PathLike)):
+        with open(archivo, 'rb') as f:
+            for bloque in iter(lambda: f.read(tamano_bloque), b''):
+                hash_contenido.update(bloque)
+    elif hasattr(archivo, 'getbuffer'):
+        hash_contenido.update(archivo.getbuffer())
+    else:
+        posicion = archivo.tell()
+        archivo.seek(0)
+        for bloque in iter(lambda: archivo.read(tamano_bloque), b''):
+            hash_contenido.update(bloque)
+        archivo.seek(posicion)
+
+    if id_archivo is not None:
+        with _bloqueo_hashes:
+            _hash_por_id[id_archivo] = hash_contenido.hexdigest()
+            while len(_hash_por_id) > MAX_HASHES:
+                _hash_por_id.popitem(last=False)
+    return hash_contenido.hexdigest()
+
+
+def clave_cache(archivo, config, secciones, nombre=''):
+    '''
+    Construye la llave del cache a partir del contenido del archivo y las secciones del config.
+    ARG: archivo: str o objeto tipo archivo
+        config: dict configuracion
+        secciones: list nombres de las secciones del config que afectan la lectura
+        nombre: str distingue resultados distintos del mismo archivo (ej. 'cubo')
+    return: str llave
+    '''
+    parametros = {seccion: config.get(seccion) for seccion in secciones}
+    parametros['version'] = VERSION_CACHE
+    parametros['nombre'] = nombre
+    texto = json.dumps(parametros, sort_keys=True, default=str)
+    hash_config = hashlib.blake2b(texto.encode('utf-8'), digest_size=10).hexdigest()
+    return f"{hash_archivo(archivo)}_{hash_config}"
+
+
+class cache_ingesta:
+    '''
+    Cache en disco de data frames procesados con expulsion LRU por tamaño.
+    ARG: carpeta: str carpeta donde se guardan las entradas
+        tamano_max_mb: float tamaño maximo total de la carpeta en MB
+    '''
+
+    def __init__(self, carpeta, tamano_max_mb=2048):
+        self.carpeta = carpeta
+        self.tamano_max = tamano_max_mb * 1024 * 1024
+        os.makedirs(self.carpeta, exist_ok=True)
+
+    def _ruta(self, clave):
+        return os.path.join(self.carpeta, clave)
+
+    def obtener(self, clave):
+        '''
+        Retorna la lista de data frames guardados para la llave o None si no existe.
+        '''
+        ruta = self._ruta(clave)
+        ruta_meta = os.path.join(ruta, 'meta.json')
+        if not os.path.exists(ruta_meta):
+            return None
+        try:
+            with open(ruta_meta, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            tablas = [pd.read_parquet(os.path.join(ruta, nombre)) for nombre in meta['tablas']]
+        except Exception as e:
+            print(f"Error al leer el cache {clave}: {e}")
+            shutil.rmtree(ruta, ignore_errors=True)
+            return None
+        os.utime(ruta_meta)  # marca la entrada como usada recientemente
+        return tablas
+
+    def guardar(self, clave, tablas):
+        '''
+        Guarda una lista de data frames bajo la llave y aplica la expulsion LRU.
+        ARG: clave: str
+            tablas: list de pd.DataFrame
+        '''
+        ruta = self._ruta(clave)
+        ruta_tmp = f"{ruta}.tmp{os.getpid()}"
+        try:
+            os.makedirs(ruta_tmp, exist_ok=True)
+            nombres = []
+            for i, tabla in enumerate(tablas):
+                nombre = f"tabla_{i}.parquet"
+                tabla.to_parquet(os.path.join(ruta_tmp, nombre), index=False)
+                nombres.append(nombre)
+            with open(os.path.join(ruta_tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'tablas': nombres, 'creado': time.time()}, f)
+            shutil.rmtree(ruta, ignore_errors=True)
+            os.replace(ruta_tmp, ruta)
+        except Exception as e:
+            print(f"No fue posible guardar el cache {clave}: {e}")
+            shutil.rmtree(ruta_tmp, ignore_errors=True)
+            return
+        self.expulsar()
+
+    def expulsar(self):
+        '''
+        Elimina las entradas usadas hace mas tiempo hasta que la carpeta quede dentro del limite.
+        '''
+        entradas = []
+        total = 0
+        for nombre in os.listdir(self.carpeta):
+            ruta = os.path.join(self.carpeta, nombre)
+            ruta_meta = os.path.join(ruta, 'meta.json')
+            if not os.path.isdir(ruta) or not os.path.exists(ruta_meta):
+                continue
+            tamano = sum(entrada.stat().st_size for entrada in os.scandir(ruta) if entrada.is_file())
+            entradas.append((os.path.getmtime(ruta_meta), tamano, ruta))
+            total += tamano
+
+        for _, tamano, ruta in sorted(entradas):
+            if total <= self.tamano_max:
+                break
+            shutil.rmtree(ruta, ignore_errors=True)
+            total -= tamano
+
+
+def cargar_con_cache(archivo, config, secciones, funcion_carga, nombre=''):
+    '''
+    Retorna los data frames de un archivo desde el cache y si no existen los carga y los guarda.
+    ARG: archivo: str o objeto tipo archivo
+        config: dict configuracion, usa la seccion 'cache'
+        secciones: list secciones del config que hacen parte de la llave
+        funcion_carga: funcion sin argumentos que retorna un data frame o una tupla de data frames
+        nombre: str nombre del resultado guardado, hace parte de la llave
+    return: lo mismo que retorna funcion_carga
+    '''
+    config_cache = config.get('cache') or {}
+    if not config_cache.get('activo', False):
+        return funcion_carga()
+
+    try:
+        cache = cache_ingesta(ruta_proyecto(config_cache['carpeta']),
+                              config_cache.get('tamano_max_mb', 2048))
+        clave = clave_cache(archivo, config, secciones, nombre)
+    except Exception as e:
+        print(f"Cache no disponible: {e}")
+        return funcion_carga()
+
+    tablas = cache.obtener(clave)
+    if tablas is not None:
+        return tablas[0] if len(tablas) == 1 else tuple(tablas)
+
+    resultado = funcion_carga()
+    if isinstance(resultado, pd.DataFrame):
+        cache.guardar(clave, [resultado])
+    elif isinstance(resultado, tuple) and all(isinstance(tabla, pd.DataFrame) for tabla in resultado):
+        cache.guardar(clave, list(resultado))
+    return resultado
@@ -0,0 +1,26 @@
+'''
+Importacion diferida de modulos: el modulo se importa la primera vez que se usa uno de sus atributos.
+La aplicacion lo usa para que la pantalla inicial (instrucciones y carga de archivos) no espere
+a pandas, plotly, pyarrow ni a los modulos de analisis.
+'''
+import importlib
+
+
+class modulo_diferido:
+    '''
+    Representa un modulo que se importa en el primer acceso a uno de sus atributos.
+    ARG: nombre: str nombre del modulo (ej. 'scripts.utils')
+    '''
+
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            # import_module usa el bloqueo de importacion de python, es seguro entre hilos de streamlit
+            self._modulo = importlib.import_module(self._nombre)
+        return getattr(self._modulo, atributo)
+
+    def __repr__(self):
+        return f"modulo_diferido({self._nombre!r}, importado={self._modulo is not None})"
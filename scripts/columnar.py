@@ -0,0 +1,344 @@
+'''
+Lectura de los archivos en formatos columnares (parquet, arrow / feather y csv) y conversion de los
+excel del balanced score y del margen a parquet o arrow, para no volver a leer el excel en cada carga.
+Los archivos arrow / feather sin compresion se leen con memory map: las columnas numericas pasan a
+pandas sin copiarse y las de texto guardadas como diccionario quedan directamente como category.
+El archivo de margen columnar es una sola tabla con la columna hoja (nombre de la hoja de config_margen)
+y las cuatro columnas de cada hoja por posicion (codigo, nombre, margen real, margen ppto).
+Uso (desde la carpeta del proyecto):
+    python -m scripts.columnar                                  # archivos de la seccion datos del config
+    python -m scripts.columnar --balance insumos/BSC_EXITO.xlsx --margen insumos/Margen.xlsx --formato arrow
+'''
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+# extension: formato
+FORMATOS = {'.parquet': 'parquet', '.pq': 'parquet', '.arrow': 'arrow', '.feather': 'arrow',
+            '.ipc': 'arrow', '.csv': 'csv'}
+COLUMNA_HOJA = 'hoja'
+COLUMNAS_MARGEN = ['codigo', 'nombre', 'margen_real', 'margen_ppto']
+# en csv los codigos y nombres del margen se leen como texto (conservan los ceros a la izquierda)
+TIPADO_MARGEN = {COLUMNA_HOJA: 'str', 'codigo': 'str', 'nombre': 'str'}
+
+
+def formato_archivo(archivo):
+    '''
+    Formato del archivo segun su extension.
+    ARG: archivo: str ruta u objeto tipo archivo con atributo name (ej. UploadedFile de streamlit)
+    return: str 'parquet', 'arrow', 'csv' o None (excel u otro formato)
+    '''
+    nombre = getattr(archivo, 'name', archivo)
+    return FORMATOS.get(os.path.splitext(str(nombre))[1].lower())
+
+
+def _fuente(archivo):
+    # las rutas se abren con memory map, los archivos cargados se leen sin copiar sus bytes
+    if isinstance(archivo, (str, os.PathLike)):
+        return pa.memory_map(os.fspath(archivo), 'r')
+    if hasattr(archivo, 'getvalue'):
+        return pa.BufferReader(archivo.getvalue())
+    return archivo
+
+
+def _tipo_arrow(tipo):
+    if tipo in ('str', str):
+        return pa.string()
+    return pa.from_numpy_dtype(np.dtype(tipo))
+
+
+def _opciones_csv(config, tipado=None, columnas=None):
+    separador = (config.get('lectura') or {}).get('separador_csv', ',')
+    tipos = {columna: _tipo_arrow(tipo) for columna, tipo in (tipado or {}).items()}
+    return (pacsv.ParseOptions(delimiter=separador),
+            pacsv.ConvertOptions(column_types=tipos, include_columns=columnas, strings_can_be_null=True))
+
+
+def esquema(archivo, config):
+    '''
+    Nombres de las columnas del archivo sin leer los datos (en csv se lee el primer bloque).
+    '''
+    formato = formato_archivo(archivo)
+    fuente = _fuente(archivo)
+    if formato == 'parquet':
+        return pq.ParquetFile(fuente).schema_arrow.names
+    if formato == 'arrow':
+        return pa.ipc.open_file(fuente).schema.names
+    opciones_lectura, _ = _opciones_csv(config)
+    return pacsv.open_csv(fuente, parse_options=opciones_lectura).schema.names
+
+
+def leer_tabla(archivo, config, columnas=None, tipado=None):
+    '''
+    Lee las columnas del archivo como tabla de arrow.
+    ARG: archivo: str ruta u objeto tipo archivo
+        columnas: list columnas a leer (None: todas)
+        tipado: dict columna: tipo, solo se usa en csv para no inferir los tipos (ej. codigos con ceros a la izquierda)
+    return: pa.Table
+    '''
+    formato = formato_archivo(archivo)
+    fuente = _fuente(archivo)
+    if formato == 'parquet':
+        return pq.read_table(fuente, columns=columnas)
+    if formato == 'arrow':
+        try:
+            tabla = pa.ipc.open_file(fuente).read_all()
+        except pa.ArrowInvalid:
+            # formato de stream de arrow (sin pie de archivo)
+            fuente.seek(0)
+            tabla = pa.ipc.open_stream(fuente).read_all()
+        return tabla.select(columnas) if columnas is not None else tabla
+    opciones_lectura, opciones_conversion = _opciones_csv(config, tipado, columnas)
+    return pacsv.read_csv(fuente, parse_options=opciones_lectura, convert_options=opciones_conversion)
+
+
+def iterar_bloques(archivo, config, columnas=None, tipado=None, tamano_bloque=50000):
+    '''
+    Recorre el archivo en bloques de a lo sumo tamano_bloque filas, sin cargarlo completo.
+    return: generador de pa.Table
+    '''
+    formato = formato_archivo(archivo)
+    fuente = _fuente(archivo)
+    if formato == 'parquet':
+        for lote in pq.ParquetFile(fuente).iter_batches(batch_size=tamano_bloque, columns=columnas):
+            yield pa.Table.from_batches([lote])
+    elif formato == 'arrow':
+        tabla = leer_tabla(archivo, config, columnas)  # memory map: solo se leen las paginas de cada bloque
+        for inicio in range(0, tabla.num_rows, tamano_bloque):
+            yield tabla.slice(inicio, tamano_bloque)
+    else:
+        opciones_lectura, opciones_conversion = _opciones_csv(config, tipado, columnas)
+        lector = pacsv.open_csv(fuente, parse_options=opciones_lectura, convert_options=opciones_conversion)
+        for lote in lector:
+            for inicio in range(0, lote.num_rows, tamano_bloque):
+                yield pa.Table.from_batches([lote.slice(inicio, tamano_bloque)])
+
+
+def a_pandas(tabla):
+    '''
+    Convierte la tabla de arrow a pandas liberando cada columna de arrow al convertirla. Las columnas
+    numericas sin nulos no se copian y las columnas diccionario quedan como category, con las categorias
+    ordenadas como al leer el excel (el diccionario esta en el orden en que aparecen los valores).
+    '''
+    df = tabla.to_pandas(split_blocks=True, self_destruct=True)
+    for columna in df.columns:
+        if isinstance(df[columna].dtype, pd.CategoricalDtype) and not df[columna].cat.categories.is_monotonic_increasing:
+            df[columna] = df[columna].cat.reorder_categories(df[columna].cat.categories.sort_values())
+    return df
+
+
+def columnas_archivo(nombres, col_usar):
+    '''
+    Relaciona las columnas del config con las del archivo (los nombres del archivo se comparan sin espacios
+    al inicio y al final, igual que en limpiar_datos).
+    return: dict columna del config: columna del archivo (solo las que existen)
+    '''
+    limpios = {str(nombre).strip(): nombre for nombre in nombres}
+    return {columna: limpios[columna] for columna in col_usar if columna in limpios}
+
+
+def muestra(archivo, config, filas=200):
+    '''
+    Encabezado y primeras filas del archivo, en la misma forma que validacion.leer_muestra.
+    Si el archivo tiene la columna hoja (margen) la muestra se separa por hoja.
+    return: dict hoja: (list encabezado, list de tuplas con las filas de la muestra)
+    '''
+    nombres = esquema(archivo, config)
+    if COLUMNA_HOJA in nombres:
+        tabla = leer_tabla(archivo, config)  # el margen es pequeno
+        resto = [nombre for nombre in nombres if nombre != COLUMNA_HOJA]
+        return {hoja: (resto, _filas(tabla.select(resto).filter(pc.equal(tabla.column(COLUMNA_HOJA).cast(pa.string()), hoja)).slice(0, filas)))
+                for hoja in pc.unique(tabla.column(COLUMNA_HOJA).cast(pa.string())).drop_null().to_pylist()}
+    primer_bloque = next(iterar_bloques(archivo, config, tamano_bloque=filas), None)
+    nombre = os.path.splitext(os.path.basename(str(getattr(archivo, 'name', archivo))))[0]
+    return {nombre: ([str(col).strip() for col in nombres], _filas(primer_bloque) if primer_bloque is not None else [])}
+
+
+def _filas(tabla):
+    return list(zip(*[columna.to_pylist() for columna in tabla.columns]))
+
+
+def leer_hoja_margen(tabla, hoja, nombrecol):
+    '''
+    Toma las filas de una hoja del margen columnar, con los nombres y tipos de config_margen (igual que dfarchivoAFO).
+    ARG: tabla: pa.Table margen con la columna hoja
+        hoja: str nombre de la hoja
+        nombrecol: dict columna: tipo
+    return: data frame
+    '''
+    from scripts.utils import tipar_columnas
+
+    if COLUMNA_HOJA not in tabla.column_names:
+        raise ValueError(f"El archivo de margen no tiene la columna {COLUMNA_HOJA}")
+    filtro = pc.equal(tabla.column(COLUMNA_HOJA).cast(pa.string()), hoja)
+    if not pc.any(filtro).as_py():
+        raise ValueError(f"No existe la hoja {hoja} en el archivo de margen")
+    resto = [nombre for nombre in tabla.column_names if nombre != COLUMNA_HOJA][:len(nombrecol)]
+    df = tabla.select(resto).filter(filtro).to_pandas()
+    df.columns = list(nombrecol.keys())
+    return tipar_columnas(df, nombrecol)
+
+
+def _tabla_arrow(df, diccionario):
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    for columna in diccionario:
+        posicion = tabla.schema.get_field_index(columna)
+        if posicion >= 0 and pa.types.is_string(tabla.schema.field(posicion).type):
+            tabla = tabla.set_column(posicion, columna, tabla.column(posicion).dictionary_encode())
+    return tabla
+
+
+def convertir_balance(ruta_excel, destino, config, formato='parquet'):
+    '''
+    Convierte el excel del balanced score a parquet o arrow. Se guardan las columnas de balanced_score_columnas
+    con su nombre y tipo de lectura (sin filtros ni nombres nuevos), al leer el archivo convertido se aplica
+    el mismo config que al excel. Las columnas con tipo en memoria category se guardan como diccionario.
+    El excel se lee por bloques de lectura.tamano_bloque filas.
+    return: int filas convertidas
+    '''
+    from openpyxl import load_workbook
+    from scripts.utils import _tipar_bloque, _valor_celda
+
+    col_usar = list(config['balanced_score_columnas'].keys())
+    tipado_col = {columna: tipo[0] for columna, tipo in config['balanced_score_columnas'].items()}
+    diccionario = [columna for columna, tipo in config['balanced_score_columnas'].items()
+                   if len(tipo) > 2 and tipo[2] == 'category']
+    tamano_bloque = (config.get('lectura') or {}).get('tamano_bloque', 50000)
+
+    libro = load_workbook(ruta_excel, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        encabezado = [str(col).strip() if col is not None else '' for col in next(filas, ())]
+        columnas_faltantes = set(col_usar) - set(encabezado)
+        if columnas_faltantes:
+            raise ValueError(f"Faltan las siguientes columnas: {columnas_faltantes}")
+        posiciones = [encabezado.index(col) for col in col_usar]
+
+        bloques = []
+        bloque = []
+        total = 0
+        for fila in filas:
+            bloque.append(tuple(_valor_celda(fila[i]) if i < len(fila) else None for i in posiciones))
+            if len(bloque) >= tamano_bloque:
+                bloques.append(_tabla_arrow(_tipar_bloque(bloque, col_usar, tipado_col, total), diccionario))
+                total += len(bloque)
+                bloque = []
+        if bloque or not bloques:
+            bloques.append(_tabla_arrow(_tipar_bloque(bloque, col_usar, tipado_col, total), diccionario))
+            total += len(bloque)
+    finally:
+        libro.close()
+
+    escribir(pa.concat_tables(bloques, promote_options='permissive'), destino, formato)
+    return total
+
+
+def convertir_margen(ruta_excel, destino, config, formato='parquet'):
+    '''
+    Convierte el excel de margen a una sola tabla parquet o arrow con la columna hoja y las
+    columnas de cada hoja de config_margen por posicion (COLUMNAS_MARGEN).
+    return: int filas convertidas
+    '''
+    from scripts.utils import cargar_margen
+
+    tablas, _ = cargar_margen(ruta_excel, config['config_margen'], paralelo=False)
+    return escribir_margen(tablas, destino, formato)
+
+
+def escribir_margen(tablas, destino, formato='parquet'):
+    '''
+    Escribe las hojas del margen como una sola tabla (parquet, arrow o csv) con la columna hoja
+    y las cuatro columnas de cada hoja por posicion (COLUMNAS_MARGEN).
+    ARG: tablas: dict hoja: data frame con las columnas de config_margen
+    return: int filas escritas
+    '''
+    partes = []
+    for hoja, df in tablas.items():
+        parte = df.iloc[:, :len(COLUMNAS_MARGEN)].copy()
+        parte.columns = COLUMNAS_MARGEN
+        for columna in COLUMNAS_MARGEN[:2]:
+            nulos = parte[columna].isna()
+            parte[columna] = parte[columna].astype(str).where(~nulos, None)
+        for columna in COLUMNAS_MARGEN[2:]:
+            parte[columna] = parte[columna].astype('float64')
+        parte.insert(0, COLUMNA_HOJA, hoja)
+        partes.append(parte)
+    margen = pd.concat(partes, ignore_index=True)
+    if formato == 'csv':
+        margen.to_csv(destino, index=False)
+    else:
+        escribir(_tabla_arrow(margen, [COLUMNA_HOJA]), destino, formato)
+    return len(margen)
+
+
+def escribir(tabla, destino, formato='parquet'):
+    '''
+    Escribe la tabla en parquet o en arrow (feather v2 sin compresion, para leerlo con memory map).
+    '''
+    if formato == 'parquet':
+        pq.write_table(tabla, destino)
+    else:
+        tabla = tabla.unify_dictionaries().combine_chunks()
+        feather.write_feather(tabla, destino, compression='uncompressed')
+
+
+def ruta_convertida(ruta, formato='parquet'):
+    '''
+    Ruta del archivo convertido: la misma ruta con la extension del formato.
+    '''
+    return os.path.splitext(ruta)[0] + ('.parquet' if formato == 'parquet' else '.arrow')
+
+
+def buscar_convertido(ruta):
+    '''
+    Si existe una version columnar del archivo (misma ruta con extension .parquet, .arrow o .feather)
+    igual o mas reciente que el archivo la retorna, si no retorna la ruta original. Si la version
+    columnar es anterior al archivo (ej. se reemplazo el excel) se usa el archivo y se advierte.
+    '''
+    base = os.path.splitext(ruta)[0]
+    antiguos = []
+    for extension in ('.parquet', '.arrow', '.feather'):
+        convertido = base + extension
+        if not os.path.exists(convertido):
+            continue
+        if os.path.exists(ruta) and os.path.getmtime(convertido) < os.path.getmtime(ruta):
+            antiguos.append(convertido)
+            continue
+        return convertido
+    if antiguos:
+        print(f"Advertencia: {', '.join(antiguos)} es anterior a {ruta}, se usa {ruta} "
+              f"(vuelva a convertirlo con python -m scripts.columnar)")
+    return ruta
+
+
+def main():
+    from scripts.configuracion import cargar_config, ruta_proyecto
+
+    config = cargar_config()
+    carpeta = ruta_proyecto(config['carpeta'])
+    parser = argparse.ArgumentParser(description='Convierte los excel del balanced score y del margen a parquet o arrow')
+    parser.add_argument('--balance', default=os.path.join(carpeta, config['datos']['balanced_score']))
+    parser.add_argument('--margen', default=os.path.join(carpeta, config['datos']['margen']))
+    parser.add_argument('--formato', choices=['parquet', 'arrow'], default='parquet')
+    args = parser.parse_args()
+
+    for ruta, convertir in ((args.balance, convertir_balance), (args.margen, convertir_margen)):
+        if not ruta or not os.path.exists(ruta):
+            print(f"Advertencia: no existe el archivo {ruta}")
+            continue
+        inicio = time.perf_counter()
+        destino = ruta_convertida(ruta, args.formato)
+        filas = convertir(ruta, destino, config, args.formato)
+        print(f"{ruta} -> {destino}: {filas:,} filas en {time.perf_counter() - inicio:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
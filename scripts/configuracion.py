@@ -0,0 +1,125 @@
+'''
+Este modulo carga el archivo de configuracion (insumos/config.yml) una sola vez por proceso.
+La ruta se resuelve desde la carpeta del proyecto (no desde el directorio de trabajo), el contenido
+se valida contra ESQUEMA y se retorna como un objeto inmutable compartido por todos los modulos.
+Solo depende de yaml, para que la aplicacion arranque sin importar pandas ni plotly.
+'''
+import functools
+import os
+
+import yaml
+
+RUTA_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUTA_CONFIG = os.path.join(RUTA_PROYECTO, 'insumos', 'config.yml')
+
+# seccion: (tipos permitidos, obligatoria)
+ESQUEMA = {
+    'balanced_score_columnas': ((dict,), True),
+    'columnas_fechas': ((list,), True),
+    'filtros': ((dict,), True),
+    'balanced_score_fill': ((dict,), True),
+    'config_margen': ((dict,), True),
+    'datos': ((dict,), True),
+    'carpeta': ((str,), True),
+    'formato_fechas': ((dict, type(None)), False),
+    'tipado_memoria': ((dict, type(None)), False),
+    'lectura': ((dict, type(None)), False),
+    'cache': ((dict, type(None)), False),
+    'historico': ((dict, type(None)), False),
+    'variaciones': ((dict, type(None)), False),
+    'atipicos': ((dict, type(None)), False),
+    'graficos': ((dict, type(None)), False),
+    'tablas': ((dict, type(None)), False),
+    'registro': ((dict, type(None)), False),
+    'diagnostico': ((dict, type(None)), False),
+    'motor': ((dict, type(None)), False),
+}
+
+
+def _solo_lectura(self, *args, **kwargs):
+    raise TypeError('La configuracion es de solo lectura, modifique insumos/config.yml')
+
+
+class config_fija(dict):
+    '''
+    Diccionario de solo lectura. Se puede serializar (json, pickle para los procesos de trabajo)
+    como un dict normal.
+    '''
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _solo_lectura
+
+    def __reduce__(self):
+        return (config_fija, (dict(self),))
+
+
+class lista_fija(list):
+    '''
+    Lista de solo lectura (sigue siendo list: pandas la usa igual en groupby, isin, subset, ...).
+    '''
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _solo_lectura
+    append = extend = insert = pop = remove = clear = sort = reverse = _solo_lectura
+
+    def __reduce__(self):
+        return (lista_fija, (list(self),))
+
+
+def _congelar(valor):
+    if isinstance(valor, dict):
+        return config_fija({llave: _congelar(elemento) for llave, elemento in valor.items()})
+    if isinstance(valor, list):
+        return lista_fija(_congelar(elemento) for elemento in valor)
+    return valor
+
+
+def validar_config(config):
+    '''
+    Revisa las secciones del config contra ESQUEMA y la forma de balanced_score_columnas,
+    columnas_fechas y config_margen.
+    return: list de errores (vacia si el config es valido)
+    '''
+    if not isinstance(config, dict):
+        return ['el archivo no contiene un diccionario de secciones']
+    errores = []
+    for seccion, (tipos, obligatoria) in ESQUEMA.items():
+        if seccion not in config:
+            if obligatoria:
+                errores.append(f"falta la seccion '{seccion}'")
+            continue
+        if not isinstance(config[seccion], tipos):
+            errores.append(f"la seccion '{seccion}' debe ser {' o '.join(tipo.__name__ for tipo in tipos)}")
+    if errores:
+        return errores
+
+    for columna, tipo in config['balanced_score_columnas'].items():
+        if not isinstance(tipo, list) or len(tipo) < 2:
+            errores.append(f"balanced_score_columnas.{columna} debe ser [tipo lectura, nombre nuevo, (tipo en memoria)]")
+    if not config['columnas_fechas']:
+        errores.append("columnas_fechas debe tener al menos una columna")
+    elif config['columnas_fechas'][0] not in config['balanced_score_columnas']:
+        errores.append(f"la columna de fechas '{config['columnas_fechas'][0]}' no esta en balanced_score_columnas")
+    for hoja, columnas in config['config_margen'].items():
+        if not isinstance(columnas, dict) or len(columnas) != 4:
+            errores.append(f"config_margen.{hoja} debe tener 4 columnas (codigo, nombre, margen real, margen ppto)")
+    return errores
+
+
+def ruta_proyecto(ruta):
+    '''
+    Resuelve una ruta relativa del config (carpetas de insumos, cache, historico) desde la carpeta del proyecto.
+    '''
+    return ruta if os.path.isabs(ruta) else os.path.join(RUTA_PROYECTO, ruta)
+
+
+@functools.lru_cache(maxsize=None)
+def cargar_config(ruta_config=RUTA_CONFIG):
+    """
+    Carga el archivo de configuración (config.yml) en un objeto de Python.
+    El archivo se lee y se valida una sola vez por proceso, las siguientes llamadas
+    retornan el mismo objeto (de solo lectura).
+    return: config_fija
+    """
+    with open(ruta_config, 'r', encoding='utf-8') as file:
+        config = yaml.safe_load(file)
+    errores = validar_config(config)
+    if errores:
+        raise ValueError(f"Configuracion invalida ({ruta_config}): " + '; '.join(errores))
+    return _congelar(config)
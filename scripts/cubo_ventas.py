@@ -0,0 +1,31 @@
+'''
+Este modulo construye el cubo de ventas: las ventas sumadas al nivel
+mes, negocio, categoria, sub categoria, marca y material, con el numero de registros.
+El cubo se construye una sola vez por archivo y todas las tablas y graficos del analisis
+se calculan sobre el cubo en lugar de recorrer todo el balanced score.
+'''
+from scripts.diagnostico import medir_etapa
+
+DIMENSIONES_CUBO = ['mes', 'negocio', 'categoria', 'sub_categoria', 'marca', 'cod_material']
+ATRIBUTOS_MATERIAL = ['nombre_material', 'PLU']  # dependen del material, no cambian el nivel del cubo
+MEDIDAS_CUBO = ['venta_cop', 'venta_un', 'filas']
+
+
+@medir_etapa()
+def construir_cubo(df):
+    '''
+    Suma las ventas del balanced score limpio al nivel del cubo.
+    ARG: df: data frame con las columnas del balanced score ya renombradas
+    return: data frame con las dimensiones, los atributos del material, venta_cop, venta_un,
+        filas (numero de registros sumados) y mes_agrupado (primer dia del mes)
+    '''
+    niveles = DIMENSIONES_CUBO + [col for col in ATRIBUTOS_MATERIAL if col in df.columns]
+    cubo = df.groupby(niveles, observed=True, dropna=False, sort=False).agg(
+        venta_cop=('venta_cop', 'sum'),
+        venta_un=('venta_un', 'sum'),
+        filas=('venta_cop', 'size'),
+    ).reset_index()
+    cubo['mes_agrupado'] = cubo['mes'].dt.to_period('M').dt.to_timestamp()
+    cubo.attrs = dict(df.attrs)
+    return cubo
+
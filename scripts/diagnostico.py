@@ -0,0 +1,206 @@
+'''
+Este modulo mide cada etapa del analisis (tiempo, filas y cambio de memoria del proceso).
+Se activa en la seccion 'diagnostico' del config.yml, desactivado cada etapa solo revisa un booleano.
+Las mediciones de cada ejecucion de streamlit (un hilo por ejecucion) se guardan por separado,
+se muestran en el panel de diagnostico de la barra lateral y se agregan a un archivo JSON lines.
+'''
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+from scripts.configuracion import cargar_config, ruta_proyecto
+
+try:
+    import psutil
+except ImportError:  # sin psutil la memoria se lee de /proc (linux)
+    psutil = None
+
+_estado = {'activo': False, 'archivo': None}
+_local = threading.local()
+_bloqueo = threading.Lock()  # los hilos de trabajo agregan sus mediciones a la lista de la ejecucion
+
+
+def configurar(config):
+    '''
+    Activa o desactiva las mediciones segun la seccion 'diagnostico' del config.
+    '''
+    config_diagnostico = config.get('diagnostico') or {}
+    _estado['activo'] = bool(config_diagnostico.get('activo', False))
+    archivo = config_diagnostico.get('archivo')
+    _estado['archivo'] = ruta_proyecto(archivo) if archivo else None
+
+
+configurar(cargar_config())
+
+
+def activo():
+    return _estado['activo']
+
+
+def _memoria_mb():
+    '''
+    Memoria residente del proceso en MB (None si no se puede leer).
+    '''
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _filas(resultado):
+    import pandas as pd  # ya importado por la funcion medida
+
+    if isinstance(resultado, (pd.DataFrame, pd.Series)):
+        return len(resultado)
+    if isinstance(resultado, (tuple, list)):
+        filas = [len(elemento) for elemento in resultado if isinstance(elemento, pd.DataFrame)]
+        return sum(filas) if filas else None
+    return None
+
+
+def iniciar_ejecucion():
+    '''
+    Inicia las mediciones de una ejecucion (en streamlit, al comienzo de cada rerun).
+    '''
+    _local.ejecucion = uuid.uuid4().hex[:12]
+    _local.etapas = []
+    _local.nivel = 0
+
+
+def etapas():
+    '''
+    Retorna la lista de mediciones de la ejecucion actual.
+    '''
+    return getattr(_local, 'etapas', [])
+
+
+def contexto():
+    '''
+    Ejecucion, lista de mediciones y nivel del hilo actual, para continuar las mediciones en los hilos
+    de trabajo que crea (ver en_contexto). None si las mediciones estan desactivadas.
+    '''
+    if not _estado['activo']:
+        return None
+    if not hasattr(_local, 'etapas'):
+        iniciar_ejecucion()
+    return {'ejecucion': _local.ejecucion, 'etapas': _local.etapas, 'nivel': getattr(_local, 'nivel', 0)}
+
+
+@contextlib.contextmanager
+def en_contexto(contexto_ejecucion):
+    '''
+    Ejecuta el bloque (en un hilo de trabajo) agregando sus mediciones a las de la ejecucion que lo creo:
+        contexto_padre = diagnostico.contexto()
+        def tarea(x):
+            with diagnostico.en_contexto(contexto_padre):
+                ...
+    ARG: contexto_ejecucion: dict retornado por contexto() en el hilo que crea el trabajo (None: no hace nada)
+    '''
+    if contexto_ejecucion is None:
+        yield
+        return
+    anterior = {nombre: getattr(_local, nombre) for nombre in ('ejecucion', 'etapas', 'nivel') if hasattr(_local, nombre)}
+    _local.ejecucion = contexto_ejecucion['ejecucion']
+    _local.etapas = contexto_ejecucion['etapas']
+    _local.nivel = contexto_ejecucion['nivel']
+    try:
+        yield
+    finally:
+        # los hilos del ejecutor se reutilizan: se deja el hilo como estaba
+        for nombre in ('ejecucion', 'etapas', 'nivel'):
+            if nombre in anterior:
+                setattr(_local, nombre, anterior[nombre])
+            elif hasattr(_local, nombre):
+                delattr(_local, nombre)
+
+
+class _etapa:
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.filas = None
+
+    def __enter__(self):
+        self.nivel = getattr(_local, 'nivel', 0)
+        _local.nivel = self.nivel + 1
+        self.memoria = _memoria_mb()
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *error):
+        segundos = time.perf_counter() - self.inicio
+        memoria = _memoria_mb()
+        _local.nivel = self.nivel
+        if not hasattr(_local, 'etapas'):
+            iniciar_ejecucion()
+        with _bloqueo:
+            _local.etapas.append({
+                'ejecucion': _local.ejecucion,
+                'fecha': time.time(),
+                'etapa': self.nombre,
+                'nivel': self.nivel,
+                'segundos': round(segundos, 6),
+                'filas': self.filas,
+                'memoria_delta_mb': None if memoria is None or self.memoria is None else round(memoria - self.memoria, 3),
+            })
+        return False
+
+
+class _etapa_inactiva:
+    filas = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        return False
+
+
+_ETAPA_INACTIVA = _etapa_inactiva()
+
+
+def etapa(nombre):
+    '''
+    Contexto que mide un bloque de codigo. El numero de filas se asigna al objeto retornado:
+        with etapa('carga margen') as e:
+            ...
+            e.filas = len(df)
+    '''
+    return _etapa(nombre) if _estado['activo'] else _ETAPA_INACTIVA
+
+
+def medir_etapa(nombre=None):
+    '''
+    Decorador que mide la funcion, las filas son las del data frame (o data frames) que retorna.
+    '''
+    def decorador(funcion):
+        nombre_etapa = nombre or funcion.__qualname__
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not _estado['activo']:
+                return funcion(*args, **kwargs)
+            with _etapa(nombre_etapa) as medicion:
+                resultado = funcion(*args, **kwargs)
+                medicion.filas = _filas(resultado)
+            return resultado
+        return envoltura
+    return decorador
+
+
+def exportar(ruta=None):
+    '''
+    Agrega las mediciones de la ejecucion actual al archivo JSON lines (por defecto el del config).
+    '''
+    ruta = ruta or _estado['archivo']
+    if not ruta or not etapas():
+        return
+    with open(ruta, 'a', encoding='utf-8') as f:
+        for medicion in etapas():
+            f.write(json.dumps(medicion, ensure_ascii=False) + '\n')
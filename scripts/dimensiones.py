@@ -0,0 +1,148 @@
+'''
+Capa de dimensiones del cubo de ventas: negocios, marcas y materiales se identifican con enteros
+consecutivos (id) y los atributos descriptivos del producto (nombre_material, PLU, categoria, ...)
+quedan en tablas pequenas de dimension. Las sumas se hacen por id (np.bincount) y los margenes
+se cruzan por posicion, en lugar de agrupar y unir (pd.merge) por columnas de texto.
+Cada cruce con una tabla de margen guarda cuantas claves de las ventas no tienen margen
+y cuantas claves del margen no tienen ventas (ver reporte_cruces).
+Los ids se construyen sobre el cubo ya armado (el historico concatena cubos mensuales).
+'''
+import functools
+
+import numpy as np
+import pandas as pd
+
+from scripts.cubo_ventas import MEDIDAS_CUBO
+from scripts.diagnostico import medir_etapa
+
+CLAVES = ['negocio', 'marca', 'cod_material']
+ATRIBUTOS_PRODUCTO = ['cod_material', 'nombre_material', 'PLU', 'negocio', 'categoria', 'marca']
+
+
+class modelo_dimensional:
+    '''
+    Ids y dimensiones de un cubo de ventas.
+    ARG: cubo: data frame del cubo (ver cubo_ventas.construir_cubo)
+    atributos:
+        dimensiones: dict clave: pd.Index con los valores de la clave (la posicion es el id)
+        ids: dict clave: np.ndarray int32 id de cada fila del cubo (-1: sin valor), 'producto' despues
+            del primer uso de productos
+        productos: data frame de la dimension producto (indice id_producto) con ATRIBUTOS_PRODUCTO,
+            id_material e id_marca
+        cruces: dict nombre del cruce: estadisticas (ver valores_por_id)
+    '''
+
+    @medir_etapa('modelo_dimensional')
+    def __init__(self, cubo):
+        self._cubo = cubo
+        self.dimensiones = {}
+        self.ids = {}
+        for clave in CLAVES:
+            codigos, valores = pd.factorize(cubo[clave])
+            self.ids[clave] = codigos.astype(np.int32)
+            self.dimensiones[clave] = pd.Index(np.asarray(valores, dtype=object), name=clave)
+        self.cruces = {}
+
+    @functools.cached_property
+    @medir_etapa('modelo_dimensional.productos')
+    def productos(self):
+        # producto: cada combinacion de los atributos del material (el mismo nivel de tabla_materiales),
+        # se construye con el primer uso (la tabla de marcas no la necesita)
+        cubo = self._cubo
+        atributos = [col for col in ATRIBUTOS_PRODUCTO if col in cubo.columns]
+        # la clave combinada se arma con los codigos enteros de cada columna y se vuelve a numerar
+        # despues de cada columna (no se desborda), los nulos son un valor mas (como dropna=False)
+        id_producto = np.zeros(len(cubo), dtype=np.int64)
+        for columna in atributos:
+            codigos, valores = pd.factorize(cubo[columna], use_na_sentinel=False)
+            id_producto, _ = pd.factorize(id_producto * len(valores) + codigos)
+        id_producto = id_producto.astype(np.int32)
+        primeras = np.flatnonzero(~pd.Series(id_producto).duplicated().to_numpy())  # ids en orden de aparicion
+        productos = cubo[atributos].iloc[primeras].reset_index(drop=True)
+        productos['id_material'] = self.ids['cod_material'][primeras]
+        productos['id_marca'] = self.ids['marca'][primeras]
+        productos.index.name = 'id_producto'
+        self.ids['producto'] = id_producto
+        return productos
+
+    def tamano(self, clave):
+        '''
+        Numero de ids de la clave.
+        '''
+        return len(self.productos) if clave == 'producto' else len(self.dimensiones[clave])
+
+    def sumar(self, clave, medidas=MEDIDAS_CUBO):
+        '''
+        Suma las medidas del cubo por id de la clave (las filas sin valor de la clave no se cuentan).
+        ARG: clave: str 'producto' o una de CLAVES
+            medidas: list columnas del cubo
+        return: data frame con indice id y una columna por medida
+        '''
+        tamano = self.tamano(clave)  # construye los productos si hace falta
+        ids = self.ids[clave]
+        validos = ids >= 0
+        ids = ids[validos]
+        return pd.DataFrame({medida: np.bincount(ids, weights=self._cubo[medida].to_numpy(dtype=np.float64)[validos],
+                                                 minlength=tamano)
+                             for medida in medidas})
+
+    def tabla_por_id(self, tabla, clave, columnas):
+        '''
+        Columnas de la tabla (ej. margenes o variaciones por material) ordenadas por id de la clave.
+        Si la clave esta repetida en la tabla se toma la primera fila.
+        ARG: tabla: data frame con la columna clave
+            clave: str una de CLAVES
+            columnas: list columnas de valores numericos
+        return: data frame con indice id (largo tamano(clave)), NaN para los ids sin valor en la tabla,
+            y np.ndarray id de cada clave unica de la tabla (-1: la clave no tiene ventas)
+        '''
+        unicas = tabla.drop_duplicates(clave)
+        posiciones = self.dimensiones[clave].get_indexer(unicas[clave])
+        encontradas = posiciones >= 0
+        valores = np.full((self.tamano(clave), len(columnas)), np.nan)
+        valores[posiciones[encontradas]] = unicas[columnas].to_numpy(dtype=np.float64, na_value=np.nan)[encontradas]
+        return pd.DataFrame(valores, columns=columnas), posiciones
+
+    def valores_por_id(self, tabla, clave, columna, nombre=None):
+        '''
+        Valores de una columna de la tabla (ej. margen por marca) ordenados por id de la clave.
+        Si la clave esta repetida en la tabla se toma la primera fila.
+        ARG: tabla: data frame con la columna clave
+            clave: str una de CLAVES
+            columna: str columna de valores numericos
+            nombre: str nombre del cruce, si se indica se guardan sus estadisticas en cruces
+        return: np.ndarray float64 de largo tamano(clave), NaN para los ids sin valor en la tabla
+        '''
+        valores, posiciones = self.tabla_por_id(tabla, clave, [columna])
+        if nombre is not None:
+            encontradas = posiciones >= 0
+            con_valor = np.zeros(self.tamano(clave), dtype=bool)
+            con_valor[posiciones[encontradas]] = True
+            ventas = self.sumar(clave, ['venta_cop'])['venta_cop'].to_numpy()
+            self.cruces[nombre] = {
+                'clave': clave,
+                'claves_ventas': self.tamano(clave),
+                'claves_sin_cruce': int((~con_valor).sum()),
+                'ventas_sin_cruce': float(ventas[~con_valor].sum()),
+                '%_ventas_sin_cruce': float(ventas[~con_valor].sum() / ventas.sum()) if ventas.sum() else 0.0,
+                'claves_tabla_sin_ventas': int((~encontradas).sum()),
+                'claves_repetidas_tabla': len(tabla) - len(posiciones),
+            }
+        return valores[columna].to_numpy()
+
+    @staticmethod
+    def tomar(valores, ids):
+        '''
+        Toma los valores por id (ej. el margen de la marca de cada producto), NaN para los ids -1.
+        '''
+        ids = np.asarray(ids)
+        resultado = valores[np.where(ids >= 0, ids, 0)] if len(valores) else np.full(len(ids), np.nan)
+        return np.where(ids >= 0, resultado, np.nan)
+
+    def reporte_cruces(self):
+        '''
+        Estadisticas de los cruces realizados: claves de las ventas sin valor en la tabla (y sus ventas)
+        y claves de la tabla que no estan en las ventas.
+        return: data frame con indice nombre del cruce
+        '''
+        return pd.DataFrame.from_dict(self.cruces, orient='index').rename_axis('cruce')
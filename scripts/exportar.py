@@ -0,0 +1,171 @@
+'''
+Este modulo exporta las tablas de resultados (marcas, materiales, ...) con sus valores numericos,
+sin convertirlos a texto: a excel con xlsxwriter en modo de memoria constante (cada fila se escribe
+en disco al pasar a la siguiente y los formatos numericos son estilos de celda de la columna),
+o a parquet / csv por bloques de filas.
+Uso desde python (ej. con las tablas del modo por lotes):
+    exportar_tablas({'marcas': tabla_marcas, 'materiales': tabla_materiales}, 'reportes', 'xlsx', formatos)
+'''
+import io
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import xlsxwriter
+except ImportError:  # sin xlsxwriter se usa el escritor de excel de pandas (carga la hoja en memoria)
+    xlsxwriter = None
+
+# formatos de formato_tablas.FORMATOS como formato numerico de excel
+FORMATOS_EXCEL = {
+    'miles': '#,##0',
+    'porcentaje': '0.0%',
+    'millones': '#,##0.0,,," M mill"',  # cada coma divide por mil
+    'cientos_millones': '#,##0.0" mill"',  # excel no divide por 1e8, el valor se escala (ESCALAS_EXCEL)
+}
+# formatos cuya escala no se puede expresar con el formato de excel: el valor de la celda se divide
+# por la escala para mostrar lo mismo que la tabla de la aplicacion (formato_tablas.formato_millones)
+ESCALAS_EXCEL = {
+    'cientos_millones': 1e8,
+}
+
+TIPOS_MIME = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/octet-stream',
+    'csv': 'text/csv',
+}
+
+
+def _valores_columna(serie):
+    '''
+    Valores de la columna como objetos de python para xlsxwriter, los nulos como None (celda vacia).
+    '''
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        numeros = serie.to_numpy(dtype=float, na_value=np.nan)
+        valores = numeros.astype(object)
+        valores[~np.isfinite(numeros)] = None
+        return valores
+    # textos, categorias, booleanos y fechas (Timestamp es un datetime)
+    valores = serie.astype(object).to_numpy()
+    valores[serie.isna().to_numpy()] = None
+    return valores
+
+
+def _indice_por_defecto(df):
+    return isinstance(df.index, pd.RangeIndex) and df.index.name is None
+
+
+def escribir_excel(tablas, destino, formatos=None, filas_bloque=10000):
+    '''
+    Escribe las tablas en un libro de excel, una hoja por tabla, en modo de memoria constante.
+    ARG: tablas: dict nombre de la hoja: data frame
+        destino: str ruta u objeto tipo archivo
+        formatos: dict columna: nombre del formato (ver FORMATOS_EXCEL), el mismo de aplicar_formatos
+        filas_bloque: int filas convertidas a objetos de python a la vez
+    '''
+    formatos = formatos or {}
+    if xlsxwriter is None:
+        print("Advertencia: xlsxwriter no esta instalado, el excel se escribe en memoria")
+        with pd.ExcelWriter(destino) as escritor:
+            for nombre, df in tablas.items():
+                df.to_excel(escritor, sheet_name=nombre[:31], index=not _indice_por_defecto(df))
+        return
+    libro = xlsxwriter.Workbook(destino, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd',
+                                          'nan_inf_to_errors': True})
+    estilos = {nombre: libro.add_format({'num_format': formato}) for nombre, formato in FORMATOS_EXCEL.items()}
+    encabezado = libro.add_format({'bold': True})
+    for nombre, df in tablas.items():
+        hoja = libro.add_worksheet(nombre[:31])
+        # las columnas del indice (si no es el indice por defecto) se exportan como columnas, bloque por bloque
+        con_indice = not _indice_por_defecto(df)
+        nombres = (list(df.index.names) if con_indice else []) + list(df.columns)
+        for posicion, columna in enumerate(nombres):
+            hoja.set_column(posicion, posicion, max(10, len(str(columna)) + 2), estilos.get(formatos.get(columna)))
+        hoja.write_row(0, 0, [str(columna) for columna in nombres], encabezado)
+        hoja.freeze_panes(1, 0)
+        for inicio in range(0, len(df), filas_bloque):
+            bloque = df.iloc[inicio:inicio + filas_bloque]
+            if con_indice:
+                bloque = bloque.reset_index()
+            columnas = [_valores_columna(bloque[columna] / ESCALAS_EXCEL[formatos[columna]]
+                                         if formatos.get(columna) in ESCALAS_EXCEL else bloque[columna])
+                        for columna in bloque.columns]
+            for fila, valores in enumerate(zip(*columnas), start=inicio + 1):
+                hoja.write_row(fila, 0, valores)
+    libro.close()
+
+
+def escribir_parquet(df, destino, filas_bloque=100000):
+    '''
+    Escribe la tabla en parquet por bloques de filas (un row group por bloque).
+    '''
+    preservar_indice = not _indice_por_defecto(df)
+    escritor = None
+    try:
+        for inicio in range(0, max(len(df), 1), filas_bloque):
+            tabla = pa.Table.from_pandas(df.iloc[inicio:inicio + filas_bloque], preserve_index=preservar_indice,
+                                         schema=escritor.schema if escritor else None)
+            if escritor is None:
+                escritor = pq.ParquetWriter(destino, tabla.schema)
+            escritor.write_table(tabla)
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+
+def escribir_csv(df, destino, filas_bloque=100000):
+    '''
+    Escribe la tabla en csv por bloques de filas.
+    '''
+    df.to_csv(destino, index=not _indice_por_defecto(df), chunksize=filas_bloque)
+
+
+def exportar_tablas(tablas, carpeta, formato='xlsx', formatos=None):
+    '''
+    Escribe las tablas en la carpeta: un libro analisis.xlsx (una hoja por tabla)
+    o un archivo parquet / csv por tabla.
+    ARG: tablas: dict nombre: data frame
+        formato: str 'xlsx', 'parquet' o 'csv'
+        formatos: dict columna: nombre del formato (solo excel)
+    return: list rutas escritas
+    '''
+    os.makedirs(carpeta, exist_ok=True)
+    if formato == 'xlsx':
+        ruta = os.path.join(carpeta, 'analisis.xlsx')
+        escribir_excel(tablas, ruta, formatos)
+        return [ruta]
+    rutas = []
+    for nombre, tabla in tablas.items():
+        ruta = os.path.join(carpeta, f"{nombre}.{formato}")
+        if formato == 'parquet':
+            escribir_parquet(tabla, ruta)
+        else:
+            escribir_csv(tabla, ruta)
+        rutas.append(ruta)
+    return rutas
+
+
+def archivo_exportado(df, formato='xlsx', formatos=None, hoja='datos'):
+    '''
+    Escribe la tabla en un archivo temporal en disco (no en memoria) y lo retorna abierto para lectura
+    (io.BufferedReader), se usa como contenido de st.download_button. El archivo se borra al cerrarlo.
+    '''
+    archivo = tempfile.TemporaryFile()
+    if formato == 'xlsx':
+        escribir_excel({hoja: df}, archivo, formatos)
+    elif formato == 'parquet':
+        escribir_parquet(df, archivo)
+    else:
+        texto = io.TextIOWrapper(archivo, encoding='utf-8', newline='')
+        escribir_csv(df, texto)
+        texto.flush()
+        texto.detach()
+    archivo.flush()
+    # lector binario sobre una copia del descriptor: el temporal sigue en disco hasta cerrar el lector
+    lector = open(os.dup(archivo.fileno()), 'rb')
+    archivo.close()
+    return lector
@@ -0,0 +1,96 @@
+'''
+Este modulo da formato a las tablas que se muestran en streamlit.
+Los textos se construyen por columna (operaciones vectorizadas de numpy / pandas) y no celda por celda,
+y las tablas grandes se muestran por paginas: se ordena la tabla completa y solo se da formato
+a las filas de la pagina visible.
+'''
+import numpy as np
+import pandas as pd
+
+
+def _texto(valores, plantilla):
+    '''
+    Aplica la plantilla (formato %) a todos los valores, los nulos quedan como texto vacio.
+    '''
+    valores = pd.to_numeric(valores, errors='coerce').to_numpy(dtype=float)
+    nulos = ~np.isfinite(valores)
+    texto = np.char.mod(plantilla, np.where(nulos, 0, valores)).astype(object)
+    texto[nulos] = ''
+    return texto
+
+
+def formato_miles(serie, decimales=0):
+    '''
+    Numero con separador de miles '.' (ej. 1234567 -> 1.234.567).
+    ARG: serie: pd.Series numerica
+        decimales: int
+    return: pd.Series de texto
+    '''
+    texto = pd.Series(_texto(serie, f"%.{decimales}f"), index=serie.index)
+    if decimales:
+        enteros = texto.str.split('.', n=1, expand=True)
+        enteros[0] = enteros[0].str.replace(r'(\d)(?=(\d{3})+$)', r'\1.', regex=True)
+        return (enteros[0] + ',' + enteros[1]).where(texto != '', '')
+    return texto.str.replace(r'(\d)(?=(\d{3})+$)', r'\1.', regex=True)
+
+
+def formato_porcentaje(serie, decimales=1):
+    '''
+    Porcentaje (ej. 0.1234 -> 12.3%).
+    '''
+    texto = _texto(pd.to_numeric(serie, errors='coerce') * 100, f"%.{decimales}f%%")
+    return pd.Series(texto, index=serie.index)
+
+
+def formato_millones(serie, decimales=1, mmill=True):
+    '''
+    Equivalente vectorizado de agrupaciones_calculos.transformaciones.
+    ARG: mmill: bool True miles de millones (M mill), False centenas de millones (mill)
+    '''
+    if mmill:
+        texto = _texto(pd.to_numeric(serie, errors='coerce') / 1e9, f"%.{decimales}f M mill")
+    else:
+        texto = _texto(pd.to_numeric(serie, errors='coerce') / 1e8, f"%.{decimales}f mill")
+    return pd.Series(texto, index=serie.index)
+
+
+FORMATOS = {
+    'miles': formato_miles,
+    'porcentaje': formato_porcentaje,
+    'millones': formato_millones,
+    'cientos_millones': lambda serie: formato_millones(serie, mmill=False),
+}
+
+
+def aplicar_formatos(df, formatos):
+    '''
+    Retorna una copia del data frame con las columnas indicadas convertidas a texto.
+    ARG: df: data frame
+        formatos: dict columna: nombre del formato (ver FORMATOS)
+    '''
+    df = df.copy()
+    for columna, formato in formatos.items():
+        if columna in df.columns:
+            df[columna] = FORMATOS[formato](df[columna])
+    return df
+
+
+def pagina_tabla(df, pagina=1, filas_por_pagina=50, orden=None, ascendente=False):
+    '''
+    Ordena la tabla y retorna las filas de una pagina.
+    ARG: df: data frame
+        pagina: int numero de pagina (desde 1)
+        filas_por_pagina: int
+        orden: str columna para ordenar (None: orden actual)
+        ascendente: bool
+    return: data frame de la pagina, int numero total de paginas
+    '''
+    total_paginas = max(1, -(-len(df) // filas_por_pagina))
+    pagina = min(max(1, pagina), total_paginas)
+    inicio = (pagina - 1) * filas_por_pagina
+    if orden is None:
+        return df.iloc[inicio:inicio + filas_por_pagina], total_paginas
+    # se ordena solo la columna y se toman las filas de la pagina
+    posiciones = (df[orden].reset_index(drop=True)
+                  .sort_values(ascending=ascendente, kind='stable').index.to_numpy())
+    return df.iloc[posiciones[inicio:inicio + filas_por_pagina]], total_paginas
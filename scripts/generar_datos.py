@@ -0,0 +1,157 @@
+'''
+Este modulo genera archivos sinteticos del balanced score y del margen con la estructura del config.yml
+(balanced_score_columnas y config_margen), para medir el desempeño de la aplicacion con el tamaño
+de produccion sin usar los archivos reales.
+Uso (desde la carpeta del proyecto):
+    python -m scripts.generar_datos --filas 1000000 --meses 24 --marcas 500 --materiales 30000
+'''
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from scripts import columnar
+from scripts.configuracion import ruta_proyecto
+from scripts.utils import config
+
+NEGOCIOS = ['Café', 'Cárnico', 'Chocolates', 'Pastas', 'Galletas', 'Helados', 'Tresmontes']
+
+
+def generar_balance(filas, meses=24, marcas=200, materiales=5000, config=config, semilla=0):
+    '''
+    Genera el balanced score con los nombres de columna del archivo original.
+    Cada material pertenece a una sola marca, negocio, categoria y sub categoria.
+    Se incluyen registros del filtro del config y nulos en las columnas de balanced_score_fill.
+    ARG: filas: int numero de registros
+        meses: int numero de meses (terminando en el mes actual)
+        marcas: int numero de marcas
+        materiales: int numero de materiales
+    return: data frame
+    '''
+    rng = np.random.default_rng(semilla)
+    negocios = NEGOCIOS + list((config.get('filtros') or {}).get('negocio', []))
+
+    # maestro de materiales
+    marca_material = rng.integers(0, marcas, materiales)
+    negocio_marca = rng.integers(0, len(NEGOCIOS), marcas)
+    maestro = pd.DataFrame({
+        'cod_material': (1000000 + np.arange(materiales)).astype(str),
+        'EAN': (7702000000000 + np.arange(materiales)).astype(str),
+        'nombre_material': [f"Producto {i}" for i in range(materiales)],
+        'PLU': rng.choice(['Si', 'No'], materiales),
+        'marca': [f"Marca {i}" for i in marca_material],
+        'negocio': np.array(NEGOCIOS)[negocio_marca[marca_material]],
+        'categoria': [f"Categoria {i % 40}" for i in marca_material],
+        'sub_categoria': [f"Sub categoria {i % 120}" for i in marca_material],
+    })
+
+    # los materiales mas vendidos aparecen mas veces (distribucion de Zipf)
+    pesos = 1 / np.arange(1, materiales + 1)
+    indice = rng.choice(materiales, filas, p=pesos / pesos.sum())
+    df = maestro.iloc[indice].reset_index(drop=True)
+    fechas = pd.date_range(end=pd.Timestamp.today().normalize().replace(day=1), periods=meses, freq='MS')
+    df.insert(0, 'mes', fechas[rng.integers(0, meses, filas)].strftime('%Y-%m-%d'))
+    df['venta_cop'] = np.round(rng.lognormal(11, 1.2, filas), 2)
+    df['venta_un'] = np.ceil(df['venta_cop'] / rng.uniform(2000, 30000, filas))
+
+    # registros que eliminan los filtros y nulos que completa balanced_score_fill
+    otros = rng.random(filas) < 0.01
+    df.loc[otros, 'negocio'] = negocios[-1]
+    fill = config.get('balanced_score_fill') or {}
+    for col in fill.get('borrar_na', []):
+        df.loc[rng.random(filas) < 0.005, col] = np.nan
+    for col in fill.get('filla_na_0', []):
+        df.loc[rng.random(filas) < 0.02, col] = np.nan
+
+    nombres = {tipo[1]: nombre for nombre, tipo in config['balanced_score_columnas'].items()}
+    return df[list(nombres)].rename(columns=nombres)
+
+
+def generar_margen(balance, config=config, semilla=0):
+    '''
+    Genera las hojas del archivo de margen (sector, marca y material) para los datos del balance.
+    ARG: balance: data frame de generar_balance
+    return: dict hoja: data frame con las columnas de config_margen
+    '''
+    rng = np.random.default_rng(semilla)
+    nombres = {tipo[1]: nombre for nombre, tipo in config['balanced_score_columnas'].items()}
+    negocios = sorted(balance[nombres['negocio']].dropna().unique())
+    marcas = sorted(balance[nombres['marca']].unique())
+    materiales = (balance[[nombres['cod_material'], nombres['nombre_material']]]
+                  .drop_duplicates(nombres['cod_material']).sort_values(nombres['cod_material']))
+    # hoja: (codigos, nombres)
+    valores = {
+        'margen_sector': ([f"{i:04d}" for i in range(len(negocios))], negocios),
+        'margen_marca': ([f"{i:04d}" for i in range(len(marcas))], marcas),
+        'margen_material': (materiales.iloc[:, 0].tolist(), materiales.iloc[:, 1].tolist()),
+    }
+    hojas = {}
+    for hoja, columnas in config['config_margen'].items():
+        codigos, descripciones = valores[hoja]
+        n = len(codigos)
+        col_codigo, col_nombre, col_real, col_ppto = list(columnas)
+        hojas[hoja] = pd.DataFrame({
+            col_codigo: codigos,
+            col_nombre: descripciones,
+            col_real: np.round(rng.normal(25, 6, n), 2),
+            col_ppto: np.round(rng.normal(25, 4, n), 2),
+        })
+    return hojas
+
+
+def escribir_archivos(carpeta, balance, margen, formatos=('xlsx',)):
+    '''
+    Escribe el balance y el margen en la carpeta.
+    ARG: formatos: list 'xlsx' (nombres de la seccion datos del config) y/o 'parquet' / 'arrow' / 'csv'
+            (mismos nombres con la extension del formato, el margen en una sola tabla con la columna hoja,
+            ver columnar.escribir_margen)
+    return: dict formato: list rutas (balance, margen)
+    '''
+    os.makedirs(carpeta, exist_ok=True)
+    rutas = {}
+    for formato in formatos:
+        if formato == 'xlsx':
+            ruta_balance = os.path.join(carpeta, config['datos']['balanced_score'])
+            ruta_margen = os.path.join(carpeta, config['datos']['margen'])
+            balance.to_excel(ruta_balance, index=False)
+            with pd.ExcelWriter(ruta_margen) as escritor:
+                for hoja, df in margen.items():
+                    df.to_excel(escritor, sheet_name=hoja, index=False)
+            rutas[formato] = [ruta_balance, ruta_margen]
+        elif formato in ('parquet', 'arrow', 'csv'):
+            ruta_balance, ruta_margen = (os.path.join(carpeta, f"{os.path.splitext(config['datos'][nombre])[0]}.{formato}")
+                                         for nombre in ('balanced_score', 'margen'))
+            if formato == 'parquet':
+                balance.to_parquet(ruta_balance, index=False)
+            elif formato == 'arrow':
+                columnar.escribir(pa.Table.from_pandas(balance, preserve_index=False), ruta_balance, formato)
+            else:
+                balance.to_csv(ruta_balance, index=False)
+            columnar.escribir_margen(margen, ruta_margen, formato)
+            rutas[formato] = [ruta_balance, ruta_margen]
+        else:
+            print(f"Advertencia: formato {formato} no soportado")
+    return rutas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera archivos sinteticos del balanced score y del margen')
+    parser.add_argument('--filas', type=int, default=100000)
+    parser.add_argument('--meses', type=int, default=24)
+    parser.add_argument('--marcas', type=int, default=200)
+    parser.add_argument('--materiales', type=int, default=5000)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--carpeta', default=ruta_proyecto('datos_sinteticos'))
+    parser.add_argument('--formatos', nargs='+', default=['xlsx', 'parquet'])
+    args = parser.parse_args()
+
+    balance = generar_balance(args.filas, args.meses, args.marcas, args.materiales, semilla=args.semilla)
+    margen = generar_margen(balance, semilla=args.semilla)
+    for formato, rutas in escribir_archivos(args.carpeta, balance, margen, args.formatos).items():
+        print(f"{formato}: {', '.join(rutas)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''
+Modo por lotes: ejecuta el analisis sin streamlit (limpieza, cubo de ventas, metricas por negocio,
+tablas de marcas y materiales con variaciones, marcas con margen atipico y cruce de las ventas con el margen)
+y escribe las tablas en archivos.
+Cada conjunto de entrada es una carpeta con los archivos de la seccion datos del config.yml
+(balanced_score y margen). Varios conjuntos (ej. uno por region o por mes) se procesan en paralelo,
+un proceso por conjunto.
+Uso (desde la carpeta del proyecto):
+    python -m scripts.lote                                      # carpeta y datos del config
+    python -m scripts.lote --entradas regiones --salida reportes --procesos 4 --formato xlsx
+'''
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from scripts.configuracion import ruta_proyecto
+from scripts.utils import config, cargar_datos, preprocess_dataframe
+from scripts.cubo_ventas import construir_cubo
+from scripts.dimensiones import modelo_dimensional
+from scripts.variaciones import motor_variaciones
+from scripts import analisis
+from scripts.exportar import exportar_tablas
+from scripts.columnar import buscar_convertido
+
+# formatos de celda de las columnas numericas en excel (ver exportar.FORMATOS_EXCEL)
+FORMATOS_LOTE = {
+    'ventas_totales': 'miles', 'venta_totales_un': 'miles', 'prom_venta_cop': 'miles', 'prom_venta_un': 'miles',
+    'ventas_ultimo_mes': 'miles', 'venta_cop': 'miles', 'venta_un': 'miles',
+    '%_ventas': 'porcentaje', 'margen_real': 'porcentaje', 'margen_real_material': 'porcentaje',
+    'margen_real_marca': 'porcentaje', 'ventas_sin_cruce': 'miles', '%_ventas_sin_cruce': 'porcentaje',
+}
+
+
+def buscar_conjuntos(entradas):
+    '''
+    Busca los conjuntos de archivos: cada carpeta de entradas que tenga los archivos del config
+    (o su version parquet / arrow) o, si no los tiene, cada sub carpeta que los tenga.
+    ARG: entradas: list carpetas
+    return: dict nombre del conjunto: (ruta balance, ruta margen)
+    '''
+    archivo_balance = config['datos']['balanced_score']
+    archivo_margen = config['datos']['margen']
+
+    def archivos(carpeta):
+        # si el excel ya fue convertido (python -m scripts.columnar) se usa el archivo convertido
+        rutas = tuple(buscar_convertido(os.path.join(carpeta, archivo)) for archivo in (archivo_balance, archivo_margen))
+        return rutas if all(os.path.exists(ruta) for ruta in rutas) else None
+
+    conjuntos = {}
+    for carpeta in entradas:
+        rutas = archivos(carpeta)
+        if rutas:
+            conjuntos[os.path.basename(os.path.normpath(carpeta))] = rutas
+            continue
+        for nombre in sorted(os.listdir(carpeta)):
+            subcarpeta = os.path.join(carpeta, nombre)
+            rutas = archivos(subcarpeta) if os.path.isdir(subcarpeta) else None
+            if rutas:
+                conjuntos[nombre] = rutas
+    return conjuntos
+
+
+def procesar_conjunto(nombre, ruta_balance, ruta_margen, carpeta_salida, formato='xlsx', mes_ref=None):
+    '''
+    Ejecuta el analisis de un conjunto de archivos y escribe sus tablas en carpeta_salida/nombre.
+    return: dict resumen (nombre, filas, segundos) o con la advertencia si no se pudo procesar
+    '''
+    inicio = time.perf_counter()
+    balance = analisis.leer_balance(ruta_balance, config)
+    if balance is None or isinstance(balance, str):
+        return {'conjunto': nombre, 'advertencia': balance or 'No fue posible leer el balanced score'}
+    balance, reporte = preprocess_dataframe(balance, config)
+    cubo = construir_cubo(balance)
+    filas = len(balance)
+    del balance
+    mg_sector, mg_marca, mg_material = cargar_datos(ruta_margen, margen=True)
+
+    ventanas = config.get('variaciones')
+    variaciones_marca = motor_variaciones(cubo, 'venta_cop', 'marca', col_fecha='mes').variaciones(
+        ventanas=ventanas, mes_ref=mes_ref)
+    variaciones_material = motor_variaciones(cubo, 'venta_cop', 'cod_material', col_fecha='mes').variaciones(
+        ventanas=ventanas, mes_ref=mes_ref)
+    marcas_atipicas, _ = analisis.marcas_atipicas(mg_marca, cubo, config.get('atipicos'))
+    modelo = modelo_dimensional(cubo)
+
+    tablas = {
+        'negocio': analisis.metricas_negocio(cubo, mg_sector).set_index('negocio'),
+        'marcas': analisis.tabla_marcas(analisis.ventas_marca(cubo, mg_marca, analisis.promedios_marca(cubo), modelo),
+                                        variaciones_marca, ventanas),
+        'materiales': analisis.tabla_materiales(cubo, mg_marca, mg_material, variaciones_material,
+                                                  config.get('atipicos'), modelo),
+        'cruce_margen': analisis.cruces_margen(modelo, mg_sector, mg_marca, mg_material),
+        'marcas_atipicas': pd.DataFrame({'marca': sorted(marcas_atipicas)}).set_index('marca'),
+        'limpieza': pd.DataFrame({'regla': list(reporte), 'registros_eliminados': list(reporte.values())}).set_index('regla'),
+    }
+    formatos = {**FORMATOS_LOTE, **{nombre_variacion: 'porcentaje' for nombre_variacion in ventanas or {}}}
+    exportar_tablas(tablas, os.path.join(carpeta_salida, nombre), formato, formatos)
+    return {'conjunto': nombre, 'filas': filas, 'segundos': round(time.perf_counter() - inicio, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analisis del balanced score por lotes (sin streamlit)')
+    parser.add_argument('--entradas', nargs='+', default=[ruta_proyecto(config['carpeta'])],
+                        help='carpetas con los archivos de la seccion datos del config (o sub carpetas con ellos)')
+    parser.add_argument('--salida', default=ruta_proyecto('reportes'))
+    parser.add_argument('--formato', choices=['xlsx', 'csv', 'parquet'], default='xlsx')
+    parser.add_argument('--procesos', type=int, default=os.cpu_count())
+    parser.add_argument('--mes-ref', default=None, help='mes de referencia de las variaciones (YYYY-MM)')
+    args = parser.parse_args()
+
+    conjuntos = buscar_conjuntos(args.entradas)
+    if not conjuntos:
+        print(f"No se encontraron {config['datos']['balanced_score']} y {config['datos']['margen']} en {args.entradas}")
+        return
+
+    parametros = [(nombre, balance, margen, args.salida, args.formato, args.mes_ref)
+                  for nombre, (balance, margen) in conjuntos.items()]
+    if len(parametros) == 1 or args.procesos <= 1:
+        resultados = [procesar_conjunto(*parametro) for parametro in parametros]
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.procesos, len(parametros))) as ejecutor:
+            futuros = [ejecutor.submit(procesar_conjunto, *parametro) for parametro in parametros]
+            resultados = [futuro.result() for futuro in as_completed(futuros)]
+
+    for resultado in sorted(resultados, key=lambda r: r['conjunto']):
+        if 'advertencia' in resultado:
+            print(f"{resultado['conjunto']}: {resultado['advertencia']}")
+        else:
+            print(f"{resultado['conjunto']}: {resultado['filas']:,} registros en {resultado['segundos']} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+'''
+Motor de ejecucion opcional para las agrupaciones y uniones del analisis.
+Con `motor: tipo: duckdb` en el config.yml, create_grupped_df, calculo_variaciones y
+agrupaciones_calculos (tabla_metricas / combinar_tablas) se ejecutan en DuckDB: una base de
+datos columnar en el mismo proceso (sin servidor) que usa todos los nucleos del equipo.
+DuckDB lee los data frames de pandas sin copiarlos y tambien puede leer archivos parquet.
+La implementacion en pandas de scripts.utils sigue siendo la referencia: con `verificar: True`
+se ejecutan ambas y se informa cualquier diferencia mayor a la tolerancia.
+'''
+import pandas as pd
+
+FUNCIONES_SQL = {
+    'sum': 'COALESCE(SUM({col}), 0)',
+    'mean': 'AVG({col})',
+    'median': 'MEDIAN({col})',
+    'std': 'STDDEV_SAMP({col})',
+    'min': 'MIN({col})',
+    'max': 'MAX({col})',
+    'count': 'COUNT({col})',
+    'nunique': 'COUNT(DISTINCT {col})',
+}
+
+TIPOS_UNION = {'left': 'LEFT', 'right': 'RIGHT', 'inner': 'INNER', 'outer': 'FULL OUTER'}
+
+
+def _q(nombre):
+    '''
+    Nombre de columna entre comillas para SQL.
+    '''
+    return '"' + str(nombre).replace('"', '""') + '"'
+
+
+def _lista(valor):
+    if valor is None:
+        return []
+    return [valor] if isinstance(valor, str) else list(valor)
+
+
+class motor_duckdb:
+    '''
+    Ejecuta las agrupaciones y uniones del analisis en DuckDB.
+    ARG: hilos: int numero de hilos (None: todos los nucleos)
+        verificar: bool compara cada resultado con la implementacion en pandas
+        tolerancia: float tolerancia relativa de la comparacion
+    '''
+
+    def __init__(self, hilos=None, verificar=False, tolerancia=1e-6):
+        import duckdb
+
+        self.conexion = duckdb.connect(':memory:')
+        if hilos:
+            self.conexion.execute(f"SET threads TO {int(hilos)}")
+        self.verificar = verificar
+        self.tolerancia = tolerancia
+
+    def _consultar(self, sql, tablas):
+        '''
+        Ejecuta la consulta con los data frames registrados como tablas.
+        Cada consulta usa su propio cursor porque streamlit atiende cada sesion en un hilo distinto.
+        ARG: sql: str
+            tablas: dict nombre: data frame
+        return: data frame
+        '''
+        cursor = self.conexion.cursor()
+        try:
+            for nombre, df in tablas.items():
+                cursor.register(nombre, df)
+            return cursor.execute(sql).df()
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _fuente(df):
+        '''
+        Retorna la expresion FROM: un data frame registrado o una ruta / patron de archivos parquet.
+        '''
+        if isinstance(df, str):
+            return "read_parquet('" + df.replace("'", "''") + "')", {}
+        return 'datos', {'datos': df}
+
+    def agrupar(self, df, var_cate, var_num, agrupa=True, sort_values=None):
+        '''
+        Equivalente a create_grupped_df.
+        ARG: df: data frame o ruta de archivos parquet
+            var_cate: list variables categoricas
+            var_num: list variables numericas (agrupa=True) o dict variable: funcion (agrupa=False)
+        '''
+        var_cate = _lista(var_cate)
+        if agrupa:
+            expresiones = [f"{FUNCIONES_SQL['sum'].format(col=_q(col))} AS {_q(col)}" for col in _lista(var_num)]
+            orden = var_cate
+        else:
+            expresiones = []
+            for col, funcion in var_num.items():
+                nombre_funcion = 'nunique' if funcion is pd.Series.nunique else funcion
+                expresiones.append(f"{FUNCIONES_SQL[nombre_funcion].format(col=_q(col))} AS {_q(col)}")
+            orden = _lista(sort_values)
+
+        fuente, tablas = self._fuente(df)
+        columnas = ', '.join(_q(col) for col in var_cate)
+        sql = (f"SELECT {columnas}, {', '.join(expresiones)} FROM {fuente} "
+               f"WHERE {' AND '.join(f'{_q(col)} IS NOT NULL' for col in var_cate)} "
+               f"GROUP BY {columnas}")
+        if orden:
+            sql += f" ORDER BY {', '.join(_q(col) for col in orden)}"
+        return self._consultar(sql, tablas)
+
+    def agrupar_mensual(self, df, col_grupo, col_valor, col_fecha):
+        '''
+        Suma col_valor por grupo y mes (paso de agrupacion de calculo_variaciones).
+        return: data frame con col_grupo, anio_mes (pd.Period mensual) y col_valor
+        '''
+        col_grupo = _lista(col_grupo)
+        fuente, tablas = self._fuente(df)
+        columnas = ', '.join(_q(col) for col in col_grupo)
+        sql = (f"SELECT {columnas}, date_trunc('month', {_q(col_fecha)}) AS anio_mes, "
+               f"{FUNCIONES_SQL['sum'].format(col=_q(col_valor))} AS {_q(col_valor)} FROM {fuente} "
+               f"WHERE {' AND '.join(f'{_q(col)} IS NOT NULL' for col in col_grupo + [col_fecha])} "
+               f"GROUP BY ALL ORDER BY {columnas}, anio_mes")
+        resultado = self._consultar(sql, tablas)
+        resultado['anio_mes'] = pd.to_datetime(resultado['anio_mes']).dt.to_period('M')
+        return resultado
+
+    def tabla_metricas(self, df, var_categoricas, var_numerica):
+        '''
+        Equivalente a agrupaciones_calculos.tabla_metricas.
+        '''
+        col = _q(var_numerica)
+        fuente, tablas = self._fuente(df)
+        sql = (f"SELECT {_q(var_categoricas)}, {FUNCIONES_SQL['sum'].format(col=col)} AS total, "
+               f"AVG({col}) AS media, STDDEV_SAMP({col}) AS desviacion, MEDIAN({col}) AS mediana, "
+               f"MIN({col}) AS minimo, MAX({col}) AS maximo FROM {fuente} "
+               f"WHERE {_q(var_categoricas)} IS NOT NULL "
+               f"GROUP BY {_q(var_categoricas)} ORDER BY total DESC")
+        return self._consultar(sql, tablas)
+
+    def combinar(self, df, df_auxiliar, union, cardinal='left'):
+        '''
+        Equivalente a agrupaciones_calculos.combinar_tablas (pd.merge): conserva el orden de la
+        tabla principal y agrega los sufijos _x / _y a las columnas repetidas.
+        '''
+        clave_izq, clave_der = (union[0], union[0]) if len(union) == 1 else (union[0], union[1])
+        misma_clave = clave_izq == clave_der
+        repetidas = (set(df.columns) & set(df_auxiliar.columns)) - ({clave_izq} if misma_clave else set())
+
+        seleccion = []
+        for col in df.columns:
+            if misma_clave and col == clave_izq and cardinal in ('right', 'outer'):
+                seleccion.append(f"COALESCE(i.{_q(col)}, d.{_q(col)}) AS {_q(col)}")
+            else:
+                nombre = f"{col}_x" if col in repetidas else col
+                seleccion.append(f"i.{_q(col)} AS {_q(nombre)}")
+        for col in df_auxiliar.columns:
+            if misma_clave and col == clave_der:
+                continue
+            nombre = f"{col}_y" if col in repetidas else col
+            seleccion.append(f"d.{_q(col)} AS {_q(nombre)}")
+
+        sql = (f"SELECT {', '.join(seleccion)} FROM "
+               f"(SELECT *, row_number() OVER () AS __orden FROM izquierda) i "
+               f"{TIPOS_UNION[cardinal]} JOIN "
+               f"(SELECT *, row_number() OVER () AS __orden FROM derecha) d "
+               f"ON i.{_q(clave_izq)} = d.{_q(clave_der)} "
+               f"ORDER BY {'d' if cardinal == 'right' else 'i'}.__orden, "
+               f"{'i' if cardinal == 'right' else 'd'}.__orden")
+        return self._consultar(sql, {'izquierda': df, 'derecha': df_auxiliar})
+
+
+def comparar_resultados(resultado, referencia, nombre, tolerancia=1e-6):
+    '''
+    Compara el resultado del motor con el de pandas (sin tener en cuenta el orden de las filas
+    ni los tipos de dato) e informa si hay diferencias.
+    return: bool True si coinciden
+    '''
+    def normalizar(df):
+        df = df.reset_index(drop=True)
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype) or df[col].dtype == object:
+                df[col] = df[col].astype(object).where(df[col].notna(), None).astype(str)
+        return df.sort_values(by=list(df.columns)).reset_index(drop=True)
+
+    try:
+        pd.testing.assert_frame_equal(normalizar(resultado), normalizar(referencia),
+                                      check_dtype=False, check_exact=False, rtol=tolerancia)
+        return True
+    except AssertionError as e:
+        print(f"Advertencia: el motor no coincide con pandas en {nombre}: {e}")
+        return False
+
+
+def crear_motor(config):
+    '''
+    Retorna el motor configurado en la seccion 'motor' del config o None para usar pandas.
+    Si DuckDB no esta instalado se usa pandas.
+    '''
+    config_motor = config.get('motor') or {}
+    tipo = config_motor.get('tipo', 'pandas')
+    if tipo == 'pandas':
+        return None
+    if tipo != 'duckdb':
+        print(f"Advertencia: motor {tipo} no soportado, se usa pandas")
+        return None
+    try:
+        return motor_duckdb(hilos=config_motor.get('hilos'),
+                            verificar=config_motor.get('verificar', False),
+                            tolerancia=config_motor.get('tolerancia', 1e-6))
+    except ImportError:
+        print("Advertencia: duckdb no esta instalado, se usa pandas")
+        return None
@@ -0,0 +1,121 @@
+'''
+Este modulo permite compartir entre todas las sesiones de streamlit los data frames ya procesados.
+Cuando varios analistas abren el mismo archivo, el servidor guarda una sola copia en memoria:
+el registro usa como llave el contenido del archivo (ver cache_datos.clave_cache) y cada sesion
+guarda solo una referencia. Las entradas sin referencias se eliminan (LRU) cuando el total supera
+el limite de memoria configurado. Los data frames compartidos son de solo lectura, las sesiones
+deben trabajar sobre copias o vistas filtradas.
+'''
+import threading
+import time
+import weakref
+
+import pandas as pd
+
+
+def tamano_datos(datos):
+    '''
+    Retorna el tamaño en bytes de un data frame o de una tupla / lista de data frames.
+    '''
+    if isinstance(datos, pd.DataFrame):
+        return int(datos.memory_usage(deep=True).sum())
+    if isinstance(datos, (tuple, list)):
+        return sum(tamano_datos(elemento) for elemento in datos)
+    return 0
+
+
+class referencia_datos:
+    '''
+    Referencia de una sesion a una entrada del registro. Cuando la referencia se reemplaza
+    o la sesion termina, la entrada deja de contar como usada por esa sesion.
+    '''
+
+    def __init__(self, registro, clave, datos):
+        self.clave = clave
+        self.datos = datos
+        self._liberar = weakref.finalize(self, registro.liberar, clave)
+
+    def liberar(self):
+        self._liberar()
+
+
+class registro_datos:
+    '''
+    Registro en memoria de datos compartidos con conteo de referencias y expulsion LRU.
+    ARG: limite_mb: float memoria maxima de las entradas en MB
+    '''
+
+    def __init__(self, limite_mb=4096):
+        self.limite = limite_mb * 1024 * 1024
+        self._entradas = {}  # clave: {'datos', 'tamano', 'referencias', 'uso'}
+        self._bloqueo = threading.Lock()
+        self._cargas = {}  # clave: lock, evita que dos sesiones carguen el mismo archivo a la vez
+
+    def adquirir(self, clave, funcion_carga):
+        '''
+        Retorna una referencia a los datos de la llave, si no estan en el registro los carga.
+        ARG: clave: str llave del contenido (ej. clave_cache del archivo)
+            funcion_carga: funcion sin argumentos que retorna los datos
+        return: referencia_datos o los datos sin registrar si no son data frames (ej. advertencias)
+        '''
+        with self._bloqueo:
+            bloqueo_carga = self._cargas.setdefault(clave, threading.Lock())
+
+        try:
+            with bloqueo_carga:
+                with self._bloqueo:
+                    entrada = self._entradas.get(clave)
+                    if entrada is not None:
+                        return self._referenciar(clave, entrada)
+
+                datos = funcion_carga()
+                tamano = tamano_datos(datos)
+                if tamano == 0:
+                    return datos
+
+                with self._bloqueo:
+                    entrada = {'datos': datos, 'tamano': tamano, 'referencias': 0, 'uso': 0}
+                    self._entradas[clave] = entrada
+                    referencia = self._referenciar(clave, entrada)
+                    self._expulsar()
+                return referencia
+        finally:
+            # el lock de carga se retira tambien si la carga falla o no retorna data frames
+            with self._bloqueo:
+                if self._cargas.get(clave) is bloqueo_carga:
+                    self._cargas.pop(clave)
+
+    def _referenciar(self, clave, entrada):
+        entrada['referencias'] += 1
+        entrada['uso'] = time.monotonic()
+        return referencia_datos(self, clave, entrada['datos'])
+
+    def liberar(self, clave):
+        '''
+        Descuenta una referencia de la entrada (lo llama referencia_datos).
+        '''
+        with self._bloqueo:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                entrada['referencias'] = max(entrada['referencias'] - 1, 0)
+                self._expulsar()
+
+    def _expulsar(self):
+        total = sum(entrada['tamano'] for entrada in self._entradas.values())
+        libres = sorted((entrada['uso'], clave) for clave, entrada in self._entradas.items()
+                        if entrada['referencias'] == 0)
+        for _, clave in libres:
+            if total <= self.limite:
+                break
+            total -= self._entradas.pop(clave)['tamano']
+        if total > self.limite:
+            print(f"Advertencia: los datos en uso ({total / 1024 ** 2:,.0f} MB) superan el limite del registro")
+
+    def estado(self):
+        '''
+        Retorna un data frame con las entradas del registro (llave, MB, referencias).
+        '''
+        with self._bloqueo:
+            filas = [{'clave': clave, 'mb': entrada['tamano'] / 1024 ** 2, 'referencias': entrada['referencias']}
+                     for clave, entrada in self._entradas.items()]
+        return pd.DataFrame(filas, columns=['clave', 'mb', 'referencias'])
@@ -1,25 +1,37 @@
 '''
 Este modulo permite parametrizar 
 '''
-import yaml
 import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import plotly.express as px
 import numpy as np
+import pyarrow as pa
+from pandas.api.types import union_categoricals
+from scripts.configuracion import cargar_config
+from scripts.motor_sql import crear_motor, comparar_resultados
+from scripts import diagnostico
+from scripts.diagnostico import medir_etapa
+from scripts import columnar
 
-def cargar_config():
-    """
-    Carga el archivo de configuración (config.yml) en un objeto de Python.
-    El archivo de configuración debe estar en la carpeta "Insumos" en el directorio de trabajo actual.
-    Luego llama a la función menu() para mostrar el menú principal.
-    return: None
-    """
-    ruta_config  = os.path.join(os.getcwd(),'insumos', 'config.yml')
-    with open(ruta_config, 'r',encoding='utf-8') as file:
-        config = yaml.safe_load(file)
-    return config
+config = cargar_config()  # configuracion del proceso (se lee una sola vez, ver scripts.configuracion)
+motor = crear_motor(config)  # None: las agrupaciones se ejecutan en pandas (ver seccion motor del config)
 
-config = cargar_config()  # cargando el archivo de configuraciones para todas las funciones que la usen.
+
+def _ejecutar(metodo, referencia, *args):
+    '''
+    Ejecuta una operacion en el motor configurado o en pandas (implementacion de referencia).
+    ARG: metodo: str metodo del motor
+        referencia: funcion en pandas equivalente
+    '''
+    if motor is None:
+        return referencia(*args)
+    resultado = getattr(motor, metodo)(*args)
+    if motor.verificar:
+        comparar_resultados(resultado, referencia(*args), metodo, motor.tolerancia)
+    return resultado
 
 def limpiar_datos(df):
     """
@@ -37,140 +49,503 @@ def limpiar_datos(df):
     if columnas_faltantes:
         return (f"Advertencia: Faltan las siguientes columnas: {columnas_faltantes}")
     else:              
-        # Reemplazar NaN con 0 (para el caso de ventas no reportadas)
-        df.fillna(0, inplace=True)            
+        # Reemplazar NaN con 0 (para el caso de ventas no reportadas), solo en columnas numericas
+        # para que las columnas de texto conserven los nulos (ver balanced_score_fill: borrar_na)
+        columnas_numericas = df.select_dtypes(include='number').columns
+        df[columnas_numericas] = df[columnas_numericas].fillna(0)
         return None
 
-def cargar_datos(ruta_archivo,margen=False, col_usar=None, tipado_col = None,parse = None, nom_columnas=None):
+def _valor_celda(valor):
+    '''
+    Convierte el valor de una celda de openpyxl igual que lo hace pd.read_excel
+    (los flotantes enteros quedan como int y las celdas vacias como None)
+    '''
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    if valor == '':
+        return None
+    return valor
+
+
+def _tipar_bloque(filas, col_usar, tipado_col, indice_inicial):
+    '''
+    Construye el data frame de un bloque de filas aplicando el tipado de columnas.
+    ARG: filas: list de tuplas con los valores de las columnas col_usar
+        col_usar: list columnas
+        tipado_col: dict columna: tipo
+        indice_inicial: int numero de la primera fila del bloque
+    return: data frame
+    '''
+    df = pd.DataFrame.from_records(filas, columns=col_usar,
+                                   index=pd.RangeIndex(indice_inicial, indice_inicial + len(filas)))
+    return tipar_columnas(df, tipado_col)
+
+
+def tipar_columnas(df, tipado_col):
+    '''
+    Aplica el tipo de lectura a las columnas (los textos conservan los nulos). Las columnas que ya son
+    category (ej. diccionarios de un archivo arrow / parquet) se dejan como estan.
+    ARG: df: data frame
+        tipado_col: dict columna: tipo
+    return: data frame
+    '''
+    for columna, tipo in (tipado_col or {}).items():
+        if columna not in df.columns:
+            continue
+        if tipo in ('str', str):
+            if isinstance(df[columna].dtype, pd.CategoricalDtype):
+                continue
+            nulos = df[columna].isna()
+            df[columna] = df[columna].astype(str).where(~nulos, np.nan)
+        else:
+            df[columna] = df[columna].astype(tipo)
+    return df
+
+
+def leer_columnar(ruta_archivo, col_usar, tipado_col=None):
+    '''
+    Lee las columnas col_usar de un archivo parquet, arrow / feather o csv (ver scripts.columnar)
+    con los nombres del config y el tipo de lectura, igual que pd.read_excel en cargar_datos.
+    return: data frame (las columnas que no estan en el archivo se omiten, las reporta limpiar_datos)
+    '''
+    columnas = columnar.columnas_archivo(columnar.esquema(ruta_archivo, config), list(col_usar))
+    tipado_archivo = {columnas[col]: tipo for col, tipo in (tipado_col or {}).items() if col in columnas}
+    df = columnar.a_pandas(columnar.leer_tabla(ruta_archivo, config, list(columnas.values()), tipado_archivo))
+    df.columns = list(columnas.keys())
+    return tipar_columnas(df, tipado_col)
+
+
+def _bloques_columnares(ruta_archivo, columnas, col_usar, tipado_col, tamano_bloque):
+    '''
+    Bloques de un archivo columnar como data frames con los nombres del config y el tipo de lectura.
+    '''
+    tipado_archivo = {columnas[col]: tipo for col, tipo in (tipado_col or {}).items() if col in columnas}
+    inicio = 0
+    for tabla in columnar.iterar_bloques(ruta_archivo, config, [columnas[col] for col in col_usar],
+                                         tipado_archivo, tamano_bloque):
+        df = columnar.a_pandas(tabla)
+        df.columns = col_usar
+        df.index = pd.RangeIndex(inicio, inicio + len(df))
+        inicio += len(df)
+        yield tipar_columnas(df, tipado_col)
+    if inicio == 0:
+        yield _tipar_bloque([], col_usar, tipado_col, 0)
+
+
+def _bloques_excel(filas, posiciones, col_usar, tipado_col, tamano_bloque):
+    '''
+    Agrupa las filas de openpyxl en data frames de tamano_bloque filas con el tipo de lectura.
+    '''
+    bloque = []
+    inicio = 0
+    for fila in filas:
+        bloque.append(tuple(_valor_celda(fila[i]) if i < len(fila) else None for i in posiciones))
+        if len(bloque) >= tamano_bloque:
+            yield _tipar_bloque(bloque, col_usar, tipado_col, inicio)
+            inicio += len(bloque)
+            bloque = []
+    if bloque or inicio == 0:
+        yield _tipar_bloque(bloque, col_usar, tipado_col, inicio)
+
+
+@medir_etapa()
+def leer_balance_streaming(ruta_archivo, col_usar, tipado_col=None, parse=None, nom_columnas=None,
+                           tamano_bloque=50000, formato_fecha=None, tipos_compactos=None):
+    '''
+    Lee el balanced score fila por fila (openpyxl en modo solo lectura, o por lotes de filas si es un
+    archivo parquet, arrow o csv) y procesa bloques de tamano_bloque filas: seleccion de columnas, tipado, limpieza, fechas, nombres y las reglas
+    filtros / balanced_score_fill del config. La memoria depende del tamaño del bloque y no del archivo.
+    ARG: ruta_archivo: str o archivo
+        col_usar: list columnas a leer
+        tipado_col: dict columna: tipo
+        parse: str columna de fecha
+        nom_columnas: list nuevos nombres de las columnas
+        tamano_bloque: int filas por bloque
+        formato_fecha: str formato de la columna de fecha (None: se infiere)
+        tipos_compactos: dict columna: tipo en memoria (ver tipado_memoria)
+    return: data frame o str con la advertencia de columnas faltantes
+    '''
+    col_usar = list(col_usar)
+    columnas_esperadas = set(config['balanced_score_columnas'].keys())
+    if columnar.formato_archivo(ruta_archivo) is not None:
+        columnas = columnar.columnas_archivo(columnar.esquema(ruta_archivo, config), col_usar)
+        columnas_faltantes = columnas_esperadas - set(columnas)
+        if columnas_faltantes:
+            return (f"Advertencia: Faltan las siguientes columnas: {columnas_faltantes}")
+        bloques = _bloques_columnares(ruta_archivo, columnas, col_usar, tipado_col, tamano_bloque)
+        return _procesar_bloques(bloques, parse, nom_columnas, formato_fecha, tipos_compactos)
+
+    from openpyxl import load_workbook
+
+    libro = load_workbook(ruta_archivo, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        encabezado = [str(col).strip() if col is not None else '' for col in next(filas, ())]
+
+        columnas_faltantes = columnas_esperadas - set(encabezado)
+        if columnas_faltantes:
+            return (f"Advertencia: Faltan las siguientes columnas: {columnas_faltantes}")
+        posiciones = [encabezado.index(col) for col in col_usar]
+        bloques = _bloques_excel(filas, posiciones, col_usar, tipado_col, tamano_bloque)
+        return _procesar_bloques(bloques, parse, nom_columnas, formato_fecha, tipos_compactos)
+    finally:
+        libro.close()
+
+
+def _procesar_bloques(bloques, parse, nom_columnas, formato_fecha, tipos_compactos):
+    '''
+    Procesa cada bloque (ver _procesar_bloque) y concatena los resultados con el reporte de limpieza.
+    '''
+    procesados = []
+    reporte = {}
+    for bloque in bloques:
+        df_bloque, reporte_bloque = _procesar_bloque(bloque, parse, nom_columnas, formato_fecha, tipos_compactos)
+        procesados.append(df_bloque)
+        _sumar_reporte(reporte, reporte_bloque)
+    df = concatenar_bloques(procesados)
+    df.attrs['reporte_limpieza'] = reporte
+    return df
+
+
+def _sumar_reporte(reporte, reporte_bloque):
+    '''
+    Acumula en reporte las filas eliminadas por cada regla en un bloque.
+    '''
+    for regla, filas in reporte_bloque.items():
+        reporte[regla] = reporte.get(regla, 0) + filas
+
+
+def _procesar_bloque(df, parse, nom_columnas, formato_fecha, tipos_compactos):
+    '''
+    Aplica al bloque (ya tipado) los mismos pasos que cargar_datos y preprocess_dataframe.
+    '''
+    limpiar_datos(df)
+    if parse is not None:
+        df[parse] = parsear_fechas(df[parse], formato_fecha)
+    if nom_columnas is not None:
+        df.columns = nom_columnas
+    df, reporte = preprocess_dataframe(df, config)
+    return compactar_tipos(df, tipos_compactos), reporte
+
+
+def tipado_memoria(config):
+    '''
+    Retorna los tipos en memoria declarados en balanced_score_columnas (tercer elemento de cada columna),
+    por ejemplo category para columnas de texto con pocos valores distintos o float32 para numericas.
+    ARG: config: dict configuracion
+    return: dict nombre nuevo de la columna: tipo
+    '''
+    return {tipo[1]: tipo[2] for tipo in config['balanced_score_columnas'].values() if len(tipo) > 2}
+
+
+@medir_etapa()
+def compactar_tipos(df, tipos_compactos):
+    '''
+    Convierte las columnas del data frame a su tipo en memoria.
+    ARG: df: data frame
+        tipos_compactos: dict columna: tipo
+    return: data frame
+    '''
+    if not tipos_compactos:
+        return df
+    tipos = {col: tipo for col, tipo in tipos_compactos.items() if col in df.columns}
+    return df.astype(tipos)
+
+
+@medir_etapa()
+def parsear_fechas(serie, formato=None):
+    '''
+    Convierte una columna a fecha parseando una sola vez cada valor distinto
+    (ej. la columna Mes solo tiene tantos valores como meses) y replicando el resultado.
+    ARG: serie: pd.Series
+        formato: str formato de la fecha, None para inferirlo
+    return: pd.Series datetime
+    '''
+    codigos, unicos = pd.factorize(serie)
+    fechas = pd.DatetimeIndex(pd.to_datetime(unicos, format=formato))
+    fechas = fechas.take(codigos, allow_fill=True, fill_value=pd.NaT)
+    return pd.Series(fechas, index=serie.index, name=serie.name)
+
+
+def concatenar_bloques(bloques):
+    '''
+    Concatena data frames con las mismas columnas unificando las categorias de las columnas
+    category, para que el resultado conserve el tipo category (pd.concat lo convierte a object
+    cuando las categorias son distintas).
+    ARG: bloques: list de data frames
+    return: data frame
+    '''
+    if len(bloques) == 1:
+        return bloques[0]
+    for columna in bloques[0].columns:
+        if isinstance(bloques[0][columna].dtype, pd.CategoricalDtype):
+            categorias = union_categoricals([bloque[columna] for bloque in bloques],
+                                            sort_categories=True).categories
+            for bloque in bloques:
+                bloque[columna] = bloque[columna].cat.set_categories(categorias)
+    return pd.concat(bloques)
+
+
+def _extension(archivo):
+    # extension de una ruta o de un archivo cargado (atributo name)
+    return os.path.splitext(str(getattr(archivo, 'name', archivo)))[1].lower()
+
+
+@medir_etapa()
+def cargar_datos(ruta_archivo,margen=False, col_usar=None, tipado_col = None,parse = None, nom_columnas=None,
+                 streaming=False, tamano_bloque=50000, formato_fecha=None, tipos_compactos=None):
     """
-    Carga los datos desde un archivo Excel
+    Carga los datos desde un archivo Excel, parquet, arrow / feather o csv (ver scripts.columnar)
     arg: ruta_archivo: str
         margen by defect False,
         col_usar by defect None
         tipado_col by defect none
+        streaming: bool lee el balanced score por bloques (ver leer_balance_streaming),
+            en este caso el resultado ya tiene aplicados los filtros del config
+        tamano_bloque: int filas por bloque en modo streaming
+        formato_fecha: str formato de la columna parse, None para inferirlo
+        tipos_compactos: dict columna: tipo en memoria, se aplica despues de renombrar
     """  
    
     if margen== False:        
         try:
-            df = pd.read_excel(ruta_archivo,
-                            usecols=col_usar,
-                            dtype=tipado_col,
-                            )
+            if streaming and _extension(ruta_archivo) == '.xls':
+                # openpyxl no lee el formato .xls (excel 97-2003): se lee completo con pd.read_excel
+                print("Advertencia: la lectura por bloques requiere archivos xlsx, el archivo .xls se lee completo")
+                streaming = False
+            if streaming:
+                return leer_balance_streaming(ruta_archivo, col_usar, tipado_col, parse=parse,
+                                              nom_columnas=nom_columnas, tamano_bloque=tamano_bloque,
+                                              formato_fecha=formato_fecha, tipos_compactos=tipos_compactos)
+            if columnar.formato_archivo(ruta_archivo) is not None:
+                df = leer_columnar(ruta_archivo, col_usar, tipado_col)
+            else:
+                df = pd.read_excel(ruta_archivo,
+                                usecols=col_usar,
+                                dtype=tipado_col,
+                                )
             valida = limpiar_datos(df)
+            if valida is not None:
+                return valida
             if parse is not None:
-                df[parse] = pd.to_datetime(df[parse])           
+                df[parse] = parsear_fechas(df[parse], formato_fecha)
             if nom_columnas is not None:
                 df.columns = nom_columnas           
-            
-            if valida is None:
-                return df
-            else:
-                return valida
-            
+            return compactar_tipos(df, tipos_compactos)
+
         except Exception as e:
             print(f"Error al cargar el archivo: {e}")
             return None
     else:
         try:
-            lista_hojas = []
-            for hojas in config['config_margen'].keys():
-                lista_hojas.append(hojas)
-        
-            margen_sector = dfarchivoAFO(ruta_archivo,lista_hojas[0],config['config_margen'][lista_hojas[0]])
-            margen_marca = dfarchivoAFO(ruta_archivo,lista_hojas[1],config['config_margen'][lista_hojas[1]])
-            margen_material = dfarchivoAFO(ruta_archivo,lista_hojas[2],config['config_margen'][lista_hojas[2]])
+            paralelo = (config.get('lectura') or {}).get('margen_paralelo', True)
+            tablas, _ = cargar_margen(ruta_archivo, config['config_margen'], paralelo=paralelo)
+            margen_sector, margen_marca, margen_material = tablas.values()
             return margen_sector, margen_marca, margen_material
         except Exception as e:
             print(f"Error al cargar el archivo: {e}")
             return None
 
-def completar_meses_faltantes(df, var_categorica, var_numericas):
+@medir_etapa()
+def completar_meses_faltantes(df, var_categorica, var_numericas, col_fecha='mes'):
     """
-    Asegura que todas las marcas tengan registros para todos los meses.
-    Si falta algún mes, se asume que las ventas fueron 0.
+    Asegura que todos los grupos tengan registros para todos los meses entre el primer
+    y el ultimo mes de los datos. Si falta algún mes, se asume que las ventas fueron 0.
+    Se hace con un solo reindex sobre todas las combinaciones (grupo, mes).
 
     ARG: df: data frame 
-        var_categorica: str columna categorica
-        var_numericas: lista var numericas
+        var_categorica: str o lista columnas categoricas que definen el grupo
+        var_numericas: str o lista var numericas
+        col_fecha: str columna de fecha
+    return: data frame con una fila por grupo y mes (las filas repetidas se suman),
+        col_fecha queda como el primer dia del mes
     """
-    # Obtener lista única de marcas
-    categorias = df[var_categorica].unique()
-    
-    # Crear un DataFrame completo con todas las combinaciones de marca y mes
-    meses = range(1, 13)  # Meses 1 al 12
-    datos_completos = []
-    var_calculos = {clave: 0 for clave in var_numericas} # para marcar cada variable numerica con 0
-    for items in categorias:
-        for mes in meses:
-            fila = df[(df[var_categorica] == items) & (df['mes'] == mes)]
-            if len(fila) == 0:
-                # Si no existe este mes para esta marca, crear un registro con ventas = 0
-                datos_completos.append({
-                    var_categorica: items      
-                }.update(var_calculos))  # añade la informacion de cada variable numerica
-            else:
-                # Si ya existe, agregar la fila existente
-                datos_completos.append(fila.iloc[0].to_dict())
-    
-    # Crear un nuevo DataFrame con los datos completos
-    df_completo = pd.DataFrame(datos_completos)
+    if isinstance(var_categorica, str):
+        var_categorica = [var_categorica]
+    if isinstance(var_numericas, str):
+        var_numericas = [var_numericas]
+
+    periodos = pd.to_datetime(df[col_fecha]).dt.to_period('M')
+    agrupado = (df[var_categorica + var_numericas]
+                .assign(**{col_fecha: periodos})
+                .groupby(var_categorica + [col_fecha], observed=True)[var_numericas]
+                .sum())
+    if agrupado.empty:
+        return agrupado.reset_index()
+
+    # todas las combinaciones de los grupos existentes con todos los meses del rango
+    rango = pd.period_range(periodos.min(), periodos.max(), freq='M')
+    grupos = agrupado.index.droplevel(col_fecha).unique()
+    niveles = [grupos.get_level_values(i).repeat(len(rango)) for i in range(grupos.nlevels)]
+    niveles.append(rango.take(np.tile(np.arange(len(rango)), len(grupos))))
+    completo = pd.MultiIndex.from_arrays(niveles, names=var_categorica + [col_fecha])
+
+    df_completo = agrupado.reindex(completo, fill_value=0).reset_index()
+    df_completo[col_fecha] = df_completo[col_fecha].dt.to_timestamp()
     return df_completo
 
 
-
-
-
-def dfarchivoAFO(ruta:str,sheet_name:str,nombrecol:dict): 
+@medir_etapa()
+def dfarchivoAFO(ruta,sheet_name:str,nombrecol:dict): 
       '''
       Lee un archivo de excel que contiene una tabla extraida de AFO.
-      ARG: ruta: str
+      Las columnas se renombran y se tipan directamente al leer la hoja.
+      ARG: ruta: str, pd.ExcelFile ya abierto (para no volver a abrir el archivo por cada hoja)
+            o pa.Table del margen columnar (ver columnar.leer_hoja_margen)
             sheet_name : str: nombre de la hoja
             nombre_col : dict: con el nombre y tipo de dato de las columnas
       return : data frame
       '''      
-      df = pd.ExcelFile(ruta)
-      df = df.parse(sheet_name,dtype=str)
-      df.columns = nombrecol.keys() 
-      df = df.astype(nombrecol)
+      if isinstance(ruta, pa.Table):
+            return columnar.leer_hoja_margen(ruta, sheet_name, nombrecol)
+      libro = ruta if isinstance(ruta, pd.ExcelFile) else pd.ExcelFile(ruta)
+      df = libro.parse(sheet_name,
+                       header=0,
+                       usecols=list(range(len(nombrecol))),
+                       names=list(nombrecol.keys()),
+                       dtype=nombrecol)
       return df
 
+@medir_etapa()
+def cargar_margen(ruta_archivo, hojas_config, paralelo=True):
+      '''
+      Lee todas las hojas del archivo de margen abriendo el libro una sola vez,
+      las hojas se leen en paralelo (un hilo por hoja). Los archivos parquet, arrow o csv
+      tienen todas las hojas en una sola tabla con la columna hoja (ver scripts.columnar).
+      ARG: ruta_archivo: str o archivo
+            hojas_config: dict hoja: {columna: tipo} (config_margen)
+            paralelo: bool
+      return: tablas: dict hoja: data frame (en el orden del config)
+            tiempos: dict hoja: segundos de lectura
+      '''
+      if columnar.formato_archivo(ruta_archivo) is not None:
+            libro = columnar.leer_tabla(ruta_archivo, config, tipado=columnar.TIPADO_MARGEN)
+      else:
+            libro = pd.ExcelFile(ruta_archivo)
+
+      contexto_diagnostico = diagnostico.contexto()  # las mediciones de los hilos quedan en la ejecucion actual
+
+      def leer_hoja(hoja):
+            # el tiempo de cada hoja queda en el panel de diagnostico como la etapa 'hoja <nombre>'
+            with diagnostico.en_contexto(contexto_diagnostico), diagnostico.etapa(f'hoja {hoja}') as medicion:
+                  inicio = time.perf_counter()
+                  df = dfarchivoAFO(libro, hoja, hojas_config[hoja])
+                  medicion.filas = len(df)
+                  return df, time.perf_counter() - inicio
+
+      try:
+            if paralelo and len(hojas_config) > 1:
+                  with ThreadPoolExecutor(max_workers=len(hojas_config)) as ejecutor:
+                        resultados = list(ejecutor.map(leer_hoja, hojas_config.keys()))
+            else:
+                  resultados = [leer_hoja(hoja) for hoja in hojas_config.keys()]
+      finally:
+            if isinstance(libro, pd.ExcelFile):
+                  libro.close()
+
+      tablas = {hoja: df for hoja, (df, _) in zip(hojas_config.keys(), resultados)}
+      tiempos = {hoja: segundos for hoja, (_, segundos) in zip(hojas_config.keys(), resultados)}
+      return tablas, tiempos
+
+@medir_etapa()
 def valores_atipicos(df,columna):
     '''
     Permite exlcuir valores atipicos utilizando los quartiles
     arg: df: data frame
             columna str.  valor de la columna que se desea eliminar atipico
     '''
-    Q1 = df[columna].quantile(0.25)
-    Q3 = df[columna].quantile(0.75)
-    IQR = Q3 - Q1
-    limite_inferior = Q1 - 1.5 * IQR
-    limite_superior = Q3 + 1.5 * IQR
-    df = df[(df[columna] >= limite_inferior) & (df[columna] <= limite_superior)]
-    return df
+    return df[~marcar_atipicos(df, columna)]
 
 
+@medir_etapa()
+def marcar_atipicos(df, columna, grupos=None, factor=1.5, max_filas_grupo=None, semilla=0):
+    '''
+    Marca los valores atipicos de la columna, fuera de [Q1 - factor * IQR, Q3 + factor * IQR] de su grupo.
+    Los cuartiles de todos los grupos se calculan en una sola agrupacion y no se copia el data frame.
+    ARG: df: data frame
+        columna: str columna numerica
+        grupos: list columnas que definen los grupos (None: un solo grupo). Los registros sin grupo
+            usan los cuartiles de todo el data frame
+        factor: float veces el rango intercuartil
+        max_filas_grupo: int los grupos con mas registros usan cuartiles aproximados, calculados
+            con una muestra aleatoria de ese tamaño
+    return: serie booleana con el indice del df (True: atipico o sin valor)
+    '''
+    grupos = [grupos] if isinstance(grupos, str) else list(grupos or [])
+    muestra = df[grupos + [columna]]
+    if max_filas_grupo and len(df) > max_filas_grupo:
+        # orden aleatorio y a lo mas max_filas_grupo registros por grupo
+        muestra = muestra.iloc[np.random.default_rng(semilla).permutation(len(df))]
+        if grupos:
+            muestra = muestra[muestra.groupby(grupos, observed=True).cumcount().to_numpy() < max_filas_grupo]
+        else:
+            muestra = muestra.iloc[:max_filas_grupo]
+
+    q1, q3 = (np.full(len(df), cuartil) for cuartil in muestra[columna].quantile([0.25, 0.75]).to_numpy())
+    if grupos:
+        agrupado = muestra.groupby(grupos, observed=True)[columna]
+        q1_grupo, q3_grupo = agrupado.quantile(0.25), agrupado.quantile(0.75)
+        llaves = pd.MultiIndex.from_frame(df[grupos]) if len(grupos) > 1 else df[grupos[0]]
+        posiciones = q1_grupo.index.get_indexer(llaves)
+        con_grupo = posiciones >= 0
+        q1[con_grupo] = q1_grupo.to_numpy()[posiciones[con_grupo]]
+        q3[con_grupo] = q3_grupo.to_numpy()[posiciones[con_grupo]]
+
+    iqr = q3 - q1
+    valores = df[columna].to_numpy(dtype=float)
+    normales = (valores >= q1 - factor * iqr) & (valores <= q3 + factor * iqr)
+    return pd.Series(~normales, index=df.index, name='atipico')
+
+
+@medir_etapa()
 def preprocess_dataframe(df,config):
 
     '''
-    Funcion para ajustar el data frma
-    arg: df: data frame, a
+    Funcion para ajustar el data frame segun las secciones filtros y balanced_score_fill del config.
+    Todas las reglas se combinan en una sola mascara booleana, de esta forma el data frame
+    se copia una sola vez sin importar cuantos valores tenga cada filtro.
+    arg: df: data frame
         config: archivo de configuracion.
     return: df: data frame
+        reporte: dict regla: filas eliminadas por esa regla
     '''
-    # Eliminamos registros con valores nulos en region y negocio
-    df = df.dropna(subset=config['ajustes_balanced_scored'][0]['borrar_na'])
-    
-    # Ciclo para filtrar valores que no son necesarios en el analisis. (ver archivo config)
-    for key, value in  config['ajustes_balanced_scored'][2]['filtros'].items():
-        df = df[df[key] != value]
-    
-    # Imputamos los valores nulos según
-    for col in config['ajustes_balanced_scored'][1]['filla_na_0']:  
-        df[col] = df[col].fillna(0)
-           
-    return df
+    mascara = np.ones(len(df), dtype=bool)
+    # si el data frame ya fue filtrado (ej. lectura por bloques) se conserva su reporte
+    reporte = dict(df.attrs.get('reporte_limpieza', {}))
+
+    # filtros: se excluyen los valores de cada columna (un valor o una lista de valores)
+    for key, value in config['filtros'].items():
+        valores = value if isinstance(value, (list, tuple, set)) else [value]
+        regla = df[key].isin(valores).to_numpy()
+        reporte[f"filtro {key}"] = reporte.get(f"filtro {key}", 0) + int((regla & mascara).sum())
+        mascara &= ~regla
+
+    # registros con valores nulos que se deben eliminar
+    for key, value in config['balanced_score_fill'].items():
+        if key == 'borrar_na':
+            for col in value:
+                regla = df[col].isna().to_numpy()
+                reporte[f"nulos {col}"] = reporte.get(f"nulos {col}", 0) + int((regla & mascara).sum())
+                mascara &= ~regla
+
+    if mascara.all():
+        df = df.copy(deep=False)
+    else:
+        df = df.loc[mascara].copy(deep=False)
+        for col in df.select_dtypes(include='category').columns:
+            df[col] = df[col].cat.remove_unused_categories()
+
+    # Imputamos los valores nulos con 0 segun el config
+    for key, value in config['balanced_score_fill'].items():
+        if key != 'borrar_na':
+            for col in value:
+                df[col] = df[col].fillna(0)
 
+    df.attrs['reporte_limpieza'] = reporte
+    return df, reporte
 
+
+@medir_etapa()
 def create_grupped_df(df,var_cate,
                       var_num,
                       agrupa = True,
@@ -183,16 +558,21 @@ def create_grupped_df(df,var_cate,
 
     return pd.DataFrame
     '''
+    return _ejecutar('agrupar', _agrupar_pandas, df, var_cate, var_num, agrupa, sort_values)
+
+
+def _agrupar_pandas(df, var_cate, var_num, agrupa, sort_values):
     # Agrupamos por negocio y mes y sumamos las ventas en unidades del año anterior
     if agrupa == True:
-        monthly_sales = df.groupby(var_cate)[var_num].sum().reset_index()
+        monthly_sales = df.groupby(var_cate, observed=True)[var_num].sum().reset_index()
         monthly_sales = monthly_sales.sort_values(by=var_cate)
         return monthly_sales
     else:
-        monthly_sales = df.groupby(var_cate).agg(var_num).reset_index()
+        monthly_sales = df.groupby(var_cate, observed=True).agg(var_num).reset_index()
         monthly_sales = monthly_sales.sort_values(by=sort_values)
         return monthly_sales
 
+@medir_etapa()
 def calculo_variaciones(df, col_valor, col_grupo, col_fecha='fecha'):
 
     '''
@@ -206,9 +586,7 @@ def calculo_variaciones(df, col_valor, col_grupo, col_fecha='fecha'):
     if isinstance(col_grupo, str):
         col_grupo = [col_grupo]
     
-    df['anio_mes'] = pd.to_datetime(df[col_fecha]).dt.to_period('M')
-   
-    df_grouped = df.groupby(col_grupo + ['anio_mes'])[col_valor].sum().reset_index()
+    df_grouped = _ejecutar('agrupar_mensual', _agrupar_mensual_pandas, df, col_grupo, col_valor, col_fecha)
     
     ultimo_mes = df_grouped['anio_mes'].max()
     mes_anterior = ultimo_mes - 1
@@ -219,7 +597,8 @@ def calculo_variaciones(df, col_valor, col_grupo, col_fecha='fecha'):
     # Variación vs mes anterior
     df_pivot = df_grouped.pivot_table(index=col_grupo, 
                 columns='anio_mes', 
-                values=col_valor).sort_index(axis=1)# Calcular variaciones
+                values=col_valor,
+                observed=True).sort_index(axis=1)# Calcular variaciones
     
     resultado = pd.DataFrame(index=df_pivot.index)
     
@@ -249,9 +628,19 @@ def calculo_variaciones(df, col_valor, col_grupo, col_fecha='fecha'):
         (df_pivot.get(ultimo_mes, np.nan) - df_pivot.get(mismo_mes_anio_anterior, np.nan)) 
         / df_pivot.get(mismo_mes_anio_anterior, np.nan)
     )
+    # un mes anterior en 0 genera divisiones por cero, se dejan como nulas
+    resultado = resultado.replace([np.inf, -np.inf], np.nan)
     resultado = resultado.reset_index()
     return resultado
 
+def _agrupar_mensual_pandas(df, col_grupo, col_valor, col_fecha):
+    anio_mes = pd.to_datetime(df[col_fecha]).dt.to_period('M').rename('anio_mes')
+    return df.groupby(col_grupo + [anio_mes], observed=True)[col_valor].sum().reset_index()
+
+_cache_figuras = OrderedDict()  # llave (datos + parametros del grafico): figura
+_bloqueo_figuras = threading.Lock()
+
+
 class creacion_graficos:
     '''
     Clase para construccion de grafico. 
@@ -260,19 +649,78 @@ class creacion_graficos:
         y_label: str valor eje y
         heu: str categorias
         titulo: str
+        top_n: int barras a mostrar, el resto se agrupa en "Otros" (None: seccion graficos del config)
+        agregado_otros: str como se agrupan las barras de "Otros" ('sum' o 'mean')
+        extremos: bool muestra las categorias con mayor y con menor valor (mitad y mitad) y agrupa
+            las del medio en "Otros" (ej. margenes, donde interesan tambien los mas bajos)
+    Las figuras se guardan en un cache por contenido de los datos y parametros del grafico,
+    las series grandes usan WebGL y las barras se limitan a top_n y al tamaño maximo (max_kb).
     return fig
     '''
 
-    def __init__(self, df,x_label , y_label, heu, titulo ):
+    def __init__(self, df,x_label , y_label, heu, titulo, top_n=None, agregado_otros='sum', extremos=False):
         self.df = df
         self.x_label = x_label
         self.y_label = y_label
         self.heu = heu
         self.titulo = titulo
+        self.config_graficos = config.get('graficos') or {}
+        self.top_n = top_n if top_n is not None else self.config_graficos.get('top_n')
+        self.agregado_otros = agregado_otros
+        self.extremos = extremos
 
+    def _figura_cache(self, tipo, construir):
+        '''
+        Retorna la figura del cache o la construye y la guarda (expulsion LRU).
+        '''
+        tamano_cache = self.config_graficos.get('cache_figuras', 64)
+        clave = (tipo, self.x_label, self.y_label, self.heu, self.titulo, self.top_n, self.agregado_otros, self.extremos,
+                 tuple(self.df.columns), len(self.df),
+                 int(pd.util.hash_pandas_object(self.df, index=False).sum()))
+        with _bloqueo_figuras:
+            if clave in _cache_figuras:
+                _cache_figuras.move_to_end(clave)
+                return _cache_figuras[clave]
+        fig = construir()
+        with _bloqueo_figuras:
+            _cache_figuras[clave] = fig
+            while len(_cache_figuras) > tamano_cache:
+                _cache_figuras.popitem(last=False)
+        return fig
 
+    def _agrupar_otros(self, df, top_n):
+        '''
+        Deja las top_n categorias con mayor valor (o las de mayor y menor valor si extremos)
+        y agrupa el resto en "Otros".
+        '''
+        es_numerico_x = pd.api.types.is_numeric_dtype(df[self.x_label])
+        categoria, valor = (self.y_label, self.x_label) if es_numerico_x else (self.x_label, self.y_label)
+        if top_n is None or df[categoria].nunique() <= top_n:
+            return df
+        df = df[[categoria, valor]].copy()
+        df[categoria] = df[categoria].astype(str)
+        por_categoria = df.groupby(categoria)[valor].agg(self.agregado_otros)
+        if self.extremos:
+            principales = por_categoria.nlargest(top_n - top_n // 2).index.union(
+                por_categoria.nsmallest(top_n // 2).index, sort=False)
+        else:
+            principales = por_categoria.nlargest(top_n).index
+        otros = por_categoria.drop(principales)
+        resultado = df[df[categoria].isin(principales)]
+        fila_otros = pd.DataFrame({categoria: [f"Otros ({len(otros)})"],
+                                   valor: [otros.sum() if self.agregado_otros == 'sum' else
+                                           df.loc[~df[categoria].isin(principales), valor].mean()]})
+        return pd.concat([resultado, fila_otros], ignore_index=True)
+
+    @medir_etapa()
     def create_line_chart(self):       
-         
+        return self._figura_cache('linea', self._create_line_chart)
+
+    def _create_line_chart(self):
+        import plotly.express as px  # plotly se importa con el primer grafico (arranque mas rapido)
+
+        # con muchos puntos la linea se dibuja con WebGL (scattergl)
+        render_mode = 'webgl' if len(self.df) > self.config_graficos.get('puntos_webgl', 1000) else 'svg'
         # Gráfico de lineas por mes y negocio
         fig = px.line(
             self.df,
@@ -281,6 +729,7 @@ class creacion_graficos:
             color=self.heu,  # Cada negocio una línea distinta
             markers=True,     # Opcional: puntos en cada mes
             line_shape='linear',  # Forzamos línea continua (opcional, pero ayuda)
+            render_mode=render_mode,
         )
         fig.update_layout(
             title=self.titulo,
@@ -293,9 +742,25 @@ class creacion_graficos:
         )
         return fig
 
+    @medir_etapa()
     def create_bar_chart(self): 
+        return self._figura_cache('barras', self._create_bar_chart)
+
+    def _create_bar_chart(self):
+        max_bytes = self.config_graficos.get('max_kb', 1024) * 1024
+        top_n = self.top_n
+        while True:
+            fig = self._barras(self._agrupar_otros(self.df, top_n))
+            # si la figura supera el tamaño maximo se reduce el numero de barras
+            if top_n == 1 or len(fig.to_json()) <= max_bytes:
+                return fig
+            top_n = max(1, (top_n or len(self.df)) // 2)
+
+    def _barras(self, df):
+        import plotly.express as px
+
         fig = px.bar(
-        self.df,
+        df,
         x=self.x_label,
         y=self.y_label,
         color=self.x_label,
@@ -323,6 +788,7 @@ class agrupaciones_calculos:
         self.df_principal = df_principal
 
     
+    @medir_etapa()
     def tabla_metricas(self,var_categoricas, var_numerica):
         
         '''
@@ -330,7 +796,13 @@ class agrupaciones_calculos:
         ARG: car_categoricas: variable Categorica
             var_numerica: str: variable numerica
         '''
-        self.df_principal = self.df_principal.groupby([var_categoricas]).agg(
+        self.df_principal = _ejecutar('tabla_metricas', self._tabla_metricas_pandas,
+                                      self.df_principal, var_categoricas, var_numerica)
+        return self.df_principal
+
+    @staticmethod
+    def _tabla_metricas_pandas(df, var_categoricas, var_numerica):
+        return df.groupby([var_categoricas], observed=True).agg(
         total = (var_numerica,'sum'),
         media = (var_numerica,'mean'),
         desviacion = (var_numerica,'std'),
@@ -338,8 +810,6 @@ class agrupaciones_calculos:
         minimo = (var_numerica,'min'),
         maximo = (var_numerica,'max')
         ).reset_index().sort_values('total',ascending=False)
-
-        return self.df_principal
     
     @classmethod
     def transformaciones(cls,valor,decimales=1, mmill=True):
@@ -353,6 +823,7 @@ class agrupaciones_calculos:
         else:
             return f"{valor / 1e8:.{decimales}f} mill"
 
+    @medir_etapa()
     def combinar_tablas(self, df_auxiliar, union, cardinal = 'left'):
         '''
         Metodo para realizar merge entre data frame
@@ -360,15 +831,17 @@ class agrupaciones_calculos:
                 union: list: variables a uniir
                 cardinal: str, cardinalidad
         '''
-     
+        self.df_principal = _ejecutar('combinar', self._combinar_pandas,
+                                      self.df_principal, df_auxiliar, union, cardinal)
+        return self.df_principal
+
+    @staticmethod
+    def _combinar_pandas(df, df_auxiliar, union, cardinal):
         if len(union) == 1:
-            self.df_principal  = pd.merge(self.df_principal,
-                                      df_auxiliar, on = union[0], how= cardinal)          
-            return self.df_principal          
+            return pd.merge(df, df_auxiliar, on = union[0], how= cardinal)
         else:
-            self.df_principal  = pd.merge(self.df_principal,
-                                      df_auxiliar, left_on= union[0],
-                                      right_on= union[1],
-                                      how= cardinal)   
-            return self.df_principal
+            return pd.merge(df, df_auxiliar, left_on= union[0],
+                            right_on= union[1],
+                            how= cardinal)
+
     
@@ -0,0 +1,334 @@
+'''
+Validacion previa de los archivos cargados: lee solo el encabezado y una muestra de filas de cada
+hoja (el xml de cada hoja del xlsx por partes, o el primer lote de filas de un archivo parquet, arrow o csv) y revisa columnas, tipos, el formato de la columna de fechas
+y las hojas del margen contra el config. De esta forma los errores se reportan al cargar el archivo,
+sin esperar a que se lea el archivo completo.
+En xlsx de la tabla de textos compartidos (sharedStrings.xml) solo se guardan los textos que usa la
+muestra y se deja de leer despues del ultimo de ellos (openpyxl carga la tabla completa al abrir el libro).
+'''
+import os
+import posixpath
+import re
+import warnings
+import zipfile
+import xml.etree.ElementTree as ET
+
+TIPOS_NUMERICOS = ('float', 'float64', 'float32', 'int', 'int64', 'int32', 'Int64')
+EXTENSIONES_OPENPYXL = ('.xlsx', '.xlsm')
+
+
+def _es_numero(valor):
+    if valor is None or (isinstance(valor, (int, float)) and not isinstance(valor, bool)):
+        return True
+    try:
+        float(str(valor).replace(',', '.'))
+        return True
+    except ValueError:
+        return False
+
+
+def leer_muestra(archivo, filas=200, config=None):
+    '''
+    Lee el encabezado y las primeras filas de cada hoja sin leer el archivo completo.
+    ARG: archivo: str ruta u objeto tipo archivo (ej. UploadedFile de streamlit)
+        filas: int filas de la muestra por hoja
+        config: dict configuracion (separador de los csv)
+    return: dict hoja: (list encabezado, list de tuplas con las filas de la muestra)
+    '''
+    nombre = getattr(archivo, 'name', archivo)
+    extension = os.path.splitext(str(nombre))[1].lower()
+    posicion = archivo.tell() if hasattr(archivo, 'tell') else None
+    try:
+        from scripts import columnar
+
+        if columnar.formato_archivo(archivo) is not None:
+            return columnar.muestra(archivo, config or {}, filas)
+        if extension in EXTENSIONES_OPENPYXL:
+            return muestra_xlsx(archivo, filas)
+        # otros formatos (ej. xls): pandas lee solo las filas de la muestra
+        import pandas as pd
+
+        hojas = pd.read_excel(archivo, sheet_name=None, nrows=filas, dtype=object)
+        return {hoja: ([str(col).strip() for col in df.columns],
+                       [tuple(None if pd.isna(valor) else valor for valor in fila) for fila in df.itertuples(index=False)])
+                for hoja, df in hojas.items()}
+    finally:
+        if posicion is not None:
+            archivo.seek(posicion)
+
+
+def _local(etiqueta):
+    # nombre de la etiqueta sin el espacio de nombres ({http://...}row -> row)
+    return etiqueta.rsplit('}', 1)[-1]
+
+
+def _columna(referencia):
+    # posicion (desde 0) de la columna de una referencia de celda (ej. 'AB12' -> 27)
+    posicion = 0
+    for letra in referencia:
+        if not letra.isalpha():
+            break
+        posicion = posicion * 26 + ord(letra.upper()) - 64
+    return posicion - 1
+
+
+def _hojas_xlsx(libro):
+    '''
+    Nombre y ruta dentro del zip de cada hoja de calculo, en el orden del libro, y si el libro usa fechas 1904.
+    '''
+    relaciones = {}
+    for relacion in ET.fromstring(libro.read('xl/_rels/workbook.xml.rels')):
+        if relacion.get('Type', '').endswith('/worksheet'):
+            destino = relacion.get('Target')
+            ruta = destino.lstrip('/') if destino.startswith('/') else posixpath.normpath(posixpath.join('xl', destino))
+            relaciones[relacion.get('Id')] = ruta
+    hojas = []
+    fecha_1904 = False
+    for elemento in ET.fromstring(libro.read('xl/workbook.xml')).iter():
+        if _local(elemento.tag) == 'workbookPr':
+            fecha_1904 = elemento.get('date1904') in ('1', 'true')
+        elif _local(elemento.tag) == 'sheet':
+            id_relacion = next((valor for nombre, valor in elemento.attrib.items() if _local(nombre) == 'id'), None)
+            if id_relacion in relaciones:
+                hojas.append((elemento.get('name'), relaciones[id_relacion]))
+    return hojas, fecha_1904
+
+
+def _estilos_fecha(libro):
+    '''
+    Posiciones de los estilos de celda (cellXfs) con formato de fecha o de duracion.
+    return: dict posicion del estilo: 'fecha' o 'duracion'
+    '''
+    from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+
+    if 'xl/styles.xml' not in libro.namelist():
+        return {}
+    raiz = ET.fromstring(libro.read('xl/styles.xml'))
+    formatos = dict(BUILTIN_FORMATS)
+    for elemento in raiz.iter():
+        if _local(elemento.tag) == 'numFmt':
+            formatos[int(elemento.get('numFmtId'))] = elemento.get('formatCode')
+    estilos = {}
+    for seccion in raiz:
+        if _local(seccion.tag) != 'cellXfs':
+            continue
+        for posicion, xf in enumerate(seccion):
+            formato = formatos.get(int(xf.get('numFmtId', 0)))
+            if formato and is_timedelta_format(formato):
+                estilos[posicion] = 'duracion'
+            elif formato and is_date_format(formato):
+                estilos[posicion] = 'fecha'
+    return estilos
+
+
+def _filas_hoja(libro, ruta, filas):
+    '''
+    Primeras filas de la hoja leyendo el xml por partes, sin convertir los valores.
+    return: list de listas (tipo, estilo, texto) por celda, None para las celdas vacias
+    '''
+    resultado = []
+    with libro.open(ruta) as xml:
+        for _, elemento in ET.iterparse(xml, events=('end',)):
+            if _local(elemento.tag) != 'row':
+                continue
+            numero = int(elemento.get('r', len(resultado) + 1))
+            while len(resultado) < min(numero - 1, filas):
+                resultado.append([])  # filas vacias que no estan en el xml
+            if len(resultado) >= filas:
+                break
+            fila = []
+            for celda in elemento:
+                if _local(celda.tag) != 'c':
+                    continue
+                posicion = _columna(celda.get('r')) if celda.get('r') else len(fila)
+                fila.extend([None] * (posicion - len(fila)))
+                texto = None
+                for hijo in celda:
+                    if _local(hijo.tag) == 'v':
+                        texto = hijo.text
+                    elif _local(hijo.tag) == 'is':
+                        texto = ''.join(t.text or '' for t in hijo.iter() if _local(t.tag) == 't')
+                fila.append((celda.get('t', 'n'), int(celda.get('s', 0)), texto))
+            resultado.append(fila)
+            elemento.clear()
+            if len(resultado) >= filas:
+                break
+    return resultado
+
+
+def _textos_compartidos(libro, indices, tamano_bloque=1024 * 1024):
+    '''
+    Textos de la tabla de textos compartidos en las posiciones pedidas. La tabla se lee por bloques de bytes:
+    en los bloques sin posiciones pedidas solo se cuentan los elementos (si), solo se interpretan como xml
+    los textos pedidos y se deja de leer despues de la ultima posicion pedida.
+    return: dict posicion: texto
+    '''
+    if not indices or 'xl/sharedStrings.xml' not in libro.namelist():
+        return {}
+    ultimo = max(indices)
+    textos = {}
+    posicion = 0
+    resto = b''
+    prefijo = None
+    with libro.open('xl/sharedStrings.xml') as xml:
+        while posicion <= ultimo:
+            bloque = xml.read(tamano_bloque)
+            if not bloque:
+                break
+            datos = resto + bloque
+            if prefijo is None:
+                # algunos libros usan un prefijo en las etiquetas (ej. <x:si>)
+                encontrado = re.search(rb'<(\w+:)?sst\b', datos)
+                if encontrado is None:
+                    resto = datos
+                    continue
+                prefijo = encontrado.group(1) or b''
+                cierre = b'</' + prefijo + b'si>'
+                vacio = b'<' + prefijo + b'si/>'
+                elemento = re.compile(rb'<' + re.escape(prefijo) + rb'si\b(?:[^>]*?/>|.*?' + re.escape(cierre) + rb')', re.S)
+                declaracion = (b' xmlns:' + prefijo[:-1] + b'="s"') if prefijo else b''
+            fines = [datos.rfind(etiqueta) + len(etiqueta) for etiqueta in (cierre, vacio) if etiqueta in datos]
+            if not fines:
+                resto = datos
+                continue
+            fin = max(fines)
+            completos, resto = datos[:fin], datos[fin:]
+            cantidad = completos.count(cierre) + completos.count(vacio)
+            if any(posicion <= indice < posicion + cantidad for indice in indices):
+                for desplazamiento, coincidencia in enumerate(elemento.finditer(completos)):
+                    if posicion + desplazamiento in indices:
+                        si = ET.fromstring(b'<r' + declaracion + b'>' + coincidencia.group(0) + b'</r>')[0]
+                        # texto simple (t) o con formato (r/t), sin la guia fonetica (rPh)
+                        partes = [hijo for hijo in si if _local(hijo.tag) in ('t', 'r')]
+                        textos[posicion + desplazamiento] = ''.join(t.text or '' for parte in partes for t in parte.iter()
+                                                                    if _local(t.tag) == 't')
+            posicion += cantidad
+    return textos
+
+
+def _valor_celda(celda, textos, estilos, fecha_1904):
+    '''
+    Valor de la celda como lo retorna openpyxl (data_only): numero, texto, booleano o fecha.
+    '''
+    if celda is None:
+        return None
+    tipo, estilo, texto = celda
+    if texto is None:
+        return None
+    if tipo == 's':
+        return textos.get(int(texto))
+    if tipo in ('str', 'inlineStr', 'e'):
+        return texto
+    if tipo == 'b':
+        return texto in ('1', 'true')
+    if tipo == 'd':
+        from openpyxl.utils.datetime import from_ISO8601
+
+        return from_ISO8601(texto)
+    numero = float(texto)
+    if estilo in estilos:
+        from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel
+
+        epoca = CALENDAR_MAC_1904 if fecha_1904 else CALENDAR_WINDOWS_1900
+        return from_excel(numero, epoca, timedelta=estilos[estilo] == 'duracion')
+    return int(numero) if numero.is_integer() and 'E' not in texto.upper() and '.' not in texto else numero
+
+
+def muestra_xlsx(archivo, filas=200):
+    '''
+    Encabezado y primeras filas de cada hoja de un xlsx: se abre el zip y solo se lee el inicio del xml
+    de cada hoja y los textos compartidos que usan esas filas, el tiempo no depende del tamaño del libro
+    (salvo si la muestra usa textos del final de la tabla de textos compartidos).
+    return: dict hoja: (list encabezado, list de tuplas con las filas de la muestra)
+    '''
+    with zipfile.ZipFile(archivo) as libro:
+        hojas, fecha_1904 = _hojas_xlsx(libro)
+        estilos = _estilos_fecha(libro)
+        crudas = {nombre: _filas_hoja(libro, ruta, filas + 1) for nombre, ruta in hojas}
+        indices = {int(celda[2]) for filas_hoja in crudas.values() for fila in filas_hoja for celda in fila
+                   if celda is not None and celda[0] == 's' and celda[2] is not None}
+        textos = _textos_compartidos(libro, indices)
+    muestra = {}
+    for nombre, filas_hoja in crudas.items():
+        valores = [tuple(_valor_celda(celda, textos, estilos, fecha_1904) for celda in fila) for fila in filas_hoja]
+        encabezado = [str(col).strip() if col is not None else '' for col in (valores[0] if valores else ())]
+        muestra[nombre] = (encabezado, valores[1:])
+    return muestra
+
+
+def validar_balance(archivo, config, filas=200):
+    '''
+    Valida el balanced score contra balanced_score_columnas (columnas y tipos numericos)
+    y el formato de la columna de fechas (formato_fechas), usando solo una muestra.
+    return: list de errores (vacia si la muestra es valida)
+    '''
+    try:
+        encabezado, muestra = next(iter(leer_muestra(archivo, filas, config).values()), ([], []))
+    except Exception as e:
+        return [f"No fue posible leer el archivo: {e}"]
+
+    columnas = config['balanced_score_columnas']
+    columnas_faltantes = [col for col in columnas if col not in encabezado]
+    if columnas_faltantes:
+        return [f"Faltan las siguientes columnas: {columnas_faltantes}"]
+    if not muestra:
+        return ["El archivo no tiene registros"]
+
+    errores = []
+    for col, tipo in columnas.items():
+        if str(tipo[0]) not in TIPOS_NUMERICOS:
+            continue
+        posicion = encabezado.index(col)
+        for numero, fila in enumerate(muestra, start=2):
+            valor = fila[posicion] if posicion < len(fila) else None
+            if not _es_numero(valor):
+                errores.append(f"La columna {col} debe ser numerica (fila {numero}: {valor!r})")
+                break
+
+    col_fecha = config['columnas_fechas'][0]
+    formato = (config.get('formato_fechas') or {}).get(col_fecha)
+    posicion = encabezado.index(col_fecha)
+    valores = [fila[posicion] for fila in muestra if posicion < len(fila) and fila[posicion] is not None]
+    if valores:
+        import pandas as pd
+
+        with warnings.catch_warnings():
+            # sin formato_fechas pandas infiere el formato y advierte si lo hace fila por fila
+            warnings.simplefilter('ignore', UserWarning)
+            fechas = pd.to_datetime(pd.Series(valores).astype(str), format=formato, errors='coerce')
+        if fechas.isna().any():
+            invalido = valores[int(fechas.isna().to_numpy().argmax())]
+            errores.append(f"La columna {col_fecha} no tiene el formato de fecha esperado "
+                           f"({formato or 'inferido'}), ej. {invalido!r}")
+    return errores
+
+
+def validar_margen(archivo, config, filas=200):
+    '''
+    Valida que el archivo de margen tenga las hojas de config_margen, con sus columnas
+    (se leen por posicion) y margenes numericos en la muestra.
+    return: list de errores (vacia si la muestra es valida)
+    '''
+    try:
+        muestra = leer_muestra(archivo, filas, config)
+    except Exception as e:
+        return [f"No fue posible leer el archivo: {e}"]
+
+    errores = []
+    for hoja, columnas in config['config_margen'].items():
+        if hoja not in muestra:
+            errores.append(f"Falta la hoja {hoja} (hojas del archivo: {list(muestra)})")
+            continue
+        encabezado, filas_hoja = muestra[hoja]
+        if len([col for col in encabezado if col]) < len(columnas):
+            errores.append(f"La hoja {hoja} debe tener {len(columnas)} columnas: {list(columnas)}")
+            continue
+        for posicion, (col, tipo) in enumerate(columnas.items()):
+            if str(tipo) not in TIPOS_NUMERICOS:
+                continue
+            for numero, fila in enumerate(filas_hoja, start=2):
+                valor = fila[posicion] if posicion < len(fila) else None
+                if not _es_numero(valor):
+                    errores.append(f"La columna {col} de la hoja {hoja} debe ser numerica (fila {numero}: {valor!r})")
+                    break
+    return errores
@@ -0,0 +1,109 @@
+'''
+Este modulo calcula variaciones de ventas para cualquier conjunto de ventanas y cualquier mes de referencia.
+Las ventas se organizan una sola vez en una matriz (grupo x mes) con sus sumas acumuladas,
+de esta forma cada consulta (ventanas, mes de referencia) es una resta de columnas por grupo
+y no requiere volver a agrupar ni pivotear el data frame.
+'''
+import numpy as np
+import pandas as pd
+
+from scripts.diagnostico import medir_etapa
+
+# nombre de la variacion: [meses atras donde inicia la ventana, numero de meses de la ventana]
+# (equivalentes a las variaciones de calculo_variaciones)
+VENTANAS_DEFECTO = {
+    'var_ultimo_mes': [1, 1],
+    'var_ultimo_trimestre': [2, 3],
+    'var_vs_prom_semestre': [1, 6],
+    'var_vs_mismo_mes_anterior': [12, 1],
+}
+
+
+class motor_variaciones:
+    '''
+    Matriz de ventas mensuales por grupo con sumas acumuladas.
+    ARG: df: data frame (ej. el cubo de ventas)
+        col_valor: str columna numerica
+        col_grupo: str o list columnas que definen el grupo (marca, negocio, cod_material...)
+        col_fecha: str columna de fecha
+    Los meses sin ventas de un grupo cuentan como 0 (ver completar_meses_faltantes).
+    '''
+
+    @medir_etapa('motor_variaciones')
+    def __init__(self, df, col_valor, col_grupo, col_fecha='mes'):
+        if isinstance(col_grupo, str):
+            col_grupo = [col_grupo]
+        self.col_grupo = col_grupo
+        self.col_valor = col_valor
+
+        periodos = pd.to_datetime(df[col_fecha]).dt.to_period('M')
+        agrupado = (df[col_grupo + [col_valor]]
+                    .assign(anio_mes=periodos)
+                    .groupby(col_grupo + ['anio_mes'], observed=True)[col_valor]
+                    .sum())
+        self.grupos = agrupado.index.droplevel('anio_mes').unique()
+
+        if agrupado.empty:
+            self.meses = pd.PeriodIndex([], freq='M')
+            self.matriz = np.zeros((0, 0))
+        else:
+            meses_datos = agrupado.index.get_level_values('anio_mes')
+            self.meses = pd.period_range(meses_datos.min(), meses_datos.max(), freq='M')
+            filas = self.grupos.get_indexer(agrupado.index.droplevel('anio_mes'))
+            columnas = self.meses.get_indexer(meses_datos)
+            self.matriz = np.zeros((len(self.grupos), len(self.meses)))
+            self.matriz[filas, columnas] = agrupado.to_numpy(dtype=float)
+
+        # acumulado[:, j] = suma de los meses anteriores a j
+        self.acumulado = np.zeros((len(self.grupos), len(self.meses) + 1))
+        np.cumsum(self.matriz, axis=1, out=self.acumulado[:, 1:])
+
+    def _posicion(self, mes_ref=None):
+        '''
+        Retorna la posicion del mes de referencia (por defecto el ultimo mes).
+        '''
+        if mes_ref is None:
+            return len(self.meses) - 1
+        return self.meses.get_loc(pd.Period(mes_ref, freq='M'))
+
+    def promedio_ventana(self, inicio, largo, mes_ref=None):
+        '''
+        Promedio por grupo de los meses mes_ref - inicio - largo + 1 ... mes_ref - inicio.
+        ARG: inicio: int meses atras donde termina la ventana (0 es el mes de referencia)
+            largo: int numero de meses
+            mes_ref: str o pd.Period mes de referencia
+        return: np.array con el promedio (nan si la ventana sale del rango de los datos)
+        '''
+        fin = self._posicion(mes_ref) - inicio
+        comienzo = fin - largo + 1
+        if comienzo < 0 or fin >= len(self.meses):
+            return np.full(len(self.grupos), np.nan)
+        return (self.acumulado[:, fin + 1] - self.acumulado[:, comienzo]) / largo
+
+    def promedio_movil(self, largo, mes_ref=None):
+        '''
+        Promedio movil de largo meses terminando en el mes de referencia.
+        return: pd.Series por grupo
+        '''
+        return pd.Series(self.promedio_ventana(0, largo, mes_ref), index=self.grupos,
+                         name=f"prom_movil_{largo}m")
+
+    @medir_etapa()
+    def variaciones(self, ventanas=None, mes_ref=None):
+        '''
+        Variacion de las ventas del mes de referencia contra el promedio de cada ventana.
+        ARG: ventanas: dict nombre: [inicio, largo] (por defecto VENTANAS_DEFECTO)
+            mes_ref: str o pd.Period mes de referencia (por defecto el ultimo mes)
+        return: data frame con las columnas del grupo, ventas_ultimo_mes y una columna por ventana
+        '''
+        ventanas = VENTANAS_DEFECTO if ventanas is None else ventanas
+        resultado = pd.DataFrame(index=self.grupos)
+        actual = self.promedio_ventana(0, 1, mes_ref)
+        resultado['ventas_ultimo_mes'] = actual
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for nombre, (inicio, largo) in ventanas.items():
+                base = self.promedio_ventana(inicio, largo, mes_ref)
+                variacion = (actual - base) / base
+                variacion[~np.isfinite(variacion)] = np.nan
+                resultado[nombre] = variacion
+        return resultado.reset_index()